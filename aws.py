@@ -9,6 +9,7 @@ import paramiko
 import command
 import cctestbedv2 as cctestbed
 import cctestbed_generate_experiments as generate_experiments
+from cctestbed_pipeline import ExperimentPipeline
 from contextlib import contextmanager, ExitStack
 import getpass
 import glob
@@ -312,9 +313,8 @@ def get_ec2_experiments(instance, ec2, region):
     return experiments
 
 def _run_ec2_experiments(experiments, instance):
-    completed_experiment_procs = []
     logging.info('Going to run {} experiments.'.format(len(experiments)))
-    with add_nat_rule(instance):
+    with ExperimentPipeline() as pipeline, add_nat_rule(instance):
         for experiment in experiments.values():
             while True:
                 try:
@@ -323,13 +323,7 @@ def _run_ec2_experiments(experiments, instance):
                 except paramiko.ssh_exception.NoValidConnectionsError as e:
                     logging.warning('Could not connect to instance. Waiting 30s and retrying.')
                     time.sleep(30)
-            completed_experiment_procs.append(proc)
-
-    for proc in completed_experiment_procs:
-        logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
-        proc.wait()
-        if proc.returncode != 0:
-            logging.warning('Error running cmd PID={}'.format(proc.pid))
+            pipeline.submit(proc)
 
 # for aws experiments use icmp ping
 def get_ping_rtt(instance_ip):
@@ -512,22 +506,17 @@ def _get_taro_experiments(tarfile_localpath):
 
 def main():
     experiments = get_taro_experiments()
-    completed_experiment_procs = []
     logging.info('Going to run {} experiments.'.format(len(experiments)))
     num_experiments = len(experiments.values())
     current_experiment = 1
-    for repeat in range(0,10):
-        for experiment in experiments.values():
-            print('Running experiment {}/{}, repetition #{}'.format(
-                current_experiment, num_experiments, repeat))
-            proc = experiment.run(compress_logs_url=True)
-            completed_experiment_procs.append(proc)
-            current_experiment += 1
-    for proc in completed_experiment_procs:
-        logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
-        proc.wait()
-        if proc.returncode != 0:
-            logging.warning('Error running cmd PID={}'.format(proc.pid))
+    with ExperimentPipeline() as pipeline:
+        for repeat in range(0,10):
+            for experiment in experiments.values():
+                print('Running experiment {}/{}, repetition #{}'.format(
+                    current_experiment, num_experiments, repeat))
+                proc = experiment.run(compress_logs_url=True)
+                pipeline.submit(proc)
+                current_experiment += 1
     
 
 def _main(git_secret, force_create_instance=False, regions=None, networks=None, force=False):
@@ -1,5 +1,6 @@
 import cctestbedv2 as cctestbed
 import cctestbed_generate_experiments as generate_experiments
+from data_analysis.experiment_catalog import ExperimentCatalog
 from contextlib import ExitStack, contextmanager
 from urllib.parse import urlsplit, urlunsplit
 from config import *
@@ -8,7 +9,6 @@ import logging
 from logging.config import fileConfig
 import time
 import pandas as pd
-import glob
 import traceback
 import os
 import yaml
@@ -22,8 +22,8 @@ QUEUE_SIZE_TABLE = {
     275: {5:128, 10:256, 15:512}}
 
 def is_completed_experiment(experiment_name):
-    num_completed = glob.glob('/tmp/{}-*.tar.gz'.format(experiment_name))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, archive_dir='/tmp')
     if experiment_done:
         logging.warning(
             'Skipping completed experiment: {}'.format(experiment_name))
@@ -31,8 +31,8 @@ def is_completed_experiment(experiment_name):
 
 def ran_experiment_today(experiment_name):
     today = datetime.datetime.now().isoformat()[:10].replace('-','')
-    num_completed = glob.glob('/tmp/{}-{}*.tar.gz'.format(experiment_name, today))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, date=today, archive_dir='/tmp')
     if experiment_done:
         logging.warning(
             'Skipping completed experiment (today): {}'.format(experiment_name))
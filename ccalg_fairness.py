@@ -1,5 +1,7 @@
 import cctestbedv2 as cctestbed
 import cctestbed_generate_experiments as generate_experiments
+from cctestbed_pipeline import ExperimentPipeline
+from data_analysis.experiment_catalog import ExperimentCatalog, COMPLETED
 from contextlib import ExitStack, contextmanager
 from urllib.parse import urlsplit, urlunsplit
 from config import *
@@ -8,7 +10,6 @@ import logging
 from logging.config import fileConfig
 import time
 import pandas as pd
-import glob
 import traceback
 import os
 import yaml
@@ -26,9 +27,16 @@ QUEUE_SIZE_TABLE = {
     130: {5:64, 10:128, 15:256},
     275: {5:128, 10:256, 15:512}}
 
+# archives wait in /tmp/data-tmp until classify_websites.snakefile processes
+# them; processed experiments may be run again
+PENDING_STATES = (COMPLETED,)
+# archives from before the catalog existed are found here
+PENDING_DIR = '/tmp/data-tmp'
+
 def is_completed_experiment(experiment_name):
-    num_completed = glob.glob('/tmp/data-tmp/{}-*.tar.gz'.format(experiment_name))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, states=PENDING_STATES,
+                                              archive_dir=PENDING_DIR)
     if experiment_done:
         logging.warning(
             'Skipping completed experiment: {}'.format(experiment_name))
@@ -36,8 +44,9 @@ def is_completed_experiment(experiment_name):
 
 def ran_experiment_today(experiment_name):
     today = datetime.datetime.now().isoformat()[:10].replace('-','')
-    num_completed = glob.glob('/tmp/data-tmp/{}-{}*.tar.gz'.format(experiment_name, today))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, date=today, states=PENDING_STATES,
+                                              archive_dir=PENDING_DIR)
     if experiment_done:
         logging.warning(
             'Skipping completed experiment (today): {}'.format(experiment_name))
@@ -1103,7 +1112,7 @@ def main(tests, websites,
          nums_competing, competing_ccalgs,
          duration, ntwrk_conditions=None, repeat=1,
          chrome=False):
-    completed_experiment_procs = []
+    pipeline = ExperimentPipeline()
     logging.info('Found {} websites'.format(len(websites)))
     print('Found {} websites'.format(len(websites)))
     if ntwrk_conditions is None:
@@ -1217,8 +1226,11 @@ def main(tests, websites,
                 too_small_rtt = max(too_small_rtt, rtt)
             elif proc is not None:
                 print('Experiment exp_name={}'.format(exp_name))
-                completed_experiment_procs.append(proc)
-            time.sleep(60)
+                pipeline.submit(proc, exp_name)
+            # next experiment can start as soon as bess has shut down
+            if not cctestbed.wait_until(lambda: not cctestbed.is_bess_running(),
+                                        timeout=60):
+                logging.warning('BESS still running 60s after experiment')
         except Exception as e:
             logging.error('Error running experiment for website: {}'.format(website))
             logging.error(e)
@@ -1226,13 +1238,10 @@ def main(tests, websites,
             print('Error running experiment for website: {}'.format(website))
             print(e)
             print(traceback.print_exc())
+            pipeline.join()
             exit(1)
                 
-    for proc in completed_experiment_procs:
-        logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
-        proc.wait()
-        if proc.returncode != 0:
-            logging.warning('Error cleaning up experiment PID={}'.format(proc.pid))
+    pipeline.join()
         
             
 def parse_args():
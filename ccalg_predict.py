@@ -1,5 +1,9 @@
 import cctestbedv2 as cctestbed
 import cctestbed_generate_experiments as generate_experiments
+from cctestbed_pipeline import ExperimentPipeline
+from data_analysis.online_classifier import OnlineClassifier, classify_queue_log
+from data_analysis.training_library import load_training_library
+from data_analysis.experiment_catalog import ExperimentCatalog, COMPLETED
 from contextlib import ExitStack, contextmanager
 from urllib.parse import urlsplit, urlunsplit
 from config import *
@@ -8,7 +12,6 @@ import logging
 from logging.config import fileConfig
 import time
 import pandas as pd
-import glob
 import traceback
 import os
 import yaml
@@ -22,9 +25,16 @@ QUEUE_SIZE_TABLE = {
     130: {5:64, 10:128, 15:256},
     275: {5:128, 10:256, 15:512}}
 
+# archives wait in /tmp/data-tmp until classify_websites.snakefile processes
+# them; processed experiments may be run again
+PENDING_STATES = (COMPLETED,)
+# archives from before the catalog existed are found here
+PENDING_DIR = '/tmp/data-tmp'
+
 def is_completed_experiment(experiment_name):
-    num_completed = glob.glob('/tmp/data-tmp/{}-*.tar.gz'.format(experiment_name))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, states=PENDING_STATES,
+                                              archive_dir=PENDING_DIR)
     if experiment_done:
         logging.warning(
             'Skipping completed experiment: {}'.format(experiment_name))
@@ -32,8 +42,9 @@ def is_completed_experiment(experiment_name):
 
 def ran_experiment_today(experiment_name):
     today = datetime.datetime.now().isoformat()[:10].replace('-','')
-    num_completed = glob.glob('/tmp/data-tmp/{}-{}*.tar.gz'.format(experiment_name, today))
-    experiment_done = len(num_completed) > 0
+    with ExperimentCatalog() as catalog:
+        experiment_done = catalog.is_completed(experiment_name, date=today, states=PENDING_STATES,
+                                              archive_dir=PENDING_DIR)
     if experiment_done:
         logging.warning(
             'Skipping completed experiment (today): {}'.format(experiment_name))
@@ -49,10 +60,30 @@ def run_rtt_monitor(url_ip):
     rtt = cctestbed.run_local_command(cmd, shell=True)
     return rtt
 
-def run_experiment(website, url, btlbw=10, queue_size=128, rtt=35, force=False):
+def get_online_classifier(btlbw, rtt, queue_size):
+    """Return classifier comparing a flow to the training flows of its network conditions"""
+    training_library = load_training_library()
+    training_exp_names = training_library.get_exp_names(btlbw, rtt, queue_size)
+    if len(training_exp_names) == 0:
+        logging.warning('No training flows for {}bw-{}rtt-{}q, not classifying online'.format(
+            btlbw, rtt, queue_size))
+        return None
+    return OnlineClassifier(training_library.get_training_flows(training_exp_names),
+                            queue_size=queue_size, resample_interval=rtt)
+
+def stop_flow(ssh_client, ip_addr, pid_filename):
+    # timeout passes the signal on to wget
+    cmd = 'pkill -P $(cat {}) timeout; rm -f {}'.format(pid_filename, pid_filename)
+    _, stdout, _ = cctestbed.exec_command(ssh_client, ip_addr, cmd)
+    stdout.channel.recv_exit_status()
+
+def run_experiment(website, url, btlbw=10, queue_size=128, rtt=35, force=False,
+                   online=False):
     experiment_name = '{}bw-{}rtt-{}q-{}'.format(btlbw, rtt, queue_size, website)
     if not force and is_completed_experiment(experiment_name):
         return (None, '')
+    # label the flow from the queue log as it downloads & stop it once confident
+    classifier = get_online_classifier(btlbw, rtt, queue_size) if online else None
     logging.info('Creating experiment for website: {}'.format(website))
     url_ip = get_website_ip(url)
     logging.info('Got website IP: {}'.format(url_ip))
@@ -129,9 +160,23 @@ def run_experiment(website, url, btlbw=10, queue_size=128, rtt=35, force=False):
             if filename.strip() == '':
                 logging.warning('Could not get filename from URL')
             start_flow_cmd = 'timeout 65s wget --no-check-certificate --no-cache --delete-after --connect-timeout=10 --tries=3 --bind-address {}  -P /tmp/ "{}" || rm -f /tmp/{}.tmp*'.format(exp.server.ip_lan, url, filename)
+            pid_filename = '/tmp/flow-{}.pid'.format(exp.name)
+            if classifier is not None:
+                # remember the shell running the flow so it can be stopped early
+                start_flow_cmd = 'echo $$ > {}; {}'.format(pid_filename, start_flow_cmd)
             # won't return until flow is done
             flow_start_time = time.time()
             _, stdout, _ = cctestbed.exec_command(ssh_client, exp.server.ip_wan, start_flow_cmd)
+            stopped_early = False
+            if classifier is not None:
+                stopped_early = classify_queue_log(
+                    exp.logs['queue_log'], classifier,
+                    is_running=lambda: not stdout.channel.exit_status_ready())
+                if stopped_early and not stdout.channel.exit_status_ready():
+                    logging.info('Stopping flow after {} seconds, classified as {}'.format(
+                        time.time() - flow_start_time,
+                        classifier.results()['predicted_label']))
+                    stop_flow(ssh_client, exp.server.ip_wan, pid_filename)
             exit_status = stdout.channel.recv_exit_status()
             flow_end_time = time.time()
             logging.info('Flow ran for {} seconds'.format(flow_end_time - flow_start_time))
@@ -147,6 +192,12 @@ def run_experiment(website, url, btlbw=10, queue_size=128, rtt=35, force=False):
             website_info['website_rtt'] = website_rtt
             website_info['url_ip'] = url_ip
             website_info['flow_runtime'] = flow_end_time - flow_start_time 
+            if classifier is not None:
+                website_info['stopped_early'] = stopped_early
+                online_results = classifier.results()
+                website_info['online_predicted_label'] = online_results['predicted_label']
+                website_info['online_closest_distance'] = online_results['closest_distance']
+                website_info['online_num_samples'] = online_results['num_samples']
             json.dump(website_info, f)
 
         if exit_status != 0:
@@ -258,56 +309,68 @@ def get_taro_experiments():
     
 def run_taro_experiments():
     experiments = get_taro_experiments()
-    completed_experiment_procs = []
     logging.info('Going to run {} experiments.'.format(len(experiments)))
 
     running_experiment = 1
     
-    for experiment in experiments.values():
-        try:
-            print('Running experiments {}/{}'.format(running_experiment, len(experiments)))
-            cctestbed.run_local_command('/opt/bess/bessctl/bessctl daemon stop')
-            proc = experiment.run()
-            completed_experiment_procs.append(proc)
-            running_experiment += 1
-        except Exception as e:
-            print('ERROR RUNNING EXPERIMENT: {}'.format(e))
+    with ExperimentPipeline() as pipeline:
+        for experiment in experiments.values():
+            try:
+                print('Running experiments {}/{}'.format(running_experiment, len(experiments)))
+                cctestbed.run_local_command('/opt/bess/bessctl/bessctl daemon stop')
+                proc = experiment.run()
+                pipeline.submit(proc)
+                running_experiment += 1
+            except Exception as e:
+                print('ERROR RUNNING EXPERIMENT: {}'.format(e))
 
-    for proc in completed_experiment_procs:
-        logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
-        proc.wait()
-        if proc.returncode != 0:
-            logging.warning('Error running cmd PID={}'.format(proc.pid))
+DEFAULT_NTWRK_CONDITIONS = [(5,35), (5,85), (5,130), (5,275),
+                            (10,35), (10,85), (10,130), (10,275),
+                            (15,35), (15,85), (15,130), (15,275)]
 
-def main(websites, ntwrk_conditions=None, force=False):
-    completed_experiment_procs = []
+def run_website_experiments(website, url, pipeline, ntwrk_conditions=None, force=False,
+                            online=False):
+    """Run experiment for each network condition; return names of experiments run.
+
+    Compressing (and postprocessing) each experiment is handed to pipeline, so
+    call pipeline.join() before using the experiments' tarballs.
+    """
+    if ntwrk_conditions is None:
+        ntwrk_conditions = DEFAULT_NTWRK_CONDITIONS
+    exp_names = []
+    too_small_rtt = 0
+    for num_experiment, (btlbw, rtt) in enumerate(ntwrk_conditions, 1):
+        queue_size = QUEUE_SIZE_TABLE[rtt][btlbw]
+        print('Running experiment {}/{} website={}, btlbw={}, queue_size={}, rtt={}.'.format(
+            num_experiment, len(ntwrk_conditions), website, btlbw, queue_size, rtt))
+        if rtt <= too_small_rtt:
+            print('Skipping experiment RTT too small')
+            continue
+        (proc, exp_name) = run_experiment(website, url, btlbw, queue_size, rtt, force=force,
+                                          online=online)
+        # spaghetti code to skip websites that don't work for given rtt
+        if proc == -1:
+            too_small_rtt = max(too_small_rtt, rtt)
+        elif proc is not None:
+            print('Experiment exp_name={}'.format(exp_name))
+            # compress & postprocess while the next experiment runs
+            pipeline.submit(proc, exp_name)
+            exp_names.append(exp_name)
+    return exp_names
+
+def main(websites, ntwrk_conditions=None, force=False, postprocess_cmd=None,
+         max_pending=4, online=False):
+    pipeline = ExperimentPipeline(postprocess_cmd=postprocess_cmd,
+                                  max_pending=max_pending)
     logging.info('Found {} websites'.format(len(websites)))
     print('Found {} websites'.format(len(websites)))
     num_completed_websites = 0
-    if ntwrk_conditions is None:
-        ntwrk_conditions = [(5,35), (5,85), (5,130), (5,275),
-                            (10,35), (10,85), (10,130), (10,275),
-                            (15,35), (15,85), (15,130), (15,275)]
         
     for website, url in websites:
         try:
-            num_completed_experiments = 1
-            too_small_rtt = 0
-            for btlbw, rtt in ntwrk_conditions:
-                queue_size = QUEUE_SIZE_TABLE[rtt][btlbw]                    
-                print('Running experiment {}/{} website={}, btlbw={}, queue_size={}, rtt={}.'.format(
-                    num_completed_experiments,len(websites)*len(ntwrk_conditions), website,btlbw,queue_size,rtt))
-                num_completed_experiments += 1
-                if rtt <= too_small_rtt:
-                    print('Skipping experiment RTT too small')
-                    continue
-                (proc, exp_name) = run_experiment(website, url, btlbw, queue_size, rtt, force=force)
-                # spaghetti code to skip websites that don't work for given rtt
-                if proc == -1:
-                    too_small_rtt = max(too_small_rtt, rtt)
-                elif proc is not None:
-                    print('Experiment exp_name={}'.format(exp_name))
-                    completed_experiment_procs.append(proc)
+            run_website_experiments(website, url, pipeline,
+                                    ntwrk_conditions=ntwrk_conditions,
+                                    force=force, online=online)
         except Exception as e:
             logging.error('Error running experiment for website: {}'.format(website))
             logging.error(e)
@@ -315,16 +378,16 @@ def main(websites, ntwrk_conditions=None, force=False):
             print('Error running experiment for website: {}'.format(website))
             print(e)
             print(traceback.print_exc())
+            pipeline.join()
             exit(1)
 
         num_completed_websites += 1
         print('Completed experiments for {}/{} websites'.format(num_completed_websites, len(websites)))
     
-    for proc in completed_experiment_procs:
-        logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
-        proc.wait()
-        if proc.returncode != 0:
-            logging.warning('Error cleaning up experiment PID={}'.format(proc.pid))
+    pipeline.join()
+    if pipeline.failed:
+        logging.warning('Failed to process {} experiments: {}'.format(
+            len(pipeline.failed), pipeline.failed))
         
             
 def parse_args():
@@ -339,6 +402,14 @@ def parse_args():
         help='Network conditions for download from website.')
     parser.add_argument('--force', '-f', action='store_true', dest='force',
                         help='Force experiments that were already run to run again')
+    parser.add_argument('--postprocess', '-p', dest='postprocess_cmd', default=None,
+                        help=('Shell command to run on each experiment after its logs are compressed, '
+                              'formatted with exp_name. Runs while the next experiment runs.'))
+    parser.add_argument('--max-pending', type=int, default=4, dest='max_pending',
+                        help='Max number of experiments waiting to be compressed or postprocessed')
+    parser.add_argument('--online', action='store_true', dest='online',
+                        help=('Classify each flow from the queue log while it downloads and stop '
+                              'the download once the label is confident'))
     args = parser.parse_args()
     return args
             
@@ -348,4 +419,6 @@ if __name__ == '__main__':
     fileConfig(log_file_path)
     logging.getLogger("paramiko").setLevel(logging.WARNING)
     args = parse_args()
-    main(args.websites, ntwrk_conditions=args.ntwrk_conditions, force=args.force)
+    main(args.websites, ntwrk_conditions=args.ntwrk_conditions, force=args.force,
+         postprocess_cmd=args.postprocess_cmd, max_pending=args.max_pending,
+         online=args.online)
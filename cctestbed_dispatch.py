@@ -0,0 +1,264 @@
+"""
+Run the experiments in one config file across several testbeds at once.
+
+Each testbed is a BESS middlebox (ex. a CloudLab bess-N node set up with
+setup-cloudlab-testbeds.sh) with its own server & client. The dispatcher keeps
+one worker thread per testbed; each worker takes the next experiment that
+hasn't run yet, runs it on its middlebox with cctestbedv2.py and copies the
+experiment's tarball back into a single archive directory. Testbeds that
+finish early keep taking experiments, so a sweep takes about as long as its
+experiments divided by the number of testbeds.
+
+Testbeds are described in a YAML file:
+
+bess-1:
+  ip_wan: ms1234.utah.cloudlab.us
+  username: rware
+  key_filename: /home/rware/.ssh/rware_cloudlab.pem
+  # server & client of this testbed, written by setup_cloudlab.py
+  host_info: /opt/cctestbed/cctestbed_host_info_bess-1.pkl
+
+The server & client in the experiment config are replaced with each testbed's
+own before the config is copied to the testbed. Only one dispatcher at a time
+can run experiments on a testbed; the remote command holds a lock on the
+middlebox while it runs.
+"""
+from command import get_ssh_client, fetch_remote_files, close_ssh_clients
+import cctestbedv2 as cctestbed
+
+from collections import namedtuple
+from contextlib import ExitStack
+import argparse
+import copy
+import glob
+import logging
+import os
+import pickle
+import queue
+import shlex
+import socket
+import threading
+import yaml
+import paramiko
+
+Testbed = namedtuple('Testbed', ['name', 'ip_wan', 'username', 'key_filename',
+                                 'server', 'client', 'cctestbed_dir', 'python'])
+
+TESTBED_LOCK = '/tmp/cctestbed-dispatch.lock'
+# exit code of flock when another dispatcher is using the testbed
+LOCK_CONFLICT_EXIT = 75
+
+def load_testbeds(testbeds_filename):
+    """Parse YAML file describing testbeds; return list of Testbeds"""
+    with open(testbeds_filename) as f:
+        testbeds_config = yaml.safe_load(f)
+    testbeds = []
+    for name, testbed in testbeds_config.items():
+        server, client = None, None
+        if testbed.get('host_info') is not None:
+            with open(testbed['host_info'], 'rb') as f:
+                server, client = pickle.load(f)
+            server, client = dict(server._asdict()), dict(client._asdict())
+        testbeds.append(Testbed(name=name,
+                                ip_wan=testbed['ip_wan'],
+                                username=testbed['username'],
+                                key_filename=testbed.get('key_filename'),
+                                server=testbed.get('server', server),
+                                client=testbed.get('client', client),
+                                cctestbed_dir=testbed.get('cctestbed_dir',
+                                                          '/opt/cctestbed'),
+                                python=testbed.get('python', 'python3.6')))
+    return testbeds
+
+def get_testbed_config(config, testbed):
+    """Return copy of experiment config that runs on the testbed's hosts"""
+    testbed_config = copy.deepcopy(config)
+    if testbed.server is not None:
+        testbed_config['server'] = dict(testbed.server)
+    if testbed.client is not None:
+        testbed_config['client'] = dict(testbed.client)
+    return testbed_config
+
+def is_archived_experiment(experiment_name, archive_dir):
+    return len(glob.glob(os.path.join(archive_dir,
+                                      '{}-*.tar.gz'.format(experiment_name)))) > 0
+
+class TestbedBusyError(Exception):
+    """Another dispatcher is running experiments on the testbed"""
+
+class Dispatcher:
+    """Run experiments from a config on a pool of testbeds.
+
+    Parameters:
+    -----------
+    config : dict
+       Parsed experiment config, see cctestbedv2.load_config_file
+    testbeds : list of Testbed
+    archive_dir : str
+       Local directory to copy experiment tarballs to
+    """
+    def __init__(self, config, testbeds, archive_dir):
+        self.config = config
+        self.testbeds = testbeds
+        self.archive_dir = archive_dir
+        self._experiments = queue.Queue()
+        self._lock = threading.Lock()
+        self.completed = {}
+        self.failed = []
+
+    def _remote_config_filename(self, testbed):
+        return '/tmp/cctestbed-dispatch-{}.yaml'.format(testbed.name)
+
+    def _upload_config(self, ssh_client, testbed):
+        config_filename = self._remote_config_filename(testbed)
+        with ssh_client.open_sftp() as sftp:
+            with sftp.open(config_filename, 'w') as f:
+                f.write(yaml.safe_dump(get_testbed_config(self.config, testbed)))
+        return config_filename
+
+    def _list_tarballs(self, ssh_client, experiment_name):
+        cmd = 'ls /tmp/{}-*.tar.gz'.format(shlex.quote(experiment_name))
+        _, stdout, _ = ssh_client.exec_command(cmd)
+        with stdout:
+            return set(stdout.read().decode('utf-8').split())
+
+    def _run_remote(self, ssh_client, testbed, config_filename, experiment_name):
+        """Run one experiment on testbed; return its exit status"""
+        log_filename = '/tmp/cctestbed-dispatch-{}-{}.log'.format(testbed.name,
+                                                                  experiment_name)
+        cmd = ('cd {} && flock -n -E {} {} {} cctestbedv2.py {} --names {} --force '
+               '> {} 2>&1').format(
+                   shlex.quote(testbed.cctestbed_dir), LOCK_CONFLICT_EXIT,
+                   TESTBED_LOCK, testbed.python, config_filename,
+                   shlex.quote(experiment_name), log_filename)
+        logging.info('[{}] Running cmd: {}'.format(testbed.name, cmd))
+        _, stdout, _ = ssh_client.exec_command(cmd)
+        with stdout:
+            exit_status = stdout.channel.recv_exit_status()
+        if exit_status == LOCK_CONFLICT_EXIT:
+            raise TestbedBusyError('Testbed {} is locked by another dispatcher'.format(
+                testbed.name))
+        if exit_status != 0:
+            logging.warning('[{}] Experiment {} exited with {}, see {}:{}'.format(
+                testbed.name, experiment_name, exit_status, testbed.ip_wan,
+                log_filename))
+        return exit_status
+
+    def _run_experiment(self, ssh_client, testbed, config_filename, experiment_name):
+        before = self._list_tarballs(ssh_client, experiment_name)
+        self._run_remote(ssh_client, testbed, config_filename, experiment_name)
+        tarballs = sorted(self._list_tarballs(ssh_client, experiment_name) - before)
+        if len(tarballs) == 0:
+            return []
+        copied = fetch_remote_files(ssh_client, testbed.ip_wan, tarballs,
+                                    local_dir=self.archive_dir)
+        if len(copied) > 0:
+            # only the archive directory should have a copy
+            _, stdout, _ = ssh_client.exec_command(
+                'rm -f {}'.format(' '.join(shlex.quote(path) for path in copied)))
+            with stdout:
+                stdout.channel.recv_exit_status()
+        return [os.path.join(self.archive_dir, os.path.basename(path))
+                for path in copied]
+
+    def _worker(self, testbed):
+        with ExitStack() as stack:
+            try:
+                ssh_client = stack.enter_context(get_ssh_client(
+                    testbed.ip_wan, username=testbed.username,
+                    key_filename=testbed.key_filename))
+                config_filename = self._upload_config(ssh_client, testbed)
+            except (paramiko.SSHException, socket.error, EOFError) as e:
+                logging.error('[{}] Could not connect to testbed: {}'.format(
+                    testbed.name, e))
+                return
+            while True:
+                try:
+                    experiment_name = self._experiments.get_nowait()
+                except queue.Empty:
+                    return
+                logging.info('[{}] Running experiment {}'.format(testbed.name,
+                                                                 experiment_name))
+                try:
+                    tarballs = self._run_experiment(ssh_client, testbed,
+                                                    config_filename, experiment_name)
+                except (TestbedBusyError, paramiko.SSHException, socket.error,
+                        EOFError) as e:
+                    # give the experiment to another testbed & stop using this one
+                    logging.error('[{}] Stopping, could not run experiment {}: {}'.format(
+                        testbed.name, experiment_name, e))
+                    self._experiments.put(experiment_name)
+                    return
+                with self._lock:
+                    if len(tarballs) > 0:
+                        self.completed[experiment_name] = tarballs
+                    else:
+                        self.failed.append(experiment_name)
+
+    def run(self, experiment_names=None, force=False):
+        """Run experiments on all testbeds; return names of experiments not run.
+
+        Experiments that already have a tarball in archive_dir are skipped
+        unless force is True.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for experiment_name in self.config['experiments']:
+            if experiment_names is not None and experiment_name not in experiment_names:
+                continue
+            if not force and is_archived_experiment(experiment_name, self.archive_dir):
+                logging.warning('Skipping completed experiment: {}'.format(experiment_name))
+                continue
+            self._experiments.put(experiment_name)
+        logging.info('Going to run {} experiments on {} testbeds'.format(
+            self._experiments.qsize(), len(self.testbeds)))
+        threads = [threading.Thread(target=self._worker, args=(testbed,),
+                                    name='dispatch-{}'.format(testbed.name))
+                   for testbed in self.testbeds]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        not_run = []
+        while not self._experiments.empty():
+            not_run.append(self._experiments.get_nowait())
+        if not_run:
+            logging.error('No testbed left to run {} experiments: {}'.format(
+                len(not_run), not_run))
+        if self.failed:
+            logging.warning('{} experiments did not produce a tarball: {}'.format(
+                len(self.failed), self.failed))
+        return not_run
+
+def main(args):
+    config = cctestbed.load_config_file(args.config_file)
+    testbeds = load_testbeds(args.testbeds_file)
+    if args.testbeds is not None:
+        testbeds = [testbed for testbed in testbeds if testbed.name in args.testbeds]
+    dispatcher = Dispatcher(config, testbeds, args.archive_dir)
+    try:
+        for num_repeat in range(args.repeat):
+            logging.info('REPTITION {}: '.format(num_repeat))
+            dispatcher.run(experiment_names=args.names,
+                           force=(args.force or num_repeat > 0))
+    finally:
+        close_ssh_clients()
+
+def parse_args():
+    """Parse commandline arguments"""
+    parser = argparse.ArgumentParser(
+        description='Run congestion control experiments on several testbeds')
+    parser.add_argument('config_file', help='Configuration file describing experiment')
+    parser.add_argument('testbeds_file', help='YAML file describing testbeds')
+    parser.add_argument('--archive-dir', '-a', dest='archive_dir', default='/tmp/data-raw',
+                        help='Directory to copy experiment tarballs to')
+    parser.add_argument('--testbeds', '-t', nargs='+', help='Name(s) of testbeds to use')
+    parser.add_argument('--names', '-n', nargs='+', help='Name(s) of experiments to run')
+    parser.add_argument('--force', '-f', action='store_true',
+                        help='Force experiments that were already run to run again')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeat experiments some number of times')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,95 @@
+"""
+Process finished experiments in the background while the next one runs.
+
+Experiment.run returns as soon as the flows are done, with its logs still
+being compressed by a background process. ExperimentPipeline hands that
+process to a pool of worker threads, which wait for it and then run an
+optional postprocessing command for the experiment (ex. snakemake target that
+extracts features and classifies it).
+
+At most max_pending experiments can be compressing or postprocessing at once;
+submit() blocks until one finishes, so logs of finished experiments can't
+pile up in /tmp faster than they are processed.
+
+with ExperimentPipeline(postprocess_cmd=...) as pipeline:
+    for experiment in experiments:
+        pipeline.submit(experiment.run(), exp_name)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import subprocess
+import threading
+
+class ExperimentPipeline:
+    """Bounded pool that waits on & postprocesses finished experiments.
+
+    Parameters:
+    -----------
+    postprocess_cmd : str, optional
+       Shell command to run after an experiment's logs are compressed.
+       Formatted with exp_name, ex.
+       'snakemake -s classify_websites.snakefile data-processed/{exp_name}.results'
+    workers : int
+       Number of experiments postprocessed at the same time
+    max_pending : int
+       Max number of experiments compressing or postprocessing; submit blocks
+       when there are this many.
+    """
+    def __init__(self, postprocess_cmd=None, workers=2, max_pending=4):
+        self.postprocess_cmd = postprocess_cmd
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self.failed = []
+
+    def _process(self, proc, exp_name):
+        try:
+            logging.info('Waiting for subprocess to finish PID={}'.format(proc.pid))
+            proc.wait()
+            if proc.returncode != 0:
+                logging.warning('Error cleaning up experiment PID={}'.format(proc.pid))
+                self.failed.append(exp_name)
+                return
+            if self.postprocess_cmd is not None and exp_name is not None:
+                cmd = self.postprocess_cmd.format(exp_name=exp_name)
+                logging.info('Running postprocess cmd: {}'.format(cmd))
+                completed_proc = subprocess.run(cmd, shell=True,
+                                                stdout=subprocess.DEVNULL,
+                                                stderr=subprocess.PIPE)
+                if completed_proc.returncode != 0:
+                    logging.warning('Error postprocessing experiment {}: {}'.format(
+                        exp_name, completed_proc.stderr.decode('utf-8')))
+                    self.failed.append(exp_name)
+        finally:
+            self._pending.release()
+
+    def submit(self, proc, exp_name=None):
+        """Hand off finished experiment; blocks if max_pending are in flight.
+
+        Parameters:
+        -----------
+        proc : subprocess.Popen
+           Process compressing the experiment's logs, returned by Experiment.run
+        exp_name : str, optional
+           Name of the experiment tarball without .tar.gz, used to format
+           postprocess_cmd
+        """
+        if not self._pending.acquire(blocking=False):
+            logging.info('Waiting for one of {} experiments to finish processing'.format(
+                self.max_pending))
+            self._pending.acquire()
+        self._futures.append(self._executor.submit(self._process, proc, exp_name))
+
+    def join(self):
+        """Wait for all submitted experiments to finish processing"""
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.join()
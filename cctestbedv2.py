@@ -1,4 +1,5 @@
-from command import RemoteCommand, run_local_command, get_ssh_client, exec_command
+from command import RemoteCommand, RemoteCommands, run_local_command, get_ssh_client, exec_command, close_ssh_clients
+from data_analysis.experiment_catalog import ExperimentCatalog
 
 from collections import namedtuple, OrderedDict
 from datetime import datetime
@@ -13,7 +14,6 @@ import shlex
 import time
 import tarfile
 import logging
-import glob
 import random
 import yaml
 import paramiko
@@ -45,9 +45,21 @@ Flow = namedtuple('Flow', ['ccalg', 'start_time', 'end_time', 'rtt',
 # -- create /etc/sudoers.d/cctestbed
 
 # TODO: to set affinity, get number of processors on remote machines using 'nproc --all
-# TODO: check every seconds if processes still running instead of using time.sleep
 # TODO: allow starting and stopping flows at any time
 
+# gzip tcpdump pcaps on the server/client while copying them back; mostly
+# headers & repeated iperf payload, so several times smaller over the WAN
+COMPRESS_TCPDUMP_LOGS = True
+
+# have the queue module write fixed-width binary records instead of text
+# lines; data_analysis.queue_log reads either, keyed off the file's header
+BINARY_QUEUE_LOG = True
+
+# seconds to wait for the BESS pipeline to come up after starting it
+BESS_START_TIMEOUT = 30
+# seconds past the last flow's end time to wait for flows to exit
+FLOW_END_SLACK = 10
+
 class Experiment:
     def __init__(self, name, btlbw, queue_size,
                  flows, server, client, config_filename, server_nat_ip=None,
@@ -74,7 +86,7 @@ class Experiment:
             'client_tcpdump_log': '/tmp/client-tcpdump-{}-{}.pcap'.format(
                 self.name, self.exp_time),
             'description_log': '/tmp/{}-{}.json'.format(self.name, self.exp_time),
-            'tcpprobe_log': '/tmp/tcpprobe-{}-{}.txt'.format(self.name, self.exp_time),
+            'tcpprobe_log': '/tmp/tcpprobe-{}-{}.bin'.format(self.name, self.exp_time),
             'dig_log': '/tmp/dig-{}-{}.txt'.format(self.name, self.exp_time),
             'rtt_log': '/tmp/rtt-{}-{}.txt'.format(self.name, self.exp_time),
             'capinfos_log': '/tmp/capinfos-{}-{}.txt'.format(self.name, self.exp_time),
@@ -139,9 +151,11 @@ class Experiment:
             #if self.dig:
             #    self._run_dig()
             with ExitStack() as stack:
-                self._run_tcpdump('server', stack)
-                self._run_tcpdump('client', stack)
-                self._run_tcpprobe(stack)
+                # start (and later stop) all the monitors at the same time
+                monitors = stack.enter_context(RemoteCommands())
+                monitors.start(self._get_tcpdump_cmd('server'),
+                               self._get_tcpdump_cmd('client'),
+                               self._get_tcpprobe_cmd())
                 self._run_all_flows(stack, bess_config_name=bess_config_name)
             # compress all log files
             if compress_logs_url:
@@ -214,11 +228,19 @@ class Experiment:
         if len(logs) == 0:
             logging.warning('Found no logs for this experiment to compress')
         logging.info('Compressing {} logs into tarfile: {}'.format(len(logs), self.tar_filename))
-        cmd = 'cp {} {} && cd /tmp && tar -czf {} {} && rm -f {}'.format(
+        # indexed tarball, so analysis can read any one log without
+        # decompressing the others; then record it in the experiment catalog
+        cmd = ('cp {} {} && cd /tmp '
+               '&& PYTHONPATH={} python3 -m data_analysis.indexed_tar {} {} '
+               '&& PYTHONPATH={} python3 -m data_analysis.experiment_catalog add {} '
+               '&& rm -f {}').format(
             self.config_filename,
             os.path.join('/tmp', os.path.basename(self.config_filename)),
+            os.path.dirname(os.path.abspath(__file__)),
             os.path.basename(self.tar_filename),
             ' '.join(logs),
+            os.path.dirname(os.path.abspath(__file__)),
+            self.tar_filename,
             ' && rm -f '.join(logs))
         logging.info('Renaming config_filename in experiment from {} to {}'.format(
             self.config_filename,
@@ -267,6 +289,10 @@ class Experiment:
 
 
     def _run_tcpdump(self, host, stack, capture_http=False):
+        start_tcpdump = self._get_tcpdump_cmd(host, capture_http=capture_http)
+        return stack.enter_context(start_tcpdump())
+
+    def _get_tcpdump_cmd(self, host, capture_http=False):
         if capture_http:
             assert(host == 'server')
             start_tcpdump_cmd = (
@@ -284,8 +310,9 @@ class Experiment:
                                           sudo=True,
                                           username=self.server.username,
                                           key_filename=self.server.key_filename,
-                                          pgrep_string=self.logs['http_log'])
-            return stack.enter_context(start_tcpdump())
+                                          pgrep_string=self.logs['http_log'],
+                                          compress_logs=COMPRESS_TCPDUMP_LOGS)
+            return start_tcpdump
         else:
             start_tcpdump_cmd = ('tcpdump -n --packet-buffered '
                                  '--snapshot-length=65535 '
@@ -302,7 +329,8 @@ class Experiment:
                                           logs=tcpdump_logs,
                                           sudo=True,
                                           username=self.server.username,
-                                          key_filename=self.server.key_filename)
+                                          key_filename=self.server.key_filename,
+                                          compress_logs=COMPRESS_TCPDUMP_LOGS)
         elif host == 'client':
             start_tcpdump_cmd = start_tcpdump_cmd.format(
                 self.client.ifname_remote,
@@ -313,16 +341,22 @@ class Experiment:
                                           logs=tcpdump_logs,
                                           sudo=True,
                                           username=self.client.username,
-                                          key_filename=self.client.key_filename)
+                                          key_filename=self.client.key_filename,
+                                          compress_logs=COMPRESS_TCPDUMP_LOGS)
         else:
             raise ValueError('Expected either server or client to host')
-        return stack.enter_context(start_tcpdump())
+        return start_tcpdump
 
     def _run_tcpprobe(self, stack):
+        start_tcpprobe = self._get_tcpprobe_cmd()
+        return stack.enter_context(start_tcpprobe())
+
+    def _get_tcpprobe_cmd(self):
+        # loads the tcpprobe module; the returned command unloads it on cleanup
         # assumes that tcp_bbr_measure is installed @ /opt/tcp_bbr_measure on iperf client
         insmod_cmd = ('sudo insmod '
                       '/opt/cctestbed/tcp_bbr_measure/tcp_probe_ray.ko port=0 full=1 '
-                      '&& sudo chmod 444 /proc/net/tcpprobe ')
+                      '&& sudo chmod 444 /proc/net/tcpprobe_bin ')
         with get_ssh_client(self.client.ip_wan,
                             username=self.client.username,
                             key_filename=self.client.key_filename) as ssh_client:
@@ -336,11 +370,12 @@ class Experiment:
                         insmod_cmd, stderr.read()))
             
         try:
-            start_tcpprobe_cmd = 'cat /proc/net/tcpprobe'
+            # packed records, read with data_analysis.tcpprobe; errors from
+            # cat would corrupt the binary log so they aren't written to it
+            start_tcpprobe_cmd = 'cat /proc/net/tcpprobe_bin'
             start_tcpprobe = RemoteCommand(start_tcpprobe_cmd,
                                            self.client.ip_wan,
                                            stdout = self.logs['tcpprobe_log'],
-                                           stderr = self.logs['tcpprobe_log'],
                                            logs=[self.logs['tcpprobe_log']],
                                            cleanup_cmd='sudo rmmod tcp_probe_ray',
                                            username=self.client.username,
@@ -352,29 +387,23 @@ class Experiment:
                                 username=self.client.username,
                                 key_filename=self.client.key_filename) as ssh_client:
                 ssh_client.exec_command('sudo rmmod tcp_probe_ray')
-        return stack.enter_context(start_tcpprobe())
+        return start_tcpprobe
 
     @contextmanager
     def _run_bess_monitor(self):
-        # have to use system here; subprocess just hangs for some reason
-        with open(self.logs['queue_log'], 'w') as f:
-            f.write('dequeued,time,src,seq,datalen,size,dropped,queued,batch\n')
-        # only log "good" lines, those that start with 0 or 1
-        cmd = 'tail -n1 -f /tmp/bessd.INFO > {} &'.format(self.logs['queue_log'])
-        logging.info('Running cmd: {}'.format(cmd))
-        pid = None
+        # queue module writes its log straight to the queue log file, so there
+        # is no glog output to filter out afterwards
+        set_queue_dump_file(self.logs['queue_log'], text=not BINARY_QUEUE_LOG)
         try:
-            os.system(cmd)
-            pid = run_local_command('pgrep -f "tail -n1 -f /tmp/bessd.INFO"')
-            assert(pid)
-            pid = int(pid)
-            logging.info('PID={}'.format(pid))
-            yield pid
+            yield self.logs['queue_log']
         finally:
-            logging.info('Cleaning up cmd: {}'.format(cmd))
-            run_local_command('kill {}'.format(pid))
-            run_local_command('grep -e "^0" -e "^1" {} > /tmp/queue-log-tmp.txt'.format(self.logs['queue_log']), shell=True)
-            run_local_command('mv /tmp/queue-log-tmp.txt {}'.format(self.logs['queue_log']))
+            try:
+                # flushes & closes the queue log
+                set_queue_dump_file('')
+            finally:
+                # bessd runs as root, so the log it created is owned by root
+                # and the user can't rm it from /tmp (sticky bit)
+                chown_queue_dump_file(self.logs['queue_log'])
             
     @contextmanager
     def _run_rtt_monitor(self, program='nping'):
@@ -417,8 +446,9 @@ class Experiment:
         stderr = None
         try:
             start_bess(self, bess_config_name)
-            # give bess some time to start
-            time.sleep(5)
+            if not wait_until(is_bess_ready, timeout=BESS_START_TIMEOUT):
+                raise RuntimeError('BESS pipeline not ready after {}s'.format(
+                    BESS_START_TIMEOUT))
             # changing to ping between server and client
             # check that i can ping between machines and store measured rtt in metadata
             if ping_source == 'client':
@@ -481,17 +511,13 @@ class Experiment:
         self.write_description_log() 
                 
     def _run_all_flows(self, stack, bess_config_name='active-middlebox-pmd'):
-        # get wait times for each flow
-        if len(self.flows) > 1:
-            wait_times = self.get_wait_times()
-        else:
-            wait_times = [0]
-        # run bess and monitor
+        # run bess and monitor; _run_bess waits until the pipeline is up
         stack.enter_context(self._run_bess(bess_config_name=bess_config_name))
-        # give bess some time to start
-        time.sleep(3)
         self._show_bess_pipeline()
         stack.enter_context(self._run_bess_monitor())
+        # all iperf servers and clients are cleaned up together
+        flow_cmds = stack.enter_context(RemoteCommands())
+        start_servers = []
         for flow in self.flows:
             start_server_cmd = ('iperf3 --server '
                                 '--bind {} '
@@ -508,8 +534,13 @@ class Experiment:
                                          username=self.server.username,
                                          logs=[flow.server_log],
                                          key_filename=self.server.key_filename)
-            stack.enter_context(start_server())
+            start_servers.append(start_server)
+        flow_cmds.start(*start_servers)
 
+        # flows start at their start time relative to when the first flow
+        # starts, all measured against the same clock so delays don't add up
+        flows_start = time.monotonic()
+        client_cmds = []
         for idx, flow in enumerate(self.flows):
             # make sure first flow runs for the whole time regardless of start time
             # note this assumes self.flows is sorted by start time
@@ -544,14 +575,21 @@ class Experiment:
                                          logs=[flow.client_log],
                                          key_filename=self.client.key_filename)
             
-            logging.info('Sleep for {}s before starting flow with start time {}'.format(
-                    wait_times[idx], flow.start_time))
-            time.sleep(wait_times[idx])
-            stack.enter_context(start_client())
-        # last flow should be the last one
-        sleep_time = flow.end_time - flow.start_time + 1
-        logging.info('Sleep for {}s'.format(sleep_time))
-        time.sleep(sleep_time) 
+            if idx > 0:
+                logging.info('Waiting to start flow with start time {}'.format(
+                    flow.start_time))
+                sleep_until(flows_start + flow.start_time)
+            flow_cmds.start(start_client)
+            client_cmds.append(start_client)
+        # done as soon as every client exits, don't wait longer than the
+        # flows should take
+        end_time = max(flow.end_time for flow in self.flows)
+        timeout = flows_start + end_time + FLOW_END_SLACK - time.monotonic()
+        logging.info('Waiting up to {:.1f}s for all flows to finish'.format(timeout))
+        if not wait_until(lambda: not any(cmd.is_running() for cmd in client_cmds),
+                          timeout=timeout, interval=1):
+            logging.warning('Flows still running {}s after end time {}'.format(
+                FLOW_END_SLACK, end_time))
         self._show_bess_pipeline()
 
     def __repr__(self):
@@ -580,8 +618,11 @@ def load_experiments(config, config_filename,
         server_nat_ip = config['server_nat_ip']
     experiments = OrderedDict()
     
+    catalog = ExperimentCatalog()
+
     def is_completed_experiment(experiment_name, force):
-        experiment_done = (len(glob.glob('/tmp/{}-*.tar.gz'.format(experiment_name))) > 0)
+        # archives from before the catalog existed are still in /tmp
+        experiment_done = catalog.is_completed(experiment_name, archive_dir='/tmp')
         if experiment_done:
             if force:
                 logging.warning(
@@ -600,6 +641,7 @@ def load_experiments(config, config_filename,
         elif experiment_name in experiment_names:
             if not is_completed_experiment(experiment_name, force):
                 experiments_to_run.append((experiment_name, experiment))
+    catalog.close()
 
     for experiment_name, experiment in experiments_to_run:
         flows = []
@@ -631,6 +673,35 @@ def load_experiments(config, config_filename,
         exp.write_description_log()
     return experiments
 
+def wait_until(condition, timeout, interval=0.2):
+    """Poll condition until it returns True or timeout seconds have passed.
+
+    Returns True if the condition was met, False if it timed out.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def sleep_until(deadline):
+    """Sleep until time.monotonic() reaches deadline"""
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+def is_bess_ready(module='queue0'):
+    """Return True once bessd is up and the pipeline has the given module"""
+    # not using run_local_command, would log every poll
+    proc = subprocess.run(['/opt/bess/bessctl/bessctl', 'show', 'pipeline'],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return proc.returncode == 0 and module in proc.stdout.decode('utf-8')
+
+def is_bess_running():
+    proc = subprocess.run(['pgrep', '-x', 'bessd'], stdout=subprocess.DEVNULL)
+    return proc.returncode == 0
+
 def start_bess(experiment, bess_config_name='active-middlebox-pmd'):
     cmd = '/opt/bess/bessctl/bessctl daemon start'
     try:
@@ -642,6 +713,26 @@ def start_bess(experiment, bess_config_name='active-middlebox-pmd'):
                bess_config_name, experiment.logs['description_log'])
     run_local_command(cmd)
 
+def set_queue_dump_file(dump_file, text=True, module='queue0'):
+    """Have the BESS queue module write its packet log to dump_file.
+
+    An empty dump_file closes the current log and goes back to logging to the
+    bessd log. Binary logs (text=False) can also be read by
+    data_analysis.queue_log.
+    """
+    cmd = ('/opt/bess/bessctl/bessctl command module {} set_dump_file '
+           'QueueCommandSetDumpFileArg '
+           '"{{\'dump_file\': \'{}\', \'text\': {}}}"').format(
+               module, dump_file, text)
+    run_local_command(cmd, check=True)
+
+def chown_queue_dump_file(dump_file):
+    """Give the queue log created by bessd (as root) to the user running cctestbed."""
+    if not os.path.exists(dump_file):
+        return
+    cmd = 'sudo chown {}:{} {}'.format(os.getuid(), os.getgid(), shlex.quote(dump_file))
+    run_local_command(cmd, check=True)
+
 def stop_bess():
     cmd = '/opt/bess/bessctl/bessctl daemon stop'
     try:
@@ -0,0 +1,306 @@
+"""
+Long running service that classifies batches of websites.
+
+classify_websites.py starts a new ccalg_predict.py and snakemake process for
+every website and every round of reruns, each importing pandas, paramiko etc.
+and loading the training flows again, and then scrapes their stdout for the
+experiments they ran. The service instead keeps one process running: jobs (a
+list of (website, url)) wait in a queue and a single worker runs them one at
+a time, since all experiments share the testbed. Experiments and the classify
+snakefile run in the worker's process, so imports, the training library and
+pooled ssh connections are reused across websites.
+
+Start the service on the BESS machine:
+python3.6 classify_service.py serve
+
+The service listens on a unix socket in ~/.cctestbed, which only the user can
+open, and clients must know the authkey in ~/.cctestbed/classify.authkey. The
+key is generated the first time it is needed; set CCTESTBED_CLASSIFY_AUTHKEY
+to use another one.
+
+Then submit websites and wait for their results:
+python3.6 classify_service.py classify --website cnn.com http://cnn.com/big.jpg
+
+or from Python:
+with ClassifyClient() as client:
+    job_id = client.submit([('cnn.com', 'http://cnn.com/big.jpg')])
+    job = client.wait(job_id)
+"""
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from logging.config import fileConfig
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import traceback
+
+import classify_websites
+from data_analysis.training_library import TRAINING_DIR, load_training_library
+
+# only the user can access this directory
+SERVICE_DIR = os.path.expanduser('~/.cctestbed')
+SERVICE_ADDRESS = os.environ.get('CCTESTBED_CLASSIFY_ADDRESS',
+                                 os.path.join(SERVICE_DIR, 'classify.sock'))
+AUTHKEY_PATH = os.path.join(SERVICE_DIR, 'classify.authkey')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+
+def get_authkey(path=None):
+    """Return key clients authenticate with, creating a random one if needed.
+
+    Connections unpickle what they receive, so the key must not be guessable
+    by other users: it is read from CCTESTBED_CLASSIFY_AUTHKEY or from a file
+    only the user can read.
+    """
+    authkey = os.environ.get('CCTESTBED_CLASSIFY_AUTHKEY')
+    if authkey:
+        return authkey.encode('utf-8')
+    if path is None:
+        path = AUTHKEY_PATH
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    with open(path) as f:
+        return f.read().strip().encode('utf-8')
+
+class ClassifyJob:
+    """Batch of websites to classify and their results so far"""
+    def __init__(self, job_id, websites, sequential=False):
+        self.job_id = job_id
+        self.websites = [tuple(website) for website in websites]
+        self.sequential = sequential
+        self.status = QUEUED
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        # one dict per website, in the order they were classified
+        self.results = []
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {'job_id': self.job_id,
+                'websites': self.websites,
+                'status': self.status,
+                'submit_time': self.submit_time,
+                'start_time': self.start_time,
+                'end_time': self.end_time,
+                'results': list(self.results)}
+
+class ClassifyService:
+    """Queue of classification jobs run one at a time by a worker thread.
+
+    Parameters:
+    -----------
+    sequential : bool
+       Default for jobs: only run network conditions until the majority label
+       is decided, see classify_websites.classify_website_sequential
+    training_dir : str
+       Training flows to load before the first job
+    """
+    def __init__(self, sequential=False, training_dir=TRAINING_DIR):
+        self.sequential = sequential
+        self.training_dir = training_dir
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def start(self):
+        # the classify snakefile gets the library from the same cache
+        training_library = load_training_library(self.training_dir)
+        logging.info('Loaded {} training flows'.format(len(training_library)))
+        self._worker = threading.Thread(target=self._run, name='classify-worker',
+                                        daemon=True)
+        self._worker.start()
+        return self
+
+    def stop(self):
+        """Stop after the running job; queued jobs are not run"""
+        self._queue.put(None)
+        if self._worker is not None:
+            self._worker.join()
+
+    def submit(self, websites, sequential=None):
+        """Queue list of (website, url) to classify; return job id"""
+        if sequential is None:
+            sequential = self.sequential
+        with self._lock:
+            job = ClassifyJob(next(self._job_ids), websites, sequential=sequential)
+            self.jobs[job.job_id] = job
+        self._queue.put(job)
+        logging.info('Queued job {} with {} websites'.format(job.job_id, len(job.websites)))
+        return job.job_id
+
+    def wait(self, job_id, timeout=None):
+        """Wait for job to finish; return its dict (status is not done on timeout)"""
+        job = self.jobs[job_id]
+        job.done.wait(timeout)
+        return job.to_dict()
+
+    def status(self, job_id=None):
+        """Return dict of job, or list of dicts of all jobs"""
+        if job_id is not None:
+            return self.jobs[job_id].to_dict()
+        return [job.to_dict() for job in self.jobs.values()]
+
+    def _classify(self, website, url, sequential):
+        try:
+            results_filename = classify_websites.classify_website(
+                website, url, sequential=sequential, in_process=True)
+            with open(results_filename) as f:
+                results = json.load(f)
+            results['results_filename'] = results_filename
+            return results
+        except Exception as e:
+            logging.exception(e)
+            return {'website': website, 'url': url, 'predicted_label': None,
+                    'error': traceback.format_exc()}
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.status = RUNNING
+            job.start_time = time.time()
+            logging.info('Running job {}'.format(job.job_id))
+            for website, url in job.websites:
+                job.results.append(self._classify(website, url, job.sequential))
+            job.status = DONE
+            job.end_time = time.time()
+            job.done.set()
+            logging.info('Finished job {} in {:.0f}s'.format(
+                job.job_id, job.end_time - job.start_time))
+
+def _handle_connection(service, conn):
+    """Answer requests from one client until it disconnects"""
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            try:
+                cmd = request['cmd']
+                if cmd == 'submit':
+                    reply = service.submit(request['websites'],
+                                           sequential=request.get('sequential'))
+                elif cmd == 'wait':
+                    reply = service.wait(request['job_id'], request.get('timeout'))
+                elif cmd == 'status':
+                    reply = service.status(request.get('job_id'))
+                else:
+                    raise ValueError('Unknown command: {}'.format(cmd))
+                conn.send({'ok': True, 'reply': reply})
+            except Exception as e:
+                conn.send({'ok': False, 'error': repr(e)})
+
+def serve(service, address=SERVICE_ADDRESS, authkey=None):
+    """Accept client connections forever, one thread per client"""
+    if authkey is None:
+        authkey = get_authkey()
+    if address == SERVICE_ADDRESS:
+        os.makedirs(os.path.dirname(address), mode=0o700, exist_ok=True)
+    if isinstance(address, str) and os.path.exists(address):
+        # left behind by a previous service
+        os.remove(address)
+    with Listener(address, authkey=authkey) as listener:
+        if isinstance(address, str):
+            # only the user can connect
+            os.chmod(address, 0o600)
+        logging.info('Classify service listening on {}'.format(address))
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logging.warning('Rejected client with the wrong authkey')
+                continue
+            threading.Thread(target=_handle_connection, args=(service, conn),
+                             daemon=True).start()
+
+class ClassifyClient:
+    """Connection to a running classify service, same methods as ClassifyService"""
+    def __init__(self, address=SERVICE_ADDRESS, authkey=None):
+        if authkey is None:
+            authkey = get_authkey()
+        self._conn = Client(address, authkey=authkey)
+
+    def _request(self, **request):
+        self._conn.send(request)
+        response = self._conn.recv()
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['reply']
+
+    def submit(self, websites, sequential=None):
+        return self._request(cmd='submit', websites=list(websites), sequential=sequential)
+
+    def wait(self, job_id, timeout=None):
+        return self._request(cmd='wait', job_id=job_id, timeout=timeout)
+
+    def status(self, job_id=None):
+        return self._request(cmd='status', job_id=job_id)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main(args):
+    if args.cmd == 'serve':
+        service = ClassifyService(sequential=args.sequential,
+                                  training_dir=args.training_dir).start()
+        try:
+            serve(service, address=args.address)
+        finally:
+            service.stop()
+    elif args.cmd == 'classify':
+        with ClassifyClient(address=args.address) as client:
+            job_id = client.submit(args.websites,
+                                   sequential=True if args.sequential else None)
+            print('Submitted job {}'.format(job_id))
+            print(json.dumps(client.wait(job_id), indent=2))
+    elif args.cmd == 'status':
+        with ClassifyClient(address=args.address) as client:
+            print(json.dumps(client.status(args.job_id), indent=2))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Long running service that classifies the congestion control algorithm of websites')
+    parser.add_argument('--address', default=SERVICE_ADDRESS,
+                        help='Unix socket the service listens on')
+    subparsers = parser.add_subparsers(dest='cmd')
+    subparsers.required = True
+    serve_parser = subparsers.add_parser('serve', help='Run the service')
+    serve_parser.add_argument('--training-dir', default=TRAINING_DIR, dest='training_dir')
+    serve_parser.add_argument('--sequential', action='store_true',
+                              help='Only run network conditions until the majority label is decided')
+    classify_parser = subparsers.add_parser('classify', help='Classify websites and wait for results')
+    classify_parser.add_argument('--website', nargs=2, action='append', required=True,
+                                 metavar=('WEBSITE', 'FILE_URL'), dest='websites')
+    classify_parser.add_argument('--sequential', action='store_true')
+    status_parser = subparsers.add_parser('status', help='Show status of jobs')
+    status_parser.add_argument('job_id', type=int, nargs='?', default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    fileConfig(classify_websites.LOGGING_CONFIG)
+    main(parse_args())
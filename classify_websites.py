@@ -1,7 +1,9 @@
 import argparse, logging
 import glob, json, os, re
-import shlex, subprocess
+import shlex, subprocess, time
 import matplotlib.pyplot as plt, numpy as np
+from data_analysis.experiment_catalog import ExperimentCatalog, REMOVED
+from data_analysis.training_library import load_training_library
 from datetime import datetime
 from logging.config import fileConfig
 
@@ -20,6 +22,11 @@ DATA_TRAINING = os.path.join(CURRENT_DIR, 'data-training')
 # Max number of times to rerun an experiment.
 RUN_LIMIT = 3
 
+# Network conditions (bw, rtt) ccalg_predict.py runs by default.
+NETWORK_CONDITIONS = [(5, 35), (5, 85), (5, 130), (5, 275),
+                      (10, 35), (10, 85), (10, 130), (10, 275),
+                      (15, 35), (15, 85), (15, 130), (15, 275)]
+
 # Parse the btlbw and rtt from an experiment name.
 def parse_network_conditions(exp_name):
     bw = r"^(\d+)bw"
@@ -29,15 +36,27 @@ def parse_network_conditions(exp_name):
 # Remove all files with the given experiment name.
 def remove_experiment(exp_name, exp_dir):
     pattern = '{}/{}*'
-    files = glob.glob(pattern.format(DATA_RAW, exp_name))
-    files.extend(glob.glob(pattern.format(DATA_TMP, exp_name)))
+    with ExperimentCatalog() as catalog:
+        experiment = catalog.get(exp_name)
+        if experiment is None:
+            # not cataloged, look for its files everywhere
+            files = glob.glob(pattern.format(DATA_RAW, exp_name))
+            files.extend(glob.glob(pattern.format(DATA_TMP, exp_name)))
+            files.extend(glob.glob(pattern.format('/tmp', exp_name)))
+        else:
+            files = [experiment['archive_path']]
+            for directory in [DATA_RAW, DATA_TMP, '/tmp']:
+                for suffix in ['.tar.gz', '.json', '.website.tar.gz']:
+                    files.append('{}/{}{}'.format(directory, exp_name, suffix))
+            catalog.set_state(exp_name, REMOVED)
+    # outputs of the classify snakefile
     files.extend(glob.glob(pattern.format(exp_dir, exp_name)))
-    files.extend(glob.glob(pattern.format('/tmp', exp_name)))
 
     logging.info('Removing files for experiment {}'.format(exp_name))
 
-    for f in files:
-        os.remove(f)
+    for f in set(files):
+        if os.path.isfile(f):
+            os.remove(f)
 
 
 def get_features(directory, exp_name, queue_size):
@@ -66,7 +85,8 @@ def plot_queue_occupancy(website, exp_names, exp_dir):
                 closest_training = results['closest_exp_name']
                 network_conditions = results['ntwrk_conditions']
 
-                training_features = get_features(DATA_TRAINING, closest_training, queue_size)
+                training_features = (load_training_library(DATA_TRAINING)
+                                     .features(closest_training) * queue_size).tolist()
                 exp_features = get_features(exp_dir, name, queue_size)
 
                 rtt = results['rtt']
@@ -100,49 +120,63 @@ def plot_queue_occupancy(website, exp_names, exp_dir):
 # which are marked invalid by classify_websites.snakefile up to 3 times. Of the final
 # labeled flows, labels the website with the majority label or marks as unknown if
 # no label has a majority.
-def classify_websites(websites):
+def classify_websites(websites, sequential=False, in_process=False):
     for website, url in websites:
-        logging.info('Starting classification for {} {}'.format(website, url))
         try:
-            # Make directory for results
-            today = datetime.now().strftime('%Y%m%dT%H%M%S')
-            exp_dir = '{}/{}'.format(DATA_PROCESSED, website + '-' + today)
-            if not os.path.exists(exp_dir):
-                os.makedirs(exp_dir)
-
-            completed_exps, invalid_exps = run_ccalg_predict(website, url, exp_dir)
-            logging.info('Valid experiments {}'.format(completed_exps.values()))
-            reruns = dict([(network, 1) for network in invalid_exps])
-
-            while len(reruns) > 0:
-                logging.info('Valid experiments {}'.format(completed_exps.values()))
-                network_conditions = []
-                for network, exp_name in invalid_exps.items():
-                    if reruns[network] == RUN_LIMIT:
-                        completed_exps[network] = exp_name
-                        reruns.pop(network)
-                    else:
-                        remove_experiment(exp_name, exp_dir)
-                        reruns[network] += 1
-                        network_conditions.append(network)
-
-                if len(network_conditions) > 0:
-                    logging.info('Rerunning network conditions {}'.format(network_conditions))
-                    labeled, invalid_exps = run_ccalg_predict(website, url, exp_dir, network_conditions)
-                    for network, exp_name in labeled.items():
-                        reruns.pop(network)
-                        completed_exps[network] = exp_name
-                        
-            logging.info('Completed classification experiments for website {} url {}'.format(website, url))
-            results_filename = output_results(website, url, completed_exps.values(), exp_dir)
-            
+            classify_website(website, url, sequential=sequential, in_process=in_process)
         except Exception as e:
             logging.exception(e)
             print(e)
 
+# Classify the CCA of a single website, see classify_websites. If in_process is
+# True, experiments and the classify snakefile run in this process instead of
+# in new ones. Returns the name of the results file.
+def classify_website(website, url, sequential=False, in_process=False):
+    logging.info('Starting classification for {} {}'.format(website, url))
+    # Make directory for results
+    today = datetime.now().strftime('%Y%m%dT%H%M%S')
+    exp_dir = '{}/{}'.format(DATA_PROCESSED, website + '-' + today)
+    if not os.path.exists(exp_dir):
+        os.makedirs(exp_dir)
+
+    if sequential:
+        completed_exps, summary = classify_website_sequential(website, url, exp_dir,
+                                                              in_process=in_process)
+        logging.info('Completed classification experiments for website {} url {}'.format(website, url))
+        return output_results(website, url, completed_exps.values(), exp_dir,
+                              sequential=summary)
+
+    completed_exps, invalid_exps = run_ccalg_predict(website, url, exp_dir,
+                                                     in_process=in_process)
+    logging.info('Valid experiments {}'.format(completed_exps.values()))
+    reruns = dict([(network, 1) for network in invalid_exps])
+
+    while len(reruns) > 0:
+        logging.info('Valid experiments {}'.format(completed_exps.values()))
+        network_conditions = []
+        for network, exp_name in invalid_exps.items():
+            if reruns[network] == RUN_LIMIT:
+                completed_exps[network] = exp_name
+                reruns.pop(network)
+            else:
+                remove_experiment(exp_name, exp_dir)
+                reruns[network] += 1
+                network_conditions.append(network)
+
+        if len(network_conditions) > 0:
+            logging.info('Rerunning network conditions {}'.format(network_conditions))
+            labeled, invalid_exps = run_ccalg_predict(website, url, exp_dir, network_conditions,
+                                                      in_process=in_process)
+            for network, exp_name in labeled.items():
+                reruns.pop(network)
+                completed_exps[network] = exp_name
+
+    logging.info('Completed classification experiments for website {} url {}'.format(website, url))
+    return output_results(website, url, completed_exps.values(), exp_dir)
+
 # Outputs the final classification for the given website using the experiments
 # in exp_names. Returns the name of the results file.
-def output_results(website, url, exp_names, exp_dir):
+def output_results(website, url, exp_names, exp_dir, sequential=None):
     predicted_label = predict_label(website, url, exp_names, exp_dir)
     results_filename = RESULTS_FILENAME.format(exp_dir, website)
     keys = ['predicted_label',
@@ -157,6 +191,8 @@ def output_results(website, url, exp_names, exp_dir):
                     'url': url,
                     'predicted_label': predicted_label,
                     'experiments': [] }
+        if sequential is not None:
+            results['sequential'] = sequential
 
         for name in exp_names:
             exp = { 'name': name }
@@ -189,24 +225,9 @@ def predict_label(website, url, exp_names, exp_dir):
     label_counts = {}
 
     for exp in exp_names:
-        results_filename = RESULTS_FILENAME.format(exp_dir, exp)
-        if os.path.isfile(results_filename):
-            with open(results_filename) as f:
-                results = json.load(f)
-                if results['mark_invalid']:
-                    logging.info('Experiment {} marked invalid'.format(exp))
-                    if 'unknown' in label_counts:
-                        label_counts['unknown'] += 1
-                    else:
-                        label_counts['unknown'] = 1
-                else:
-                    label = results['predicted_label']
-                    logging.info('Experiment {} labeled {}'.format(exp, label))
-
-                    if label in label_counts:
-                        label_counts[label] += 1
-                    else:
-                        label_counts[label] = 1
+        label = get_exp_label(exp, exp_dir)
+        if label is not None:
+            label_counts[label] = label_counts.get(label, 0) + 1
 
     predicted_label = max(label_counts, key=label_counts.get)
     if label_counts[predicted_label] > num_exps / 2:
@@ -214,17 +235,153 @@ def predict_label(website, url, exp_names, exp_dir):
 
     return 'unknown'
 
+# Returns the label of a single experiment: its predicted label, unknown if it
+# was marked invalid or None if it has no results.
+def get_exp_label(exp, exp_dir):
+    results_filename = RESULTS_FILENAME.format(exp_dir, exp)
+    if not os.path.isfile(results_filename):
+        return None
+    with open(results_filename) as f:
+        results = json.load(f)
+    if results['mark_invalid']:
+        logging.info('Experiment {} marked invalid'.format(exp))
+        return 'unknown'
+    label = results['predicted_label']
+    logging.info('Experiment {} labeled {}'.format(exp, label))
+    return label
+
+# Returns the label predict_label gives no matter how the num_remaining
+# experiments still to run turn out, or None if it isn't decided yet. Remaining
+# experiments can get any label, be invalid (unknown) or not run at all (ex.
+# website RTT too high), which leaves them out of the majority.
+def get_decided_label(label_counts, num_remaining):
+    num_exps = sum(label_counts.values())
+    labels = {label: count for label, count in label_counts.items() if label != 'unknown'}
+    for label, count in labels.items():
+        # even if every remaining experiment gets some other label
+        if count > (num_exps + num_remaining) / 2:
+            return label
+    # even if every remaining experiment gets the label closest to a majority
+    max_count = max(labels.values(), default=0)
+    if max_count + num_remaining <= (num_exps + num_remaining) / 2:
+        return 'unknown'
+    return None
+
+# Returns the fewest more experiments after which the majority could be decided.
+def get_num_to_decide(label_counts, num_remaining):
+    num_exps = sum(label_counts.values())
+    num_total = num_exps + num_remaining
+    labels = [count for label, count in label_counts.items() if label != 'unknown']
+    max_count = max(labels, default=0)
+    # the leading label gets all of the next experiments
+    num_for_label = int(num_total // 2) + 1 - max_count
+    # none of the next experiments get a label that could still win
+    num_for_unknown = int(np.ceil(max_count + num_remaining - num_total / 2))
+    return min(num_remaining, max(1, min(num_for_label, num_for_unknown)))
+
+# Returns network conditions sorted by how often their past experiments (in
+# results_dir) were valid, so the ones most likely to count towards the
+# majority run first. Conditions without history keep their order.
+def order_network_conditions(network_conditions, results_dir=DATA_PROCESSED):
+    num_valid = {}
+    num_exps = {}
+    for results_filename in glob.glob('{}/*/*.results'.format(results_dir)):
+        try:
+            with open(results_filename) as f:
+                results = json.load(f)
+            network = (results['btlbw'], results['rtt'])
+            mark_invalid = results['mark_invalid']
+        except (ValueError, KeyError, OSError):
+            # website results or unreadable file
+            continue
+        num_exps[network] = num_exps.get(network, 0) + 1
+        num_valid[network] = num_valid.get(network, 0) + (not mark_invalid)
+    def valid_rate(network):
+        # add-one smoothing, so conditions without history rank in the middle
+        return (num_valid.get(network, 0) + 1) / (num_exps.get(network, 0) + 2)
+    return sorted(network_conditions, key=valid_rate, reverse=True)
+
+# Classify a single website, running as few network conditions as needed to
+# decide its majority label. Each round runs the fewest conditions that could
+# decide the majority (reruns of invalid experiments first) and stops as soon
+# as the label can no longer change. Returns (completed, summary) where
+#   completed: dictionary mapping (bw, rtt) to experiment name of all final experiments
+#   summary: number of experiments run and estimated testbed minutes saved
+def classify_website_sequential(website, url, exp_dir, network_conditions=NETWORK_CONDITIONS,
+                                in_process=False):
+    pending = order_network_conditions(network_conditions)
+    runs = {network: 0 for network in pending}
+    completed_exps = {}
+    label_counts = {}
+    num_exps_run = 0
+    run_time = 0
+
+    while len(pending) > 0:
+        decided_label = get_decided_label(label_counts, len(pending))
+        if decided_label is not None:
+            logging.info('Label {} for website {} decided with {} network conditions left'.format(
+                decided_label, website, len(pending)))
+            break
+        batch = pending[:get_num_to_decide(label_counts, len(pending))]
+        logging.info('Running network conditions {}, label counts {}'.format(batch, label_counts))
+        start_time = time.time()
+        labeled, invalid_exps = run_ccalg_predict(website, url, exp_dir, batch,
+                                                  in_process=in_process)
+        run_time += time.time() - start_time
+        num_exps_run += len(batch)
+        for network in batch:
+            runs[network] += 1
+            pending.remove(network)
+            if network in labeled:
+                exp_name = labeled[network]
+            elif network in invalid_exps and runs[network] < RUN_LIMIT:
+                remove_experiment(invalid_exps[network], exp_dir)
+                # rerun before starting new network conditions
+                pending.insert(0, network)
+                continue
+            elif network in invalid_exps:
+                exp_name = invalid_exps[network]
+            else:
+                # ccalg_predict.py skipped it, doesn't count towards majority
+                continue
+            completed_exps[network] = exp_name
+            label = get_exp_label(exp_name, exp_dir)
+            label_counts[label] = label_counts.get(label, 0) + 1
+
+    minutes_per_exp = run_time / 60 / num_exps_run if num_exps_run > 0 else 0
+    summary = {'num_experiments_run': num_exps_run,
+               'network_conditions_not_run': [list(network) for network in pending],
+               'minutes_saved': round(len(pending) * minutes_per_exp, 1)}
+    logging.info('Sequential classification of {} ran {} experiments, saved {} testbed minutes'.format(
+        website, num_exps_run, summary['minutes_saved']))
+    print('Saved {} testbed minutes for website {}'.format(summary['minutes_saved'], website))
+    return completed_exps, summary
+
 # Run ccalg_predict.py for a single website and the given network conditions and
 # classifies each of the resulting experiments. Returns (labeled, invalid) where
 #   labeled: dictionary mapping (bw, rtt) to experiment name of all labeled experiments
 #   invalid: dictionary mapping (bw, rtt) to experiment name of all invalid experiments
-def run_ccalg_predict(website, url, exp_dir, network_conditions=[], skip_predict=False):
+def run_ccalg_predict(website, url, exp_dir, network_conditions=[], skip_predict=False,
+                      in_process=False):
     exp_names = []
     if skip_predict:
         logging.info('Grabbing experiments from /tmp/data-raw')
         for exp in os.listdir(DATA_RAW):
             if exp.endswith('.tar.gz'):
                 exp_names.append(exp[:exp.index('.tar')])
+    elif in_process:
+        # imported here so the command line doesn't need paramiko etc. until used
+        import ccalg_predict
+        from cctestbed_pipeline import ExperimentPipeline
+        logging.info('Running experiments for network conditions {}'.format(network_conditions))
+        with ExperimentPipeline() as pipeline:
+            ran_exps = ccalg_predict.run_website_experiments(
+                website, url, pipeline, ntwrk_conditions=network_conditions or None,
+                force=True)
+        failed = set(pipeline.failed)
+        for exp in ran_exps:
+            if exp not in failed and os.path.exists('{}/{}.tar.gz'.format(DATA_RAW, exp)):
+                exp_names.append(exp)
     else:
         logging.info('Running ccalg_predict.py for network conditions {}'.format(network_conditions))
         network_arg = ' '.join(['--network {} {}'.format(bw, rtt) for bw, rtt in network_conditions])
@@ -249,20 +406,33 @@ def run_ccalg_predict(website, url, exp_dir, network_conditions=[], skip_predict
 
     logging.info('Ran experiments {}'.format(exp_names))
 
-    return run_classify_snakefile(exp_names, exp_dir)
+    return run_classify_snakefile(exp_names, exp_dir, in_process=in_process)
 
 
 # Runs classify_websites.snakefile for the given experiment names and returns a list
 # of the experiment names which were marked invalid. Returns (labeled, invalid) where
 #   labeled: dictionary mapping (bw, rtt) to experiment name of all labeled experiments
 #   invalid: dictionary mapping (bw, rtt) to experiment name of all invalid experiments
-def run_classify_snakefile(exp_names, exp_dir):
+def run_classify_snakefile(exp_names, exp_dir, in_process=False):
     logging.info('Running classify snakefile for {}'.format(exp_names))
-    cmd = 'snakemake --config exp_name="{}" results_dir="{}" -s {} --latency-wait 10'.format(
-            ' '.join(exp_names), exp_dir, CLASSIFY_SNAKEFILE)
-    args = shlex.split(cmd)
-    process = subprocess.run(args, stdout=subprocess.PIPE)
-    if process.returncode != 0:
+    if in_process:
+        from snakemake import snakemake
+        # the snakefile changes the working directory
+        cwd = os.getcwd()
+        try:
+            success = snakemake(CLASSIFY_SNAKEFILE,
+                                config={'exp_name': ' '.join(exp_names),
+                                        'results_dir': exp_dir},
+                                latency_wait=10, quiet=True)
+        finally:
+            os.chdir(cwd)
+    else:
+        cmd = 'snakemake --config exp_name="{}" results_dir="{}" -s {} --latency-wait 10'.format(
+                ' '.join(exp_names), exp_dir, CLASSIFY_SNAKEFILE)
+        args = shlex.split(cmd)
+        process = subprocess.run(args, stdout=subprocess.PIPE)
+        success = process.returncode == 0
+    if not success:
         raise Exception('classify_websites.snakefile failed on {}'.format('\n'.join(exp_names)))
 
     invalid = {}
@@ -291,6 +461,10 @@ def parse_args():
             required='True',
             metavar=('WEBSITE', 'FILE_URL'),
             dest='websites')
+    parser.add_argument(
+            '--sequential',
+            action='store_true',
+            help='Only run network conditions until the majority label is decided')
     args = parser.parse_args()
     return args
 
@@ -298,4 +472,4 @@ def parse_args():
 if __name__ == '__main__':
     fileConfig(LOGGING_CONFIG)
     args = parse_args()
-    classify_websites(args.websites)
+    classify_websites(args.websites, sequential=args.sequential)
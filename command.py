@@ -3,6 +3,10 @@ import subprocess
 import paramiko
 import logging
 import shlex
+import socket
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing, contextmanager, ExitStack
 import os
 
@@ -14,7 +18,8 @@ class RemoteCommand:
     """Command to run on a remote machine in the background"""
     def __init__(self, cmd, ip_addr, username,
                  stdout='/dev/null', stdin='/dev/null', stderr='/dev/null', logs=[],
-                 cleanup_cmd=None, sudo=False, key_filename=None, pgrep_string=None):
+                 cleanup_cmd=None, sudo=False, key_filename=None, pgrep_string=None,
+                 compress_logs=False):
         self.cmd = cmd.strip()
         self.ip_addr = ip_addr
         self.stdout = stdout
@@ -28,6 +33,8 @@ class RemoteCommand:
         self.exit_stack = ExitStack()
         self.pgrep_string = pgrep_string
         self.pid = None
+        # gzip logs on the remote machine while copying them back
+        self.compress_logs = compress_logs
         
     def _get_ssh_client(self):
         return get_ssh_client(self.ip_addr, self.username, self.key_filename)
@@ -44,6 +51,10 @@ class RemoteCommand:
         return exit_code == 0
         
         
+    def is_running(self):
+        """Return True if the command started by __call__ is still running"""
+        return self.pid is not None and self._is_running()
+
     def _wait(self):
         while self._is_running():
             time.sleep(1)
@@ -79,40 +90,19 @@ class RemoteCommand:
         logging.info('Done cleaning up cmd ({}): {}'.format(self.ip_addr, self.cmd))
             
     def _cleanup_logs(self):
-        with ExitStack() as stack:
-            scp_procs = []
-            for log in self.logs:
-                logging.info('Copying remote file ({}): {}'.format(self.ip_addr,
-                                                                   log))
-                if self.key_filename is None:
-                    cmd = 'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null {}@{}:{} /tmp/'.format(self.username, self.ip_addr,
-                                                os.path.join('/tmp', log))
-                else:
-                    cmd = 'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -i {} {}@{}:{} /tmp/'.format(self.key_filename, self.username,
-                                                      self.ip_addr,
-                                                      os.path.join('/tmp',log))
-                logging.info('Starting local cmd: {}'.format(cmd))
-                proc = subprocess.Popen(shlex.split(cmd),
-                                        stdout = subprocess.DEVNULL,
-                                        stderr=subprocess.PIPE)
-                stack.callback(proc.kill) # should always kill process if there is an error
-                scp_procs.append(proc)
-
-            for proc in scp_procs:
-                logging.info('Waiting for remote file to finish copying: {}'.format(proc.args[-1]))
-                # NOTE: NO TIMEOUT SO THIS COULD HANG FOREVER
-                proc.wait() 
-                if proc.returncode != 0:
-                    logging.warning('Could not find file "{}" on remote server "{}"'.format(log, self.ip_addr))
-                    logging.warning(proc.stderr.read())
-                else:
-                    logging.info('Remove remote file ({}): {}'.format(self.ip_addr,
-                                                                      log))
-                    with self._get_ssh_client() as ssh_client:
-                        rm_cmd = 'rm {}'.format(log)
-                        if self.sudo:
-                            rm_cmd = 'sudo rm {}'.format(log)
-                        exec_command(ssh_client, self.ip_addr, rm_cmd)
+        if len(self.logs) == 0:
+            return
+        with self._get_ssh_client() as ssh_client:
+            logs = [os.path.join('/tmp', log) for log in self.logs]
+            copied_logs = fetch_remote_files(ssh_client, self.ip_addr, logs,
+                                             compress=self.compress_logs)
+            if len(copied_logs) > 0:
+                # remove all copied logs at once
+                rm_cmd = 'rm -f {}'.format(' '.join(shlex.quote(log) for log in copied_logs))
+                if self.sudo:
+                    rm_cmd = 'sudo {}'.format(rm_cmd)
+                _, stdout, _ = exec_command(ssh_client, self.ip_addr, rm_cmd)
+                stdout.channel.recv_exit_status()
     
     @contextmanager
     def __call__(self):
@@ -164,6 +154,188 @@ class RemoteCommand:
     def __repr__(self):
         return 'RemoteCommand({})'.format(self.__str__())
 
+class RemoteCommands:
+    """Group of RemoteCommands that are started and cleaned up concurrently.
+
+    Each command still blocks on its own ssh round trips, but all the commands
+    passed to one start() call wait on them at the same time, so starting or
+    cleaning up a group takes about as long as its slowest command.
+
+    Use as a context manager; all started commands are cleaned up on exit.
+    """
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._started = []
+
+    def _map(self, func, items):
+        """Run func on every item in parallel; return (results, exceptions)"""
+        if len(items) == 0:
+            return [], []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            futures = [executor.submit(func, item) for item in items]
+        results, errors = [], []
+        for future in futures:
+            error = future.exception()
+            results.append(None if error else future.result())
+            errors.append(error)
+        return results, errors
+
+    def start(self, *remote_cmds):
+        """Start remote_cmds concurrently; return their PIDs.
+
+        If any command fails to start, every command in the group is cleaned
+        up and the first error is raised.
+        """
+        contexts = [remote_cmd() for remote_cmd in remote_cmds]
+        pids, errors = self._map(lambda context: context.__enter__(), contexts)
+        self._started += [context for context, error in zip(contexts, errors)
+                          if error is None]
+        for error in errors:
+            if error is not None:
+                self.close()
+                raise error
+        return pids
+
+    def close(self):
+        """Clean up all started commands concurrently"""
+        started, self._started = self._started, []
+        _, errors = self._map(lambda context: context.__exit__(None, None, None),
+                              started)
+        errors = [error for error in errors if error is not None]
+        for error in errors:
+            logging.error('Error cleaning up remote command: {}'.format(error))
+        if errors:
+            raise errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# max number of files copied from one machine at the same time
+FETCH_WORKERS = 4
+# seconds a copy can go without receiving any data before it is retried
+FETCH_TIMEOUT = 60
+FETCH_RETRIES = 3
+# suffix of files fetch_remote_files(partial=True) is still copying
+PARTIAL_SUFFIX = '.part'
+_FETCH_BUFSIZE = 1 << 20
+
+def _fetch_sftp(ssh_client, remotepath, localpath, timeout, resume=False):
+    """Copy remotepath over sftp, appending to localpath if resuming"""
+    with closing(ssh_client.open_sftp()) as sftp:
+        sftp.get_channel().settimeout(timeout)
+        remote_size = sftp.stat(remotepath).st_size
+        offset = 0
+        if resume and os.path.isfile(localpath):
+            offset = os.path.getsize(localpath)
+            if offset > remote_size:
+                offset = 0
+        with sftp.open(remotepath, 'rb') as remote_file, \
+             open(localpath, 'ab' if offset > 0 else 'wb') as local_file:
+            remote_file.seek(offset)
+            # request all chunks up front instead of one round trip per read
+            remote_file.prefetch(remote_size)
+            while True:
+                buf = remote_file.read(_FETCH_BUFSIZE)
+                if not buf:
+                    break
+                local_file.write(buf)
+    if os.path.getsize(localpath) != remote_size:
+        raise EOFError('Copied {} of {} bytes of {}'.format(
+            os.path.getsize(localpath), remote_size, remotepath))
+
+# exit status of the gzip fetch when the remote file doesn't exist (EX_NOINPUT)
+_MISSING_FILE_STATUS = 66
+
+def _fetch_gzip(ssh_client, remotepath, localpath, timeout):
+    """Copy remotepath gzipped on the fly; localpath is written uncompressed.
+
+    The file is decompressed into localpath.part and only renamed to localpath
+    once the whole stream was read and gzip exited cleanly, so a failed copy
+    leaves no localpath behind.
+    """
+    quoted = shlex.quote(remotepath)
+    _, stdout, stderr = ssh_client.exec_command(
+        '[ -f {0} ] || exit {1}; gzip -c {0}'.format(quoted, _MISSING_FILE_STATUS),
+        timeout=timeout)
+    partpath = localpath + PARTIAL_SUFFIX
+    try:
+        decompressor = zlib.decompressobj(31)
+        with open(partpath, 'wb') as local_file:
+            while True:
+                buf = stdout.read(_FETCH_BUFSIZE)
+                if not buf:
+                    break
+                local_file.write(decompressor.decompress(buf))
+            local_file.write(decompressor.flush())
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status == _MISSING_FILE_STATUS:
+            raise FileNotFoundError('No such file: {}'.format(remotepath))
+        if exit_status != 0:
+            raise IOError('gzip of {} exited with status {}: {}'.format(
+                remotepath, exit_status, stderr.read().decode('utf-8').strip()))
+        if not decompressor.eof:
+            raise EOFError('Compressed stream of {} ended early'.format(remotepath))
+        os.replace(partpath, localpath)
+    except zlib.error as e:
+        raise IOError('Corrupt compressed stream of {}: {}'.format(remotepath, e))
+    finally:
+        if os.path.exists(partpath):
+            os.remove(partpath)
+
+def fetch_remote_files(ssh_client, ip_addr, remotepaths, local_dir='/tmp',
+                       compress=False, workers=FETCH_WORKERS,
+                       timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES,
+                       partial=False):
+    """Copy files from remote machine to local_dir in parallel.
+
+    Files are streamed over the ssh_client's transport, at most workers at a
+    time. A copy that fails or stalls for timeout seconds is retried up to
+    retries times, resuming where it left off (unless compressing).
+
+    Files are copied to {name}.part and only renamed once complete. If partial
+    is True, a .part file left by an earlier call is resumed and a failed copy
+    keeps its .part file for the next call; otherwise it is deleted.
+
+    Returns list of the remotepaths that were copied.
+    """
+    def fetch(remotepath):
+        localpath = os.path.join(local_dir, os.path.basename(remotepath))
+        partpath = localpath + PARTIAL_SUFFIX
+        try:
+            for attempt in range(retries):
+                logging.info('Copying remote file ({}): {}'.format(ip_addr, remotepath))
+                try:
+                    if compress:
+                        _fetch_gzip(ssh_client, remotepath, localpath, timeout)
+                    else:
+                        # a .part file left by an earlier call is only resumed
+                        # if partial, retries always resume
+                        _fetch_sftp(ssh_client, remotepath, partpath, timeout,
+                                    resume=(partial or attempt > 0))
+                        os.replace(partpath, localpath)
+                    return True
+                except FileNotFoundError as e:
+                    logging.warning('Could not find file "{}" on remote server "{}"'.format(
+                        remotepath, ip_addr))
+                    return False
+                except (IOError, EOFError, socket.error, paramiko.SSHException) as e:
+                    logging.warning('Error copying file "{}" from "{}" (attempt {}/{}): {}'.format(
+                        remotepath, ip_addr, attempt + 1, retries, e))
+            return False
+        finally:
+            # unless partial, a failed copy leaves nothing behind
+            if not partial and os.path.exists(partpath):
+                os.remove(partpath)
+
+    if len(remotepaths) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(remotepaths))) as executor:
+        copied = list(executor.map(fetch, remotepaths))
+    return [remotepath for remotepath, ok in zip(remotepaths, copied) if ok]
+
 def run_local_command(cmd, shell=False, timeout=None, check=False):
     """Run local command return stdout"""
     logging.info('Running cmd: {}'.format(cmd))
@@ -175,16 +347,96 @@ def run_local_command(cmd, shell=False, timeout=None, check=False):
                               timeout=timeout, check=check)
     return proc.stdout.decode('utf-8')
 
+# seconds between keepalive packets on pooled ssh connections
+SSH_KEEPALIVE = 30
+
+class SSHClientPool:
+    """Long-lived ssh connections, one per (ip_addr, username, key_filename).
+
+    Every command run on a host opens a new channel on the same transport
+    instead of doing a new TCP + key exchange. Connections that have died are
+    replaced the next time they are asked for.
+    """
+    def __init__(self, keepalive=SSH_KEEPALIVE):
+        self.keepalive = keepalive
+        self._clients = {}
+        self._connect_locks = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # connections can't be shared with forked processes (ex. mp.Pool),
+        # the child starts its own pool and leaves the parent's alone
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._connect_locks = {}
+            self._pid = os.getpid()
+
+    def _connect(self, ip_addr, username, key_filename):
+        logging.info('Opening ssh connection to {}@{}'.format(username, ip_addr))
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            ssh_client.connect(ip_addr, username=username, key_filename=key_filename,
+                               banner_timeout=60, auth_timeout=60, timeout=60)
+        except Exception:
+            ssh_client.close()
+            raise
+        ssh_client.get_transport().set_keepalive(self.keepalive)
+        return ssh_client
+
+    def get(self, ip_addr, username, key_filename=None):
+        """Return connected client, opening a new connection if needed"""
+        key = (ip_addr, username, key_filename)
+        with self._lock:
+            self._check_pid()
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+        # only hold the lock for this host while connecting to it
+        with connect_lock:
+            ssh_client = self._clients.get(key)
+            if ssh_client is not None:
+                transport = ssh_client.get_transport()
+                if transport is not None and transport.is_active():
+                    return ssh_client
+                logging.warning('Lost ssh connection to {}@{}, reconnecting'.format(
+                    username, ip_addr))
+                ssh_client.close()
+            ssh_client = self._connect(ip_addr, username, key_filename)
+            self._clients[key] = ssh_client
+            return ssh_client
+
+    def discard(self, ssh_client):
+        """Close client and remove it from the pool"""
+        with self._lock:
+            for key, pooled_client in list(self._clients.items()):
+                if pooled_client is ssh_client:
+                    del self._clients[key]
+        ssh_client.close()
+
+    def close(self):
+        """Close all connections"""
+        with self._lock:
+            self._check_pid()
+            clients = list(self._clients.values())
+            self._clients = {}
+        for ssh_client in clients:
+            ssh_client.close()
+
+SSH_CLIENT_POOL = SSHClientPool()
+
+def close_ssh_clients():
+    SSH_CLIENT_POOL.close()
+
 @contextmanager
 def get_ssh_client(ip_addr, username, key_filename=None):
+    """Yield pooled ssh client for this host; it stays open after the with block"""
+    ssh_client = SSH_CLIENT_POOL.get(ip_addr, username, key_filename)
     try:
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh_client.connect(ip_addr, username=username, key_filename=key_filename,
-                           banner_timeout=60, auth_timeout=60, timeout=60)
         yield ssh_client
-    finally:
-        ssh_client.close()
+    except (paramiko.SSHException, socket.error, EOFError):
+        # don't hand out a connection that might be broken again
+        SSH_CLIENT_POOL.discard(ssh_client)
+        raise
 
 def exec_command(ssh_client, ip_addr, cmd):
     logging.info('Running cmd ({}): {}'.format(ip_addr, cmd))
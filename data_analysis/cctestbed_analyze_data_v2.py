@@ -12,6 +12,9 @@ sys.path.insert(0, CODEPATH)
 from collections import namedtuple, Counter, defaultdict
 from contextlib import contextmanager
 import cctestbedv2 as cctestbed
+from data_analysis.pcap import analyze_pcap, write_tcpdump_fields
+from data_analysis.tcpprobe import (read_tcpprobe, process_tcpprobe, store_tcpprobe,
+                                     load_tcpprobe, get_endpoint, get_endpoint_port)
 import matplotlib.pyplot as plt
 import pandas as pd
 import datetime as dt
@@ -241,33 +244,19 @@ class ExperimentAnalyzer:
 
     @property
     def df_tcpprobe(self):
-        MICROSECONDS_TO_MILLISECONDS = 1.0 / 1000
         tcpprobe_log_tarpath = self.experiment.logs['tcpprobe_log']
         tcpprobe_log_localpath = os.path.join(DATAPATH_PROCESSED,
-                                            '{}.csv'.format(os.path.join(tcpprobe_log_tarpath[:-len('.txt')])))
+                                            '{}.h5'.format(os.path.join(os.path.splitext(tcpprobe_log_tarpath)[0])))
         if (self._df_tcpprobe is None) or (not os.path.isfile(tcpprobe_log_localpath)):
             if not os.path.isfile(tcpprobe_log_localpath):
-                with untarfile(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as f:
-                    tcpprobe = pd.read_csv(f, sep='\s+', header=None,
-                                names=['time','sender','receiver','bytes','next',
-                                        'unack','cwnd','ssthresh','swnd','srtt',
-                                        'rwnd', 'bbr_bw_lo','bbr_bw_hi','bbr_min_rtt',
-                                        'bbr_pacing_gain','bbr_cwnd_gain'])
-
-                    tcpprobe['bbr_bw_lo'] = (tcpprobe['bbr_bw_lo']*715) / 1e6
-                    tcpprobe['bbr_pacing_gain'] = tcpprobe['bbr_pacing_gain'] / 256
-                    tcpprobe['bbr_cwnd_gain'] = tcpprobe['bbr_cwnd_gain'] / 256
-                    tcpprobe['bbr_min_rtt'] = tcpprobe['bbr_min_rtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['srtt'] = tcpprobe['srtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['time'] = tcpprobe['time'].apply(lambda x: dt.timedelta(seconds=x))
-                    tcpprobe = tcpprobe.set_index('time')
-                    senders = ['192.0.0.1:{}'.format(port) for port in  self.flow_sender_ports.keys()]
-                    tcpprobe = tcpprobe[tcpprobe.sender.isin(senders)]
-                    tcpprobe.to_csv(tcpprobe_log_localpath, header=True)
+                with untarfile_extract(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as tcpprobe_log_raw_localpath:
+                    # binary or text log, whichever the experiment wrote
+                    tcpprobe = read_tcpprobe(tcpprobe_log_raw_localpath)
+                senders = [get_endpoint('192.0.0.1', port) for port in self.flow_sender_ports.keys()]
+                tcpprobe = process_tcpprobe(tcpprobe, senders=senders)
+                store_tcpprobe(tcpprobe, tcpprobe_log_localpath)
             else:
-                with open(tcpprobe_log_localpath) as f:
-                    tcpprobe = pd.read_csv(f, header=0, index_col = 'time')
-                    tcpprobe.index = pd.to_datetime(tcpprobe.index)
+                tcpprobe = load_tcpprobe(tcpprobe_log_localpath)
             self._df_tcpprobe = tcpprobe
         return self._df_tcpprobe
 
@@ -280,11 +269,8 @@ class ExperimentAnalyzer:
                 with open(tcpdump_client_processed_localpath, 'w') as f:
                     f.write('frame.time_relative,tcp.len,tcp.srcport,tcp.seq,tcp.analysis,ack_rtt\n')
                 with untarfile_extract(self.experiment.tarfile_localpath, tcpdump_client_tarpath) as tcpdump_client_raw_localpath:
-                    cmd = 'tshark -T fields -E separator=, -E quote=d -r {} -e frame.time_relative -e tcp.len -e tcp.srcport -e tcp.seq -e tcp.analysis.ack_rtt >> {}'.format(
-                                            tcpdump_client_raw_localpath, tcpdump_client_processed_localpath)
-                    proc = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-                    if proc.returncode != 0:
-                        raise RuntimeError('Encountered error running cmd {}\n{}'.format(cmd, proc.stderr.decode('utf-8')))
+                    write_tcpdump_fields(analyze_pcap(tcpdump_client_raw_localpath),
+                                         tcpdump_client_processed_localpath)
             with open(tcpdump_client_processed_localpath) as f:
                 self._df_tcpdump_client = pd.read_csv(f, header=0, skipinitialspace=True)
         return self._df_tcpdump_client
@@ -567,7 +553,8 @@ def get_tcpprobe_columns_per_flow(experiment_analyzer, col):
     """
     #assert(type(cols) is list)
     tcpprobe = experiment_analyzer.df_tcpprobe.copy()
-    tcpprobe['sender'] = tcpprobe['sender'].apply(lambda x: x.split(':')[-1])
+    # flow_sender_ports & flow_names are keyed by str port
+    tcpprobe['sender'] = get_endpoint_port(tcpprobe['sender']).astype(str)
     tcpprobe = tcpprobe.pivot(columns='sender', values=col)
     flow_sender_ports = list(experiment_analyzer.flow_sender_ports.keys())
     tcpprobe = tcpprobe[flow_sender_ports].rename(columns=experiment_analyzer.flow_names)
@@ -830,33 +817,19 @@ class ExperimentAnalyzer:
 
     @property
     def df_tcpprobe(self):
-        MICROSECONDS_TO_MILLISECONDS = 1.0 / 1000
         tcpprobe_log_tarpath = self.experiment.logs['tcpprobe_log']
         tcpprobe_log_localpath = os.path.join(DATAPATH_PROCESSED,
-                                            '{}.csv'.format(os.path.join(tcpprobe_log_tarpath[:-len('.txt')])))
+                                            '{}.h5'.format(os.path.join(os.path.splitext(tcpprobe_log_tarpath)[0])))
         if (self._df_tcpprobe is None) or (not os.path.isfile(tcpprobe_log_localpath)):
             if not os.path.isfile(tcpprobe_log_localpath):
-                with untarfile(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as f:
-                    tcpprobe = pd.read_csv(f, sep='\s+', header=None,
-                                names=['time','sender','receiver','bytes','next',
-                                        'unack','cwnd','ssthresh','swnd','srtt',
-                                        'rwnd', 'bbr_bw_lo','bbr_bw_hi','bbr_min_rtt',
-                                        'bbr_pacing_gain','bbr_cwnd_gain'])
-
-                    tcpprobe['bbr_bw_lo'] = (tcpprobe['bbr_bw_lo']*715) / 1e6
-                    tcpprobe['bbr_pacing_gain'] = tcpprobe['bbr_pacing_gain'] / 256
-                    tcpprobe['bbr_cwnd_gain'] = tcpprobe['bbr_cwnd_gain'] / 256
-                    tcpprobe['bbr_min_rtt'] = tcpprobe['bbr_min_rtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['srtt'] = tcpprobe['srtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['time'] = tcpprobe['time'].apply(lambda x: dt.timedelta(seconds=x))
-                    tcpprobe = tcpprobe.set_index('time')
-                    senders = ['192.0.0.1:{}'.format(port) for port in  self.flow_sender_ports.keys()]
-                    tcpprobe = tcpprobe[tcpprobe.sender.isin(senders)]
-                    tcpprobe.to_csv(tcpprobe_log_localpath, header=True)
+                with untarfile_extract(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as tcpprobe_log_raw_localpath:
+                    # binary or text log, whichever the experiment wrote
+                    tcpprobe = read_tcpprobe(tcpprobe_log_raw_localpath)
+                senders = [get_endpoint('192.0.0.1', port) for port in self.flow_sender_ports.keys()]
+                tcpprobe = process_tcpprobe(tcpprobe, senders=senders)
+                store_tcpprobe(tcpprobe, tcpprobe_log_localpath)
             else:
-                with open(tcpprobe_log_localpath) as f:
-                    tcpprobe = pd.read_csv(f, header=0, index_col = 'time')
-                    tcpprobe.index = pd.to_datetime(tcpprobe.index)
+                tcpprobe = load_tcpprobe(tcpprobe_log_localpath)
             self._df_tcpprobe = tcpprobe
         return self._df_tcpprobe
 
@@ -869,11 +842,8 @@ class ExperimentAnalyzer:
                 with open(tcpdump_client_processed_localpath, 'w') as f:
                     f.write('frame.time_relative,tcp.len,tcp.srcport,tcp.seq,tcp.analysis,ack_rtt\n')
                 with untarfile_extract(self.experiment.tarfile_localpath, tcpdump_client_tarpath) as tcpdump_client_raw_localpath:
-                    cmd = 'tshark -T fields -E separator=, -E quote=d -r {} -e frame.time_relative -e tcp.len -e tcp.srcport -e tcp.seq -e tcp.analysis.ack_rtt >> {}'.format(
-                                            tcpdump_client_raw_localpath, tcpdump_client_processed_localpath)
-                    proc = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-                    if proc.returncode != 0:
-                        raise RuntimeError('Encountered error running cmd {}\n{}'.format(cmd, proc.stderr.decode('utf-8')))
+                    write_tcpdump_fields(analyze_pcap(tcpdump_client_raw_localpath),
+                                         tcpdump_client_processed_localpath)
             with open(tcpdump_client_processed_localpath) as f:
                 self._df_tcpdump_client = pd.read_csv(f, header=0, skipinitialspace=True)
         return self._df_tcpdump_client
@@ -1156,7 +1126,8 @@ def get_tcpprobe_columns_per_flow(experiment_analyzer, col):
     """
     #assert(type(cols) is list)
     tcpprobe = experiment_analyzer.df_tcpprobe.copy()
-    tcpprobe['sender'] = tcpprobe['sender'].apply(lambda x: x.split(':')[-1])
+    # flow_sender_ports & flow_names are keyed by str port
+    tcpprobe['sender'] = get_endpoint_port(tcpprobe['sender']).astype(str)
     tcpprobe = tcpprobe.pivot(columns='sender', values=col)
     flow_sender_ports = list(experiment_analyzer.flow_sender_ports.keys())
     tcpprobe = tcpprobe[flow_sender_ports].rename(columns=experiment_analyzer.flow_names)
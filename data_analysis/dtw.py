@@ -0,0 +1,336 @@
+"""
+Dynamic time warping (DTW) nearest neighbour search used to classify flows.
+
+A flow is labeled with the congestion control algorithm of the training flow
+its queue occupancy is closest to. Instead of computing the DTW distance to
+every training flow, candidates are ordered by cheap lower bounds (LB_Kim and
+LB_Keogh) and the DTW of each candidate is abandoned as soon as it can't beat
+the closest flow found so far. Candidates whose lower bound is already larger
+than the closest distance are never computed at all.
+
+The distance is the same as fastdtw.dtw(x, y)[0]: the sum of |x_i - y_j| along
+the cheapest warping path. Matrix rows are computed with NumPy instead of one
+cell at a time in Python, for many series at once with dtw_distances. An
+optional Sakoe-Chiba window limits how far the path can stray from the
+diagonal, which also limits how much of each row has to be computed.
+
+Two things differ from the old compute_dtw rules, which computed every
+distance and then took idxmin over the CCAS columns:
+
+- Training flows that were pruned have a distance of None (null in the
+  .classify and .results files) instead of their DTW distance. Pruned flows
+  are always farther than the closest one, but their distance is unknown.
+- Ties go to the training flow that comes first in training_flows (the
+  training library's order), not to the ccalg that comes first in CCAS.
+"""
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import pandas as pd
+
+def _as_series(x):
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim != 1 or len(x) == 0:
+        raise ValueError('DTW needs a non-empty 1-D series')
+    return x
+
+def _as_batch(Y):
+    Y = np.asarray(Y, dtype=np.float64)
+    if Y.ndim == 1:
+        Y = Y[np.newaxis]
+    if Y.ndim != 2 or Y.shape[1] == 0:
+        raise ValueError('DTW needs a non-empty series or 2-D array of series')
+    return Y
+
+def _get_window(window, n, m):
+    """Return Sakoe-Chiba band width, wide enough to reach the last cell"""
+    if window is None:
+        return max(n, m)
+    if window < 0:
+        raise ValueError('DTW window must be >= 0')
+    return max(int(window), abs(n - m))
+
+def _dtw_rows(x, Y, window=None, max_distance=np.inf):
+    """DTW distances from series x to every row of Y.
+
+    Computes one row of the cost matrix at a time for all of Y at once. Only
+    cells with |i - j| <= window are computed, every other cell is inf.
+    """
+    n, m = len(x), Y.shape[1]
+    window = _get_window(window, n, m)
+    row = np.full(Y.shape, np.inf)
+    prev = np.full(Y.shape, np.inf)
+    hi = min(m, window + 1)
+    row[:, :hi] = np.cumsum(np.abs(x[0] - Y[:, :hi]), axis=1)
+    prev_lo, prev_hi = 0, hi
+    for i in range(1, n):
+        # every warping path goes through this row & costs are never negative
+        if (row.min(axis=1) > max_distance).all():
+            return np.full(len(Y), np.inf)
+        lo, hi = max(0, i - window), min(m, i + window + 1)
+        # prev buffer still holds row i-2, reuse it for row i
+        row, prev = prev, row
+        row[:, prev_lo:prev_hi] = np.inf
+        # D[i,j] = c[j] + min(D[i,j-1], D[i-1,j], D[i-1,j-1]), which unrolls
+        # to min over k <= j of (min(D[i-1,k], D[i-1,k-1]) + c[k] + ... + c[j])
+        diag = prev[:, lo:hi].copy()
+        if lo > 0:
+            np.minimum(diag, prev[:, lo-1:hi-1], out=diag)
+        else:
+            np.minimum(diag[:, 1:], prev[:, :hi-1], out=diag[:, 1:])
+        cost = np.cumsum(np.abs(x[i] - Y[:, lo:hi]), axis=1)
+        shifted = np.zeros_like(cost)
+        shifted[:, 1:] = cost[:, :-1]
+        row[:, lo:hi] = cost + np.minimum.accumulate(diag - shifted, axis=1)
+        prev_lo, prev_hi = max(0, i - 1 - window), min(m, i + window)
+    distances = row[:, -1].copy()
+    distances[distances > max_distance] = np.inf
+    return distances
+
+def dtw_distance(x, y, window=None, max_distance=np.inf):
+    """Return DTW distance between x and y.
+
+    Parameters:
+    -----------
+    x, y : array-like
+       1-D series, can be different lengths
+    window : int, optional
+       Sakoe-Chiba band: only match x[i] and y[j] if |i - j| <= window. Widened
+       to the difference in lengths if needed. Defaults to no window.
+    max_distance : float
+       Return np.inf if the distance is larger than this, stopping as soon as
+       that is known (early abandoning).
+    """
+    x = _as_series(x)
+    y = _as_series(y)
+    # DTW is symmetric, loop over the shorter series & vectorize the longer one
+    if len(x) > len(y):
+        x, y = y, x
+    return float(_dtw_rows(x, y[np.newaxis], window=window,
+                           max_distance=max_distance)[0])
+
+def dtw_distances(X, Y=None, window=None):
+    """Return DTW distances between many series at once.
+
+    Parameters:
+    -----------
+    X : array-like
+       1-D series (one-to-many) or 2-D array with one series per row
+       (many-to-many)
+    Y : array-like, optional
+       2-D array with one series per row. Defaults to X, in which case only
+       half of the symmetric distance matrix is computed.
+    window : int, optional
+       Sakoe-Chiba band width, see dtw_distance
+
+    Returns: np.ndarray of shape (len(Y),) if X is 1-D, else (len(X), len(Y))
+    """
+    one_to_many = np.ndim(X) == 1
+    X = _as_batch(X)
+    if Y is None:
+        if one_to_many:
+            raise ValueError('Need Y to compare a single series to')
+        distances = np.zeros((len(X), len(X)))
+        for i in range(len(X) - 1):
+            distances[i, i+1:] = _dtw_rows(X[i], X[i+1:], window=window)
+        return distances + distances.T
+    Y = _as_batch(Y)
+    distances = np.array([_dtw_rows(x, Y, window=window) for x in X])
+    return distances[0] if one_to_many else distances
+
+class IncrementalDTW:
+    """DTW distances from a growing series to several fixed series.
+
+    Appending value x_i computes row i of each cost matrix, so the distance
+    between x[:i+1] and y[:i+1] is known after every value, without
+    recomputing the rows before it. Once x is as long as y, the distance is
+    that of x[:len(y)] and y, same as classify_series compares them.
+
+    Parameters:
+    -----------
+    series : list of array-like
+       1-D series to compare to, can be different lengths
+    """
+    def __init__(self, series):
+        series = [_as_series(y) for y in series]
+        if len(series) == 0:
+            raise ValueError('Need at least one series')
+        self.lengths = np.array([len(y) for y in series])
+        # padding never changes the cells before it in a row
+        self._Y = np.zeros((len(series), self.lengths.max()))
+        for idx, y in enumerate(series):
+            self._Y[idx, :len(y)] = y
+        self._row = None
+        self._distances = np.full(len(series), np.inf)
+        self.num_values = 0
+
+    @property
+    def done(self):
+        """True once more values can't change any distance"""
+        return self.num_values >= self.lengths.max()
+
+    @property
+    def distances(self):
+        return self._distances.copy()
+
+    def append(self, value):
+        i = self.num_values
+        self.num_values += 1
+        if i >= self._Y.shape[1]:
+            return
+        cost = np.cumsum(np.abs(value - self._Y), axis=1)
+        if self._row is None:
+            row = cost
+        else:
+            # same recurrence as _dtw_rows without a window
+            diag = self._row.copy()
+            np.minimum(diag[:, 1:], self._row[:, :-1], out=diag[:, 1:])
+            shifted = np.zeros_like(cost)
+            shifted[:, 1:] = cost[:, :-1]
+            row = cost + np.minimum.accumulate(diag - shifted, axis=1)
+        self._row = row
+        growing = self.lengths > i
+        self._distances[growing] = row[growing, i]
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+def lb_kim(x, y):
+    """Lower bound on the DTW distance: first and last points are always matched"""
+    x = _as_series(x)
+    y = _as_series(y)
+    bound = abs(x[0] - y[0])
+    if len(x) > 1 or len(y) > 1:
+        bound += abs(x[-1] - y[-1])
+    return float(bound)
+
+def _envelope(y, n, window):
+    """Return min & max of y[i-window:i+window+1] for i in range(n)"""
+    window = _get_window(window, n, len(y))
+    if window >= max(n, len(y)):
+        return np.full(n, y.min()), np.full(n, y.max())
+    width = 2 * window + 1
+    pad = (window, n + window - len(y))
+    lower = np.pad(y, pad, mode='constant', constant_values=np.inf)
+    upper = np.pad(y, pad, mode='constant', constant_values=-np.inf)
+    lower = as_strided(lower, shape=(n, width), strides=lower.strides * 2)
+    upper = as_strided(upper, shape=(n, width), strides=upper.strides * 2)
+    return lower.min(axis=1), upper.max(axis=1)
+
+def lb_keogh(x, y, window=None):
+    """Lower bound on the DTW distance: every point of x is matched to a point of y.
+
+    x[i] can only be matched to points of y within the window, so it costs at
+    least its distance to the envelope (min & max) of those points. Not
+    symmetric, lb_keogh(y, x) is also a lower bound.
+    """
+    x = _as_series(x)
+    y = _as_series(y)
+    lower, upper = _envelope(y, len(x), window)
+    return float((np.maximum(x - upper, 0) + np.maximum(lower - x, 0)).sum())
+
+def dtw_lower_bound(x, y, window=None):
+    """Return the tightest of the LB_Kim and LB_Keogh lower bounds"""
+    return max(lb_kim(x, y), lb_keogh(x, y, window=window),
+               lb_keogh(y, x, window=window))
+
+def _nearest_pair(pairs, window=None):
+    """Return (index of the pair (x, y) with the smallest DTW distance, distances)"""
+    if len(pairs) == 0:
+        raise ValueError('Need at least one candidate')
+    bounds = [dtw_lower_bound(x, y, window=window) for x, y in pairs]
+    distances = [None] * len(pairs)
+    closest, closest_distance = None, np.inf
+    for idx in np.argsort(bounds, kind='stable'):
+        if bounds[idx] > closest_distance:
+            break
+        x, y = pairs[idx]
+        distance = dtw_distance(x, y, window=window,
+                                max_distance=closest_distance)
+        if np.isinf(distance):
+            continue
+        distances[idx] = distance
+        if (distance < closest_distance
+                or (distance == closest_distance and idx < closest)):
+            closest, closest_distance = idx, distance
+    return closest, distances
+
+def dtw_nearest_neighbor(query, candidates, window=None):
+    """Find the candidate closest to query by DTW distance.
+
+    Ties go to the candidate that comes first, same as idxmin.
+
+    Returns: (index of closest candidate, list of DTW distances). Distances of
+    candidates pruned by their lower bound or abandoned early are None; these
+    are all larger than the closest distance.
+    """
+    return _nearest_pair([(query, candidate) for candidate in candidates],
+                         window=window)
+
+def read_features(features_filename):
+    """Read queue occupancy series written by the compute_flow_features rule"""
+    return pd.read_csv(features_filename).squeeze('columns').values
+
+def classify_series(testing_flow, training_flows, window=None):
+    """Label flow with the ccalg of the closest training flow.
+
+    Each pair of flows is compared over the length of the shorter one.
+
+    Parameters:
+    -----------
+    testing_flow : array-like
+       Features of the flow to classify
+    training_flows : dict
+       Training experiment name to its features; the training flow's ccalg is
+       the start of its name (ex. cubic-10bw-35rtt-32q-local-20181113T122426)
+    window : int, optional
+       Sakoe-Chiba band width, see dtw_distance
+
+    Returns: dict with the DTW distance to each ccalg, predicted_label,
+    closest_distance, num_distance_ties and closest_exp_name. This is what the
+    classify rules write to the .classify file and then to the .results file:
+
+    {ccalg}            DTW distance to the ccalg's training flow, or None if
+                       the flow was pruned because it can't be the closest
+    predicted_label    ccalg of the closest training flow; a tie goes to the
+                       flow that comes first in training_flows
+    closest_distance   DTW distance to the closest training flow
+    num_distance_ties  number of training flows at closest_distance (pruned
+                       flows are never tied)
+    closest_exp_name   name of the closest training flow
+    """
+    testing_flow = np.asarray(testing_flow)
+    training_exp_names = list(training_flows.keys())
+    ccalgs = [exp_name.split('-')[0] for exp_name in training_exp_names]
+    pairs = []
+    for training_flow in training_flows.values():
+        pairs.append((testing_flow[:len(training_flow)],
+                      training_flow[:len(testing_flow)]))
+    closest, distances = _nearest_pair(pairs, window=window)
+    closest_distance = distances[closest]
+    results = dict(zip(ccalgs, distances))
+    results['predicted_label'] = ccalgs[closest]
+    results['closest_distance'] = closest_distance
+    results['num_distance_ties'] = sum(distance == closest_distance
+                                       for distance in distances)
+    results['closest_exp_name'] = training_exp_names[closest]
+    return results
+
+def classify_flow(testing_features, training_features, window=None):
+    """Label flow from features files, see classify_series.
+
+    Parameters:
+    -----------
+    testing_features : str
+       Path to features of the flow to classify
+    training_features : list of str
+       Paths to features of training flows, in the order ties are broken
+
+    Returns: dict, see classify_series; distances of pruned flows are None.
+    """
+    training_flows = {os.path.basename(filename)[:-len('.features')]:
+                      read_features(filename) for filename in training_features}
+    return classify_series(read_features(testing_features), training_flows,
+                           window=window)
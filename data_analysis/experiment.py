@@ -2,12 +2,20 @@ import sys
 sys.path.append('../')
 
 from cctestbedv2 import Flow, Host, get_ssh_client, run_local_command
+from data_analysis.queue_log import store_queue_log
+from data_analysis.pcap import analyze_pcap, write_tcpdump_fields
+from data_analysis.tcpprobe import (read_tcpprobe, process_tcpprobe, store_tcpprobe,
+                                     load_tcpprobe, get_endpoint)
+from data_analysis.queue_store import open_queue_store
+from data_analysis.experiment_catalog import ExperimentCatalog
+from data_analysis.experiment_sync import sync_experiments
+from data_analysis.tar_cache import EXTRACT_ERRORS, extract_member
 
 import os
 import tarfile
 import json
 import pandas as pd
-from collections import Counter
+from collections import Counter, namedtuple
 from contextlib import contextmanager
 import subprocess
 import re
@@ -25,6 +33,12 @@ BITS_TO_MEGABITS = 1.0 / 1000000.0
 REMOTE_IP_ADDR = '128.2.208.131'
 REMOTE_USERNAME = 'ranysha'
 
+# number of processes load_experiments uses, defaults to get_num_loader_processes
+LOADER_PROCESSES = os.environ.get('CCTESTBED_LOADER_PROCESSES')
+# copying tarballs with scp mostly waits on the network, not the cpu
+REMOTE_LOADER_PROCESSES_PER_CPU = 2
+MAX_LOADER_PROCESSES = 32
+
 class Experiment:
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
@@ -71,13 +85,19 @@ class Experiment:
     def __ne__(self, other):
         return self.name.__ne__(other.name)
 
+# what a load_experiments worker sends back instead of a pickled analyzer: the
+# experiment and paths of the processed stores it created. Frames are read
+# from the stores by the analyzer in the parent when first used.
+ExperimentHandle = namedtuple('ExperimentHandle', ['experiment', 'hdf_queue_path',
+                                                   'tcpprobe_path'])
+
 """
 Each experiment has it's own experiment analyzer
 
 Lazily populate dataframes for queue, tcpprobe
 """
 class ExperimentAnalyzer:
-    def __init__(self, experiment, load_queue=False):
+    def __init__(self, experiment, load_queue=False, load_tcpprobe=False):
         self.experiment = experiment
         self._df_queue = None
         self._df_tcpprobe = None
@@ -87,6 +107,8 @@ class ExperimentAnalyzer:
         self._flow_names = None
          # path to HDF5 store of queue; lazily poulated after hdf_queue_path called
         self._hdf_queue_path = None
+        # path to store of processed tcpprobe log; lazily populated after tcpprobe_path called
+        self._tcpprobe_path = None
 
         if load_queue:
             try:
@@ -94,70 +116,31 @@ class ExperimentAnalyzer:
                     pass
             except Exception as e:
                 print('Error creating hdf queue for experiment: {}\n {}'.format(experiment.name, e))
+        if load_tcpprobe:
+            try:
+                self.tcpprobe_path
+            except Exception as e:
+                print('Error creating tcpprobe store for experiment: {}\n {}'.format(experiment.name, e))
+
+    @classmethod
+    def from_handle(cls, handle):
+        """Return analyzer of experiment loaded by another process"""
+        analyzer = cls(handle.experiment)
+        analyzer._hdf_queue_path = handle.hdf_queue_path
+        analyzer._tcpprobe_path = handle.tcpprobe_path
+        return analyzer
+
+    @property
+    def handle(self):
+        """ExperimentHandle with the stores created so far; frames aren't included"""
+        return ExperimentHandle(self.experiment, self._hdf_queue_path, self._tcpprobe_path)
 
     def _create_hdf_queue(self, raw_queue_log_tarpath, raw_queue_log_localpath, processed_queue_log_localpath):
         # haven't created HDF5 store yet; create it now
-        find_bad_lines_cmd = 'grep ^.*,.*,.*,.*,.*,.*,.*,.*,.*$ {} -v -n'.format(raw_queue_log_localpath)
-        badlines = run_local_command(find_bad_lines_cmd, shell=False).split('\n')
-        if len(badlines) >= 1 and badlines[0] != '':
-            sort_cmd = 'sort -k 2 -o {} {}'.format(raw_queue_log_localpath, raw_queue_log_localpath)
-            print('Found {} bad lines:\n {}'.format(len(badlines), badlines))
-        else:
-            tmp_queue_filename = raw_queue_log_localpath + '.tmp'
-            sort_cmd = 'sort -k 2 -o {} {} && grep ^.*,.*,.*,.*,.*,.*,.*,.*,.*$ {} > {} && mv {} {} '.format(
-                        raw_queue_log_localpath, raw_queue_log_localpath, raw_queue_log_localpath, tmp_queue_filename, tmp_queue_filename, raw_queue_log_localpath)
-
-        with untarfile(self.experiment.tarfile_localpath, raw_queue_log_tarpath, postprocess_cmd=sort_cmd) as f:
-            with pd.HDFStore(processed_queue_log_localpath, mode='w') as store:
-                df = pd.read_csv(f, names = ['dequeued',
-                                                'time',
-                                                'src',
-                                                'seq',
-                                                'datalen',
-                                                'size',
-                                                'dropped',
-                                                'queued',
-                                                'batch'],
-                                    converters = {'seq': tohex,
-                                                'src': tohex},
-                                    dtype={'dequeued': bool,
-                                        'time': np.uint64,
-                                        'datalen': np.uint16,
-                                        'size': np.uint32,
-                                        'dropped':bool,
-                                        'queued': np.uint16,
-                                        'batch': np.uint16}, skip_blank_lines=True)
-                df['seq'] = df['seq'].astype( np.uint32)
-                df['src'] = df['src'].astype( np.uint16)
-                #chunk['time'] = pd.to_datetime(chunk['time'], infer_datetime_format=True, unit='ns')
-                df['lineno'] = df.index + 1
-                df = df.set_index('time')
-                df_enq = (pd
-                        .get_dummies(df[(df.dequeued==0) & (df.dropped==0)]['src'])
-                        .astype(np.uint8))
-                df_deq = (pd
-                        .get_dummies(df[df.dequeued==1]['src'])
-                        .replace(1,-1)
-                        .astype(np.int8))
-                df_flows = (df_enq
-                            .append(df_deq)
-                            .sort_index()
-                            .cumsum()
-                            .fillna(0)
-                            .astype(np.uint32))
-                df = (df
-                    .reset_index()
-                    .join(df_flows.reset_index().drop('time', axis=1))
-                    .sort_index()
-                    .ffill())
-                df.time = pd.to_datetime(df.time,
-                                        infer_datetime_format=True,
-                                        unit='ns')
-                df = df.set_index('time')
-                store.append('df_queue',
-                            df,
-                            format='table',
-                            data_columns=['src', 'dropped', 'dequeued'])
+        # queue log is streamed into the store in chunks, so no need to load
+        # the whole log into memory; bad lines are dropped while reading
+        with untarfile_extract(self.experiment.tarfile_localpath, raw_queue_log_tarpath) as queue_log_localpath:
+            store_queue_log(queue_log_localpath, processed_queue_log_localpath)
 
     @contextmanager
     def hdf_queue(self, mode='r'):
@@ -171,7 +154,7 @@ class ExperimentAnalyzer:
                 print('Creating HDF store for queue')
                 self._create_hdf_queue(raw_queue_log_tarpath, raw_queue_log_localpath, processed_queue_log_localpath)
             self._hdf_queue_path = processed_queue_log_localpath
-        store = pd.HDFStore(self._hdf_queue_path, mode=mode)
+        store = open_queue_store(self._hdf_queue_path, mode=mode)
         try:
             yield store
         finally:
@@ -276,35 +259,26 @@ class ExperimentAnalyzer:
         return self._flow_names
 
     @property
-    def df_tcpprobe(self):
-        MICROSECONDS_TO_MILLISECONDS = 1.0 / 1000
-        tcpprobe_log_tarpath = self.experiment.logs['tcpprobe_log']
-        tcpprobe_log_localpath = os.path.join(DATAPATH_PROCESSED,
-                                            '{}.csv'.format(os.path.join(tcpprobe_log_tarpath[:-len('.txt')])))
-        if (self._df_tcpprobe is None) or (not os.path.isfile(tcpprobe_log_localpath)):
+    def tcpprobe_path(self):
+        """Path to store of processed tcpprobe log, created if it doesn't exist"""
+        if (self._tcpprobe_path is None) or (not os.path.isfile(self._tcpprobe_path)):
+            tcpprobe_log_tarpath = self.experiment.logs['tcpprobe_log']
+            tcpprobe_log_localpath = os.path.join(DATAPATH_PROCESSED,
+                                                '{}.h5'.format(os.path.join(os.path.splitext(tcpprobe_log_tarpath)[0])))
             if not os.path.isfile(tcpprobe_log_localpath):
-                with untarfile(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as f:
-                    tcpprobe = pd.read_csv(f, sep='\s+', header=None,
-                                names=['time','sender','receiver','bytes','next',
-                                        'unack','cwnd','ssthresh','swnd','srtt',
-                                        'rwnd', 'bbr_bw_lo','bbr_bw_hi','bbr_min_rtt',
-                                        'bbr_pacing_gain','bbr_cwnd_gain'])
-
-                    tcpprobe['bbr_bw_lo'] = (tcpprobe['bbr_bw_lo']*715) / 1e6
-                    tcpprobe['bbr_pacing_gain'] = tcpprobe['bbr_pacing_gain'] / 256
-                    tcpprobe['bbr_cwnd_gain'] = tcpprobe['bbr_cwnd_gain'] / 256
-                    tcpprobe['bbr_min_rtt'] = tcpprobe['bbr_min_rtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['srtt'] = tcpprobe['srtt'] * MICROSECONDS_TO_MILLISECONDS
-                    tcpprobe['time'] = tcpprobe['time'].apply(lambda x: dt.timedelta(seconds=x))
-                    tcpprobe = tcpprobe.set_index('time')
-                    senders = ['192.0.0.1:{}'.format(port) for port in  self.flow_sender_ports.keys()]
-                    tcpprobe = tcpprobe[tcpprobe.sender.isin(senders)]
-                    tcpprobe.to_csv(tcpprobe_log_localpath, header=True)
-            else:
-                with open(tcpprobe_log_localpath) as f:
-                    tcpprobe = pd.read_csv(f, header=0, index_col = 'time')
-                    tcpprobe.index = pd.to_datetime(tcpprobe.index)
-            self._df_tcpprobe = tcpprobe
+                with untarfile_extract(self.experiment.tarfile_localpath, tcpprobe_log_tarpath) as tcpprobe_log_raw_localpath:
+                    # binary or text log, whichever the experiment wrote
+                    tcpprobe = read_tcpprobe(tcpprobe_log_raw_localpath)
+                senders = [get_endpoint('192.0.0.1', port) for port in self.flow_sender_ports.keys()]
+                tcpprobe = process_tcpprobe(tcpprobe, senders=senders)
+                store_tcpprobe(tcpprobe, tcpprobe_log_localpath)
+            self._tcpprobe_path = tcpprobe_log_localpath
+        return self._tcpprobe_path
+
+    @property
+    def df_tcpprobe(self):
+        if (self._df_tcpprobe is None) or (not os.path.isfile(self.tcpprobe_path)):
+            self._df_tcpprobe = load_tcpprobe(self.tcpprobe_path)
         return self._df_tcpprobe
 
     @property
@@ -316,11 +290,8 @@ class ExperimentAnalyzer:
                 with open(tcpdump_client_processed_localpath, 'w') as f:
                     f.write('frame.time_relative,tcp.len,tcp.srcport,tcp.seq,tcp.analysis,ack_rtt\n')
                 with untarfile_extract(self.experiment.tarfile_localpath, tcpdump_client_tarpath) as tcpdump_client_raw_localpath:
-                    cmd = 'tshark -T fields -E separator=, -E quote=d -r {} -e frame.time_relative -e tcp.len -e tcp.srcport -e tcp.seq -e tcp.analysis.ack_rtt >> {}'.format(
-                                            tcpdump_client_raw_localpath, tcpdump_client_processed_localpath)
-                    proc = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-                    if proc.returncode != 0:
-                        raise RuntimeError('Encountered error running cmd {}\n{}'.format(cmd, proc.stderr.decode('utf-8')))
+                    write_tcpdump_fields(analyze_pcap(tcpdump_client_raw_localpath),
+                                         tcpdump_client_processed_localpath)
             with open(tcpdump_client_processed_localpath) as f:
                 self._df_tcpdump_client = pd.read_csv(f, header=0, skipinitialspace=True)
         return self._df_tcpdump_client
@@ -425,15 +396,13 @@ def regex_match(regex, key):
 def untarfile(tar_filename, filename, untar_dir=DATAPATH_RAW, delete_file=True, postprocess_cmd=None):
     file_localpath = os.path.join(untar_dir, filename)
     print('Extracting file {} from {} to {}'.format(filename, tar_filename, file_localpath))
-    cmd = 'cd {} && tar -xzvf {} {}'.format(untar_dir,
-                                            tar_filename,
-                                            filename)
-    # untar file
+    # untar file; goes through the tar cache so the archive is only
+    # decompressed once no matter how many of its files are used
     try:
-        completed_proc = subprocess.run(cmd, shell=True, check=False, stderr=subprocess.PIPE)
-        completed_proc.check_returncode()
-    except subprocess.CalledProcessError as e:
-        print('STDERR:', completed_proc.stderr)
+        extract_member(tar_filename, filename, untar_dir)
+    except EXTRACT_ERRORS as e:
+        # like a failed tar -x: report it, opening the file fails below
+        print('STDERR:', e)
     # run postprocess cmd
     if postprocess_cmd is not None:
         try:
@@ -461,15 +430,13 @@ def untarfile(tar_filename, filename, untar_dir=DATAPATH_RAW, delete_file=True,
 def untarfile_extract(tar_filename, filename, untar_dir=DATAPATH_RAW, delete_file=True, postprocess_cmd=None):
     file_localpath = os.path.join(untar_dir, filename)
     print('Extracting file {} from {} to {}'.format(filename, tar_filename, file_localpath))
-    cmd = 'cd {} && tar -xzvf {} {}'.format(untar_dir,
-                                            tar_filename,
-                                            filename)
-    # untar file
+    # untar file; goes through the tar cache so the archive is only
+    # decompressed once no matter how many of its files are used
     try:
-        completed_proc = subprocess.run(cmd, shell=True, check=False, stderr=subprocess.PIPE)
-        completed_proc.check_returncode()
-    except subprocess.CalledProcessError as e:
-        print('STDERR:', completed_proc.stderr)
+        extract_member(tar_filename, filename, untar_dir)
+    except EXTRACT_ERRORS as e:
+        # like a failed tar -x: report it, opening the file fails below
+        print('STDERR:', e)
     # run postprocess cmd
     if postprocess_cmd is not None:
         try:
@@ -491,7 +458,8 @@ def untarfile_extract(tar_filename, filename, untar_dir=DATAPATH_RAW, delete_fil
 def load_experiments(experiment_name_patterns, remote=True, force_local=False,
                         remote_username=REMOTE_USERNAME, remote_ip=REMOTE_IP_ADDR,
                         load_queue=False, clean=False, parallel=True,
-                        min_num_files=0, min_date=None, remove_duplicates=True):
+                        min_num_files=0, min_date=None, remove_duplicates=True,
+                        load_tcpprobe=False, num_proc=None):
     """Load all experiments into experiment analyzers
     experiment_name_pattern : list of str
         Should be a pattern that will be called
@@ -515,6 +483,12 @@ def load_experiments(experiment_name_patterns, remote=True, force_local=False,
         Only return experiments with equal to or large than the expected date
     remove_duplicates: bool
         Remove experiments with the same name, keeping the most recent one
+    load_tcpprobe: bool
+        If True, also create the processed tcpprobe store of each experiment
+        while loading, like load_queue does for the queue store
+    num_proc: int, optional
+        Number of processes to load experiments with in parallel. Defaults to
+        get_num_loader_processes.
     """
     assert(type(experiment_name_patterns) is list)
     tarfile_remotepaths = []
@@ -524,19 +498,13 @@ def load_experiments(experiment_name_patterns, remote=True, force_local=False,
             print('Deleting local files matching experiment pattern: {}'.format(experiment_name_pattern))
             run_local_command('rm {}.h5'.format(os.path.join(DATAPATH_PROCESSED, experiment_name_pattern)))
     if remote:
-        print('Searching for experiments on remote machine: {}'.format(remote_ip))
-        with get_ssh_client(ip_addr=remote_ip, username=remote_username) as ssh_client:
-            '''
-            for experiment_name_pattern in experiment_name_patterns:
-                _, stdout, _ = ssh_client.exec_command(
-                    'ls -1 /tmp/{}.tar.gz'.format(experiment_name_pattern))
-                tarfile_remotepaths += [filename.strip()
-                                        for filename in stdout.readlines()]
-            '''
-            cmd = 'ls -1 ' + ' '.join(['/tmp/{}.tar.gz']*len(experiment_name_patterns)).format(*experiment_name_patterns)
-            print(cmd)
-            _, stdout, _ = ssh_client.exec_command(cmd)
-            tarfile_remotepaths += [filename.strip() for filename in stdout.readlines()]
+        print('Syncing experiments from remote machine: {}'.format(remote_ip))
+        # only copies archives that are missing or changed and that would not
+        # be filtered out below by min_date or remove_duplicates; returns local paths
+        tarfile_remotepaths += sync_experiments(remote_ip, remote_username,
+                                                experiment_name_patterns, DATAPATH_RAW,
+                                                min_date=min_date,
+                                                remove_duplicates=remove_duplicates)
         print('Found {} experiment(s) on remote machine: {}'.format(
             len(tarfile_remotepaths), tarfile_remotepaths))
     else:
@@ -544,11 +512,11 @@ def load_experiments(experiment_name_patterns, remote=True, force_local=False,
 
     if force_local or len(tarfile_remotepaths) == 0:
         num_local_files = 0
-        for experiment_name_pattern in experiment_name_patterns:
-            local_filepaths = glob.glob(os.path.join(DATAPATH_RAW,
-                                                     experiment_name_pattern +'.tar.gz'))
-            tarfile_remotepaths += local_filepaths
-            num_local_files += len(local_filepaths)
+        with ExperimentCatalog() as catalog:
+            for experiment_name_pattern in experiment_name_patterns:
+                local_filepaths = get_local_tarfiles(catalog, experiment_name_pattern)
+                tarfile_remotepaths += local_filepaths
+                num_local_files += len(local_filepaths)
         if len(tarfile_remotepaths) == 0:
             raise ValueError(('Found no experiments on remote or local machine '
                             '{} with name pattern {}').format(
@@ -587,29 +555,83 @@ def load_experiments(experiment_name_patterns, remote=True, force_local=False,
             tarfile_remotepaths = []
 
     #experiments = {}
-    num_proc = 10
     num_tarfiles = len(tarfile_remotepaths)
-    num_tarfiles_per_process = int(num_tarfiles / num_proc) + 1
-    if parallel and num_tarfiles > 1:
+    if num_proc is None:
+        num_remote = sum(not os.path.isfile(get_tarfile_localpath(tarfile_remotepath))
+                         for tarfile_remotepath in tarfile_remotepaths)
+        num_proc = get_num_loader_processes(num_tarfiles, remote=num_remote > 0)
+    if parallel and num_tarfiles > 1 and num_proc > 1:
+            # workers only send back handles; the processed stores they create
+            # are read from disk by the analyzers when a frame is first used
+            # several chunks per process, since some experiments take much longer
+            chunksize = max(1, num_tarfiles // (num_proc * 4))
             with mp.Pool(num_proc) as pool:
-                analyzers = pool.starmap(get_experiment, zip(tarfile_remotepaths,
-                                                            it.repeat(remote_ip, num_tarfiles),
-                                                            it.repeat(remote_username, num_tarfiles),
-                                                            it.repeat(load_queue, num_tarfiles)),
-                                                            chunksize=num_tarfiles_per_process)
+                handles = pool.starmap(get_experiment_handle, zip(tarfile_remotepaths,
+                                                                 it.repeat(remote_ip, num_tarfiles),
+                                                                 it.repeat(remote_username, num_tarfiles),
+                                                                 it.repeat(load_queue, num_tarfiles),
+                                                                 it.repeat(load_tcpprobe, num_tarfiles)),
+                                       chunksize=chunksize)
+            analyzers = [ExperimentAnalyzer.from_handle(handle) for handle in handles]
     else:
-        analyzers = [get_experiment(tarfile_remotepath, remote_ip, remote_username, load_queue) for tarfile_remotepath in tarfile_remotepaths]
+        analyzers = [get_experiment(tarfile_remotepath, remote_ip, remote_username, load_queue, load_tcpprobe) for tarfile_remotepath in tarfile_remotepaths]
     experiment_analyzers = ExperimentAnalyzers()
     for analyzer in analyzers:
         experiment_analyzers['{}-{}'.format(analyzer.experiment.name,
                                             analyzer.experiment.exp_time)] = analyzer
     return experiment_analyzers
 
-def get_experiment(tarfile_remotepath, remote_ip, remote_username, load_queue):
+def get_local_tarfiles(catalog, experiment_name_pattern):
+    """Return paths of tarballs in DATAPATH_RAW matching experiment_name_pattern.
+
+    Looked up in the experiment catalog; DATAPATH_RAW is only globbed if the
+    catalog has no matching tarballs there (ex. copied by hand).
+    """
+    datapath_raw = os.path.abspath(DATAPATH_RAW)
+    local_filepaths = [experiment['archive_path']
+                       for experiment in catalog.find(pattern=experiment_name_pattern)
+                       if os.path.dirname(experiment['archive_path']) == datapath_raw
+                       and os.path.isfile(experiment['archive_path'])]
+    if len(local_filepaths) == 0:
+        local_filepaths = glob.glob(os.path.join(DATAPATH_RAW,
+                                                 experiment_name_pattern +'.tar.gz'))
+    return local_filepaths
+
+def get_num_loader_processes(num_tarfiles, remote=False):
+    """Return number of processes to load num_tarfiles experiments with.
+
+    One per cpu this process can run on, or REMOTE_LOADER_PROCESSES_PER_CPU
+    per cpu when tarballs have to be copied from the remote machine first.
+    Set CCTESTBED_LOADER_PROCESSES to override.
+    """
+    if LOADER_PROCESSES is not None:
+        num_proc = int(LOADER_PROCESSES)
+    else:
+        try:
+            num_cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            num_cpus = mp.cpu_count()
+        if remote:
+            num_cpus = num_cpus * REMOTE_LOADER_PROCESSES_PER_CPU
+        num_proc = min(num_cpus, MAX_LOADER_PROCESSES)
+    return max(1, min(num_proc, num_tarfiles))
+
+def get_tarfile_localpath(tarfile_remotepath):
+    experiment_name = os.path.basename(tarfile_remotepath[:-len('.tar.gz')])
+    return os.path.join(DATAPATH_RAW, '{}.tar.gz'.format(experiment_name))
+
+def get_experiment_handle(tarfile_remotepath, remote_ip, remote_username, load_queue,
+                          load_tcpprobe=False):
+    """Same as get_experiment, but return a ExperimentHandle to send to another process"""
+    return get_experiment(tarfile_remotepath, remote_ip, remote_username,
+                          load_queue, load_tcpprobe).handle
+
+def get_experiment(tarfile_remotepath, remote_ip, remote_username, load_queue,
+                   load_tcpprobe=False):
     # check if tarfile already here
     # copy tarfile from remote machine to local machine (data directory)
     experiment_name = os.path.basename(tarfile_remotepath[:-len('.tar.gz')])
-    tarfile_localpath = os.path.join(DATAPATH_RAW, '{}.tar.gz'.format(experiment_name))
+    tarfile_localpath = get_tarfile_localpath(tarfile_remotepath)
     if not os.path.isfile(tarfile_localpath):
         print('Copying remotepath {} to localpath {}'.format(
                     tarfile_remotepath, tarfile_localpath))
@@ -639,7 +661,8 @@ def get_experiment(tarfile_remotepath, remote_ip, remote_username, load_queue):
             experiment_description = json.loads(json.loads(f.read().replace('=', ':')))
         experiment = Experiment(tarfile_localpath=tarfile_localpath,
                                 **experiment_description)
-    experiment_analyzer = ExperimentAnalyzer(experiment, load_queue=load_queue)
+    experiment_analyzer = ExperimentAnalyzer(experiment, load_queue=load_queue,
+                                             load_tcpprobe=load_tcpprobe)
     return experiment_analyzer
 
 def tohex(x):
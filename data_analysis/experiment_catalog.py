@@ -0,0 +1,377 @@
+"""
+Catalog of experiment archives in a local SQLite database.
+
+Scripts used to find experiments by globbing /tmp, /tmp/data-tmp etc. for
+{name}-*.tar.gz, which gets slow with tens of thousands of archives and also
+matches experiments whose name merely starts with the one asked for. Instead,
+every archive is recorded in the catalog when its run ends, with the
+experiment's network conditions (parsed from its description & name), the
+archive's path, size and sha256, and its processing state:
+
+completed  archive written, not processed yet
+processed  results computed & uploaded (ex. by classify_websites.snakefile)
+removed    archive deleted, ex. to rerun the experiment
+
+Lookups by name, ccalg, btlbw, rtt, queue_size, website and date are indexed.
+
+Set the database location with the CCTESTBED_CATALOG environment variable.
+Archives written before the catalog existed can be added with:
+python3 -m data_analysis.experiment_catalog scan /tmp/data-raw
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tarfile
+import time
+
+from data_analysis.indexed_tar import iter_member, read_index
+
+CATALOG_PATH = os.environ.get('CCTESTBED_CATALOG', '/tmp/cctestbed-catalog.db')
+
+COMPLETED = 'completed'
+PROCESSED = 'processed'
+REMOVED = 'removed'
+STATES = (COMPLETED, PROCESSED, REMOVED)
+
+_EXP_NAME_REGEX = re.compile(r'^(.+)-(\d{8}T\d{6})$')
+_NTWRK_CONDITIONS_REGEX = re.compile(r'^(\d+)bw-(\d+)rtt-(\d+)q(?:-(.+))?$')
+_HASH_BUFSIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    exp_name TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    exp_time TEXT NOT NULL,
+    date TEXT NOT NULL,
+    btlbw INTEGER,
+    rtt INTEGER,
+    queue_size INTEGER,
+    website TEXT,
+    archive_path TEXT NOT NULL,
+    archive_size INTEGER,
+    archive_mtime REAL,
+    archive_sha256 TEXT,
+    state TEXT NOT NULL,
+    description TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flows (
+    exp_name TEXT NOT NULL REFERENCES experiments(exp_name) ON DELETE CASCADE,
+    ccalg TEXT,
+    rtt INTEGER,
+    kind TEXT
+);
+CREATE INDEX IF NOT EXISTS experiments_name ON experiments(name, exp_time);
+CREATE INDEX IF NOT EXISTS experiments_ntwrk ON experiments(btlbw, rtt, queue_size);
+CREATE INDEX IF NOT EXISTS experiments_website ON experiments(website);
+CREATE INDEX IF NOT EXISTS experiments_date ON experiments(date);
+CREATE INDEX IF NOT EXISTS experiments_state ON experiments(state);
+CREATE INDEX IF NOT EXISTS flows_ccalg ON flows(ccalg, exp_name);
+CREATE INDEX IF NOT EXISTS flows_exp_name ON flows(exp_name);
+"""
+
+def parse_exp_name(exp_name):
+    """Return (name, exp_time) of experiment name written as {name}-{exp_time}"""
+    match = _EXP_NAME_REGEX.match(exp_name)
+    if match is None:
+        raise ValueError('Experiment name {} does not end with a time'.format(exp_name))
+    return match.group(1), match.group(2)
+
+def get_archive_exp_name(archive_path):
+    return os.path.basename(archive_path)[:-len('.tar.gz')]
+
+def get_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_BUFSIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def read_archive_description(archive_path):
+    """Return experiment description stored in archive, or None if it has none"""
+    member = '{}.json'.format(get_archive_exp_name(archive_path))
+    try:
+        index = read_index(archive_path)
+        if index is not None:
+            data = b''.join(iter_member(archive_path, member, index=index))
+        else:
+            with tarfile.open(archive_path) as tar:
+                data = tar.extractfile(member).read()
+        description = json.loads(data.decode('utf-8'))
+    except (KeyError, OSError, ValueError, tarfile.TarError):
+        return None
+    # very old experiments stored their description as a JSON string
+    if not isinstance(description, dict):
+        return None
+    return description
+
+def get_catalog_fields(exp_name, description=None):
+    """Return dict of the experiments row & list of flows rows of an experiment"""
+    name, exp_time = parse_exp_name(exp_name)
+    if description is None:
+        description = {}
+    fields = {'exp_name': exp_name, 'name': name, 'exp_time': exp_time,
+              'date': exp_time[:8], 'btlbw': description.get('btlbw'),
+              'rtt': None, 'queue_size': description.get('queue_size'),
+              'website': None}
+    match = _NTWRK_CONDITIONS_REGEX.match(name)
+    if match is not None:
+        fields['btlbw'] = fields['btlbw'] or int(match.group(1))
+        fields['rtt'] = int(match.group(2))
+        fields['queue_size'] = fields['queue_size'] or int(match.group(3))
+        fields['website'] = match.group(4)
+    flows = []
+    # flows are stored as lists of Flow fields: ccalg, start_time, end_time, rtt, ...
+    for flow in description.get('flows', []):
+        flows.append({'exp_name': exp_name, 'ccalg': flow[0], 'rtt': flow[3],
+                      'kind': flow[8] if len(flow) > 8 else None})
+    if fields['rtt'] is None and len(flows) > 0:
+        fields['rtt'] = flows[0]['rtt']
+    return fields, flows
+
+class ExperimentCatalog:
+    """SQLite catalog of experiment archives, safe to share between processes.
+
+    Parameters:
+    -----------
+    path : str
+       Database file, created if it doesn't exist
+    timeout : float
+       Seconds to wait for another process to finish writing
+    """
+    def __init__(self, path=CATALOG_PATH, timeout=60):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        # readers don't block the writer at the end of a run & vice versa
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def add(self, archive_path, description=None, state=COMPLETED, checksum=True,
+            sha256=None):
+        """Record archive of a finished experiment; return its exp_name.
+
+        An experiment already in the catalog is replaced, ex. when its archive
+        is moved.
+
+        Parameters:
+        -----------
+        archive_path : str
+           Path to {name}-{exp_time}.tar.gz
+        description : dict, optional
+           Experiment description, read from the archive by default
+        checksum : bool
+           If False, don't compute the sha256 of the archive
+        sha256 : str, optional
+           sha256 of the archive if already known, ex. checked after copying it
+        """
+        archive_path = os.path.abspath(archive_path)
+        exp_name = get_archive_exp_name(archive_path)
+        if description is None:
+            description = read_archive_description(archive_path)
+        fields, flows = get_catalog_fields(exp_name, description)
+        stat = os.stat(archive_path)
+        fields.update({'archive_path': archive_path,
+                       'archive_size': stat.st_size,
+                       'archive_mtime': stat.st_mtime,
+                       'archive_sha256': sha256 or (get_sha256(archive_path) if checksum else None),
+                       'state': state,
+                       'description': None if description is None else json.dumps(description),
+                       'updated': time.time()})
+        columns = list(fields.keys())
+        with self._conn:
+            self._conn.execute('DELETE FROM experiments WHERE exp_name = ?', (exp_name,))
+            self._conn.execute('INSERT INTO experiments ({}) VALUES ({})'.format(
+                ', '.join(columns), ', '.join('?' * len(columns))),
+                [fields[column] for column in columns])
+            self._conn.executemany(
+                'INSERT INTO flows (exp_name, ccalg, rtt, kind) VALUES (?, ?, ?, ?)',
+                [(flow['exp_name'], flow['ccalg'], flow['rtt'], flow['kind'])
+                 for flow in flows])
+        return exp_name
+
+    def set_state(self, exp_name, state):
+        """Set processing state of experiment; return False if it isn't in the catalog"""
+        if state not in STATES:
+            raise ValueError('Unknown experiment state: {}'.format(state))
+        with self._conn:
+            cursor = self._conn.execute(
+                'UPDATE experiments SET state = ?, updated = ? WHERE exp_name = ?',
+                (state, time.time(), exp_name))
+        return cursor.rowcount > 0
+
+    def remove(self, exp_name):
+        """Delete experiment from the catalog"""
+        with self._conn:
+            self._conn.execute('DELETE FROM experiments WHERE exp_name = ?', (exp_name,))
+
+    def get(self, exp_name):
+        """Return dict of experiment, or None if it isn't in the catalog"""
+        row = self._conn.execute('SELECT * FROM experiments WHERE exp_name = ?',
+                                 (exp_name,)).fetchone()
+        return None if row is None else dict(row)
+
+    def find(self, name=None, pattern=None, ccalg=None, btlbw=None, rtt=None,
+             queue_size=None, website=None, date=None, min_date=None,
+             states=(COMPLETED, PROCESSED)):
+        """Return list of dicts of matching experiments, oldest first.
+
+        Parameters:
+        -----------
+        name : str
+           Experiment name without the time, matched exactly
+        pattern : str
+           Shell style pattern matched against {name}-{exp_time}, ex. '*cubic*'
+        ccalg : str
+           Experiments with a flow using this congestion control algorithm
+        date : str
+           Day experiments were run, ex. 20190101
+        min_date : str
+           First day experiments were run
+        states : tuple of str
+           Processing states to return, None for all
+        """
+        conditions = []
+        params = []
+        for column, value in [('name', name), ('btlbw', btlbw), ('rtt', rtt),
+                              ('queue_size', queue_size), ('website', website),
+                              ('date', date)]:
+            if value is not None:
+                conditions.append('e.{} = ?'.format(column))
+                params.append(value)
+        if pattern is not None:
+            conditions.append('e.exp_name GLOB ?')
+            params.append(pattern)
+        if min_date is not None:
+            conditions.append('e.date >= ?')
+            params.append(min_date)
+        if ccalg is not None:
+            conditions.append('e.exp_name IN (SELECT exp_name FROM flows WHERE ccalg = ?)')
+            params.append(ccalg)
+        if states is not None:
+            conditions.append('e.state IN ({})'.format(', '.join('?' * len(states))))
+            params.extend(states)
+        query = 'SELECT * FROM experiments e'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY e.exp_time, e.exp_name'
+        return [dict(row) for row in self._conn.execute(query, params)]
+
+    def is_completed(self, name, date=None, states=(COMPLETED, PROCESSED),
+                     archive_dir=None):
+        """Return True if an experiment with this name (without the time) was run.
+
+        Parameters:
+        -----------
+        archive_dir : str, optional
+           Directory scripts globbed for archives before the catalog existed. If
+           the catalog has no experiment with this name, its archives there are
+           added to the catalog (as completed) and counted.
+        """
+        if archive_dir is not None and len(self.find(name=name, date=date, states=None)) == 0:
+            self._add_uncataloged(name, date, archive_dir)
+        return len(self.find(name=name, date=date, states=states)) > 0
+
+    def _add_uncataloged(self, name, date, archive_dir):
+        pattern = '{}-{}*.tar.gz'.format(glob.escape(name), date or '')
+        for archive_path in sorted(glob.glob(os.path.join(archive_dir, pattern))):
+            match = _EXP_NAME_REGEX.match(get_archive_exp_name(archive_path))
+            # the glob also matches longer names starting with name
+            if match is not None and match.group(1) == name:
+                self.add(archive_path, checksum=False)
+
+    def get_manifest(self, patterns):
+        """Return list of dicts (exp_name, path, size, mtime, sha256) of archives
+        matching any of patterns that are still on disk, see find"""
+        manifest = {}
+        for pattern in patterns:
+            for experiment in self.find(pattern=pattern):
+                if os.path.isfile(experiment['archive_path']):
+                    manifest[experiment['exp_name']] = {
+                        'exp_name': experiment['exp_name'],
+                        'path': experiment['archive_path'],
+                        'size': experiment['archive_size'],
+                        'mtime': experiment['archive_mtime'],
+                        'sha256': experiment['archive_sha256']}
+        return list(manifest.values())
+
+    def scan(self, directory, checksum=True):
+        """Add archives in directory that aren't in the catalog yet; return their exp_names"""
+        added = []
+        for archive_path in sorted(glob.glob(os.path.join(directory, '*.tar.gz'))):
+            exp_name = get_archive_exp_name(archive_path)
+            if _EXP_NAME_REGEX.match(exp_name) is None or self.get(exp_name) is not None:
+                continue
+            added.append(self.add(archive_path, checksum=checksum))
+        return added
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return 'ExperimentCatalog({})'.format(self.path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Catalog of experiment archives.')
+    parser.add_argument('--catalog', default=CATALOG_PATH, help='Catalog database')
+    subparsers = parser.add_subparsers(dest='cmd')
+    subparsers.required = True
+    add_parser = subparsers.add_parser('add', help='Record archives of finished experiments')
+    add_parser.add_argument('archives', nargs='+')
+    add_parser.add_argument('--state', default=COMPLETED, choices=STATES)
+    state_parser = subparsers.add_parser('state', help='Set processing state of experiments')
+    state_parser.add_argument('exp_names', nargs='+')
+    state_parser.add_argument('state', choices=STATES)
+    scan_parser = subparsers.add_parser('scan', help='Add archives in directories not cataloged yet')
+    scan_parser.add_argument('directories', nargs='+')
+    scan_parser.add_argument('--no-checksum', action='store_false', dest='checksum')
+    manifest_parser = subparsers.add_parser(
+        'manifest', help='Print JSON manifest of archives matching patterns, see experiment_sync')
+    manifest_parser.add_argument('patterns', nargs='+')
+    find_parser = subparsers.add_parser('find', help='Print archives of matching experiments')
+    find_parser.add_argument('pattern', nargs='?', default=None)
+    for arg in ['ccalg', 'website', 'date', 'min_date']:
+        find_parser.add_argument('--{}'.format(arg.replace('_', '-')), dest=arg)
+    for arg in ['btlbw', 'rtt', 'queue_size']:
+        find_parser.add_argument('--{}'.format(arg.replace('_', '-')), dest=arg, type=int)
+    args = parser.parse_args(argv)
+
+    with ExperimentCatalog(args.catalog) as catalog:
+        if args.cmd == 'add':
+            for archive_path in args.archives:
+                catalog.add(archive_path, state=args.state)
+        elif args.cmd == 'state':
+            for exp_name in args.exp_names:
+                if not catalog.set_state(exp_name, args.state):
+                    print('Experiment {} is not in the catalog'.format(exp_name),
+                          file=sys.stderr)
+        elif args.cmd == 'scan':
+            for directory in args.directories:
+                added = catalog.scan(directory, checksum=args.checksum)
+                print('Added {} experiment(s) from {}'.format(len(added), directory))
+        elif args.cmd == 'manifest':
+            print(json.dumps(catalog.get_manifest(args.patterns)))
+        elif args.cmd == 'find':
+            for experiment in catalog.find(pattern=args.pattern, ccalg=args.ccalg,
+                                           btlbw=args.btlbw, rtt=args.rtt,
+                                           queue_size=args.queue_size,
+                                           website=args.website, date=args.date,
+                                           min_date=args.min_date):
+                print(experiment['archive_path'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Sync experiment archives from a remote machine into a local directory.
+
+load_experiments used to run ls on the remote machine and then scp each
+missing archive from its own pool worker, with no checksum and no way to
+resume. Instead, the remote machine sends a manifest of the matching archives
+(name, size, mtime and sha256). The manifest comes from its experiment
+catalog when it has one, with a find listing for archives the catalog
+doesn't know about. The manifest is diffed against the local catalog. Only
+archives that are missing locally or differ in size or sha256 are copied.
+The copies run as parallel sftp streams over the one pooled ssh connection.
+Archives older than min_date, or superseded by a later run with the same
+name, are dropped from the manifest before it is diffed, so they are never
+copied. Each copy goes to a .part file, which is resumed by the next sync if it is
+interrupted. Copied archives are checked against the manifest's sha256 and
+added to the local catalog.
+
+python3 -m data_analysis.experiment_sync 128.2.208.131 '*cubic*' -o /opt/cctestbed/data-raw
+"""
+import argparse
+import json
+import logging
+import os
+import shlex
+import sys
+from collections import namedtuple
+from contextlib import ExitStack
+
+from command import fetch_remote_files, get_ssh_client
+from data_analysis.experiment_catalog import (ExperimentCatalog, get_archive_exp_name,
+                                              get_sha256)
+
+# cctestbed checkout on the remote machine, used to read its catalog
+REMOTE_CODEPATH = '/opt/cctestbed'
+# max number of archives copied at the same time
+SYNC_WORKERS = 8
+
+ManifestEntry = namedtuple('ManifestEntry', ['exp_name', 'path', 'size', 'mtime', 'sha256'])
+
+def _exec(ssh_client, cmd):
+    _, stdout, _ = ssh_client.exec_command(cmd, timeout=600)
+    with stdout:
+        output = stdout.read().decode('utf-8')
+        exit_status = stdout.channel.recv_exit_status()
+    return exit_status, output
+
+def get_remote_manifest(ssh_client, patterns, remote_dir='/tmp',
+                        remote_codepath=REMOTE_CODEPATH):
+    """Return dict of exp_name to ManifestEntry of remote archives matching patterns.
+
+    Archives in remote_dir are listed with find. Archives that are in the remote
+    catalog, in remote_dir or anywhere else, also get their sha256.
+    """
+    manifest = {}
+    names = ' -o '.join('-name {}'.format(shlex.quote('{}.tar.gz'.format(pattern)))
+                        for pattern in patterns)
+    cmd = r'find {} -maxdepth 1 -type f \( {} \) -printf "%p\t%s\t%T@\n"'.format(
+        shlex.quote(remote_dir), names)
+    exit_status, output = _exec(ssh_client, cmd)
+    if exit_status != 0:
+        logging.warning('Could not list archives in remote directory {}'.format(remote_dir))
+    for line in output.splitlines():
+        path, size, mtime = line.split('\t')
+        exp_name = get_archive_exp_name(path)
+        manifest[exp_name] = ManifestEntry(exp_name, path, int(size), float(mtime), None)
+    cmd = 'PYTHONPATH={} python3 -m data_analysis.experiment_catalog manifest {}'.format(
+        shlex.quote(remote_codepath), ' '.join(shlex.quote(pattern) for pattern in patterns))
+    exit_status, output = _exec(ssh_client, cmd)
+    if exit_status != 0:
+        logging.warning('Could not read remote experiment catalog, archives will not be checksummed')
+        return manifest
+    for entry in json.loads(output):
+        listed = manifest.get(entry['exp_name'])
+        # the catalog is out of date if the archive changed since it was added
+        if listed is not None and listed.size != entry['size']:
+            continue
+        manifest[entry['exp_name']] = ManifestEntry(**entry)
+    return manifest
+
+def filter_manifest(manifest, min_date=None, remove_duplicates=False):
+    """Return manifest without the archives load_experiments would drop.
+
+    Parameters:
+    -----------
+    min_date : str, optional
+       Drop archives whose experiment time is smaller than this, ex. '20190101'
+    remove_duplicates : bool
+       Keep only the most recent archive of experiments with the same name
+    """
+    filtered = {}
+    for exp_name in sorted(manifest.keys()):
+        name, exp_time = exp_name.rsplit('-', 1) if '-' in exp_name else ('', exp_name)
+        if min_date is not None and exp_time < min_date:
+            continue
+        if remove_duplicates:
+            # exp_names sort by time within a name, so the last one is kept
+            filtered[name] = manifest[exp_name]
+        else:
+            filtered[exp_name] = manifest[exp_name]
+    return {entry.exp_name: entry for entry in filtered.values()}
+
+def diff_manifest(manifest, catalog, local_dir):
+    """Return (list of local archive paths up to date, list of ManifestEntry to copy)"""
+    up_to_date = []
+    to_copy = []
+    for exp_name, entry in sorted(manifest.items()):
+        localpath = os.path.join(local_dir, os.path.basename(entry.path))
+        local = catalog.get(exp_name)
+        if (local is not None and local['archive_path'] == os.path.abspath(localpath)
+                and os.path.isfile(localpath)):
+            same_size = local['archive_size'] == entry.size
+            same_sha256 = (entry.sha256 is None or local['archive_sha256'] is None
+                           or local['archive_sha256'] == entry.sha256)
+            if same_size and same_sha256:
+                up_to_date.append(localpath)
+                continue
+        elif os.path.isfile(localpath) and os.path.getsize(localpath) == entry.size:
+            # copied before the catalog existed, or cataloged somewhere else
+            sha256 = get_sha256(localpath)
+            if entry.sha256 is None or entry.sha256 == sha256:
+                catalog.add(localpath, sha256=sha256)
+                up_to_date.append(localpath)
+                continue
+        to_copy.append(entry)
+    return up_to_date, to_copy
+
+def sync_experiments(ip_addr, username, patterns, local_dir, catalog=None,
+                     remote_dir='/tmp', workers=SYNC_WORKERS, key_filename=None,
+                     min_date=None, remove_duplicates=False):
+    """Copy remote archives matching patterns that local_dir doesn't have yet.
+
+    Returns list of local paths of all matching archives that are up to date,
+    whether they were copied now or before.
+
+    Parameters:
+    -----------
+    patterns : list of str
+       Shell style patterns of experiment names, ex. '*cubic*'; '.tar.gz' is added
+    catalog : ExperimentCatalog, optional
+       Local catalog, the default catalog if not given
+    min_date : str, optional
+       Don't copy archives whose experiment time is smaller than this
+    remove_duplicates : bool
+       Don't copy archives superseded by a later run with the same name
+    """
+    with ExitStack() as stack:
+        if catalog is None:
+            catalog = stack.enter_context(ExperimentCatalog())
+        ssh_client = stack.enter_context(
+            get_ssh_client(ip_addr, username, key_filename=key_filename))
+        manifest = get_remote_manifest(ssh_client, patterns, remote_dir=remote_dir)
+        manifest = filter_manifest(manifest, min_date=min_date,
+                                   remove_duplicates=remove_duplicates)
+        up_to_date, to_copy = diff_manifest(manifest, catalog, local_dir)
+        logging.info('Found {} archive(s) on {}: {} up to date, {} to copy'.format(
+            len(manifest), ip_addr, len(up_to_date), len(to_copy)))
+        entries = {entry.path: entry for entry in to_copy}
+        copied = fetch_remote_files(ssh_client, ip_addr, list(entries.keys()),
+                                    local_dir=local_dir, workers=workers, partial=True)
+        for remotepath in copied:
+            entry = entries[remotepath]
+            localpath = os.path.join(local_dir, os.path.basename(remotepath))
+            sha256 = get_sha256(localpath)
+            if entry.sha256 is not None and sha256 != entry.sha256:
+                logging.warning('Checksum of {} does not match {}:{}, removing it'.format(
+                    localpath, ip_addr, remotepath))
+                os.remove(localpath)
+                continue
+            catalog.add(localpath, sha256=sha256)
+            up_to_date.append(localpath)
+        if len(copied) < len(to_copy):
+            logging.warning('Could not copy {} archive(s) from {}'.format(
+                len(to_copy) - len(copied), ip_addr))
+    return sorted(up_to_date)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Copy experiment archives from a remote machine.')
+    parser.add_argument('ip_addr')
+    parser.add_argument('patterns', nargs='+', help='Experiment name patterns, ex. *cubic*')
+    parser.add_argument('--username', default=os.environ.get('USER'))
+    parser.add_argument('--key-filename', dest='key_filename', default=None)
+    parser.add_argument('--remote-dir', dest='remote_dir', default='/tmp')
+    parser.add_argument('--output', '-o', dest='local_dir', default='.')
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS)
+    args = parser.parse_args(argv)
+    archives = sync_experiments(args.ip_addr, args.username, args.patterns,
+                                args.local_dir, remote_dir=args.remote_dir,
+                                workers=args.workers, key_filename=args.key_filename)
+    print('{} archive(s) up to date in {}'.format(len(archives), args.local_dir))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
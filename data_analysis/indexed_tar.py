@@ -0,0 +1,175 @@
+"""
+Experiment tarballs that can be read one member at a time.
+
+An indexed tarball is still an ordinary .tar.gz that tar -xzf can read, but
+every member is compressed as its own gzip member (gzip allows any number of
+them back to back). An index of where each member starts is stored as one
+last tar member, and the end of archive blocks are written as a fixed-size
+gzip member that points at the index. Reading one member (ex. the experiment
+description) then only decompresses that member, instead of everything in
+front of it in the archive.
+
+Create an indexed tarball from the command line like tar -czf:
+python3 -m data_analysis.indexed_tar -C /tmp exp.tar.gz exp.json queue-exp.txt
+"""
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import tarfile
+import zlib
+
+INDEX_NAME = '.cctestbed-index.json'
+
+_BLOCKSIZE = tarfile.BLOCKSIZE
+_COPY_BUFSIZE = 1 << 20
+# gzip header with an extra field holding the offset of the index
+_TRAILER_EXTRA_ID = b'CI'
+_TRAILER_HEADER = struct.Struct('<2sBBIBBH2sHQ')
+# tar end of archive marker, stored uncompressed so the trailer has a fixed size
+_END_OF_ARCHIVE = b'\0' * (2 * _BLOCKSIZE)
+_STORED_BLOCK = struct.Struct('<BHH')
+_GZIP_FOOTER = struct.Struct('<II')
+TRAILER_SIZE = (_TRAILER_HEADER.size + _STORED_BLOCK.size + len(_END_OF_ARCHIVE)
+                + _GZIP_FOOTER.size)
+
+def _tar_padding(size):
+    return b'\0' * (-size % _BLOCKSIZE)
+
+def _write_gzip_member(out, chunks, level=6):
+    """Write chunks of bytes to out as a single gzip member; return its size"""
+    start = out.tell()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    return out.tell() - start
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(_COPY_BUFSIZE)
+            if not buf:
+                break
+            yield buf
+
+def _write_trailer(out, index_offset):
+    out.write(_TRAILER_HEADER.pack(b'\x1f\x8b', 8, 4, 0, 0, 255,
+                                   12, _TRAILER_EXTRA_ID, 8, index_offset))
+    # a single final stored deflate block
+    out.write(_STORED_BLOCK.pack(1, len(_END_OF_ARCHIVE),
+                                 0xffff ^ len(_END_OF_ARCHIVE)))
+    out.write(_END_OF_ARCHIVE)
+    out.write(_GZIP_FOOTER.pack(zlib.crc32(_END_OF_ARCHIVE),
+                                len(_END_OF_ARCHIVE)))
+
+def write_indexed_tar(tar_filename, filenames, base_dir='.'):
+    """Create indexed tarball with filenames (relative to base_dir).
+
+    Returns the index: dict of member name to the offset and size of its gzip
+    member, the size of its tar header and the size of its data.
+    """
+    index = {}
+    # only used to fill in tar headers from the files on disk
+    tar = tarfile.open(fileobj=io.BytesIO(), mode='w')
+    with open(tar_filename, 'wb') as out:
+        for filename in filenames:
+            path = os.path.join(base_dir, filename)
+            filename = os.path.normpath(filename)
+            tarinfo = tar.gettarinfo(path, arcname=filename)
+            if not tarinfo.isfile():
+                raise ValueError('Can only add regular files to an indexed '
+                                 'tarball: {}'.format(path))
+            header = tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            offset = out.tell()
+            chunks = [[header], _read_file(path), [_tar_padding(tarinfo.size)]]
+            length = _write_gzip_member(out, (chunk for part in chunks
+                                              for chunk in part))
+            index[filename] = {'offset': offset, 'length': length,
+                               'header_size': len(header),
+                               'size': tarinfo.size}
+        # index is a regular tar member, so tar -xzf just extracts it too
+        index_data = json.dumps(index).encode('utf-8')
+        tarinfo = tarfile.TarInfo(INDEX_NAME)
+        tarinfo.size = len(index_data)
+        index_offset = out.tell()
+        _write_gzip_member(out, [tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8',
+                                               'surrogateescape'),
+                                 index_data, _tar_padding(len(index_data))])
+        _write_trailer(out, index_offset)
+    return index
+
+def _read_gzip_member(f, offset, length):
+    """Yield decompressed chunks of the gzip member at offset"""
+    f.seek(offset)
+    decompressor = zlib.decompressobj(31)
+    while length > 0:
+        buf = f.read(min(length, _COPY_BUFSIZE))
+        if not buf:
+            raise EOFError('Indexed tarball is truncated')
+        length -= len(buf)
+        yield decompressor.decompress(buf)
+    yield decompressor.flush()
+
+def read_index(tar_filename):
+    """Return index of an indexed tarball, or None for any other file"""
+    with open(tar_filename, 'rb') as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        if file_size < TRAILER_SIZE:
+            return None
+        f.seek(file_size - TRAILER_SIZE)
+        trailer = f.read(_TRAILER_HEADER.size)
+        (magic, method, flags, _, _, _, xlen, extra_id, extra_len,
+         index_offset) = _TRAILER_HEADER.unpack(trailer)
+        if (magic != b'\x1f\x8b' or flags != 4 or xlen != 12
+                or extra_id != _TRAILER_EXTRA_ID or extra_len != 8
+                or index_offset >= file_size - TRAILER_SIZE):
+            return None
+        data = b''.join(_read_gzip_member(f, index_offset,
+                                          file_size - TRAILER_SIZE - index_offset))
+    with tarfile.open(fileobj=io.BytesIO(data + _END_OF_ARCHIVE)) as tar:
+        return json.loads(tar.extractfile(INDEX_NAME).read().decode('utf-8'))
+
+def is_indexed_tar(tar_filename):
+    return read_index(tar_filename) is not None
+
+def iter_member(tar_filename, member, index=None):
+    """Yield chunks of the data of member; raises KeyError if not in archive"""
+    if index is None:
+        index = read_index(tar_filename)
+    entry = index[os.path.normpath(member)]
+    with open(tar_filename, 'rb') as f:
+        skip = entry['header_size']
+        remaining = entry['size']
+        for chunk in _read_gzip_member(f, entry['offset'], entry['length']):
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:skip + remaining]
+            skip = 0
+            remaining -= len(chunk)
+            if chunk:
+                yield chunk
+
+def extract_indexed_member(tar_filename, member, localpath, index=None):
+    """Write data of member to localpath"""
+    with open(localpath, 'wb') as f:
+        for chunk in iter_member(tar_filename, member, index=index):
+            f.write(chunk)
+    return localpath
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create an indexed tarball.')
+    parser.add_argument('-C', '--directory', default='.',
+                        help='Directory the files are relative to')
+    parser.add_argument('tar_filename')
+    parser.add_argument('filenames', nargs='*')
+    args = parser.parse_args(argv)
+    write_indexed_tar(args.tar_filename, args.filenames, base_dir=args.directory)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Per flow queue occupancy computed from queue log events.
+
+Every enqueued packet that isn't dropped adds one packet to the queue for its
+src port and every dequeued packet removes one. The occupancy of each port is a
+signed cumulative sum of these events, computed here per port group over the
+integer encoded ports instead of one-hot encoding every event.
+"""
+import numpy as np
+import pandas as pd
+
+def get_occupancy_deltas(dequeued, dropped):
+    """Return change in queue occupancy for each event: +1, -1 or 0 (dropped)"""
+    dequeued = np.asarray(dequeued, dtype=bool)
+    dropped = np.asarray(dropped, dtype=bool)
+    deltas = np.where(dequeued, -1, 1).astype(np.int64)
+    deltas[dropped & ~dequeued] = 0
+    return deltas
+
+def get_port_occupancy(codes, deltas, num_ports, initial=None):
+    """Occupancy of the port of each event, right after that event.
+
+    Parameters:
+    -----------
+    codes : np.ndarray of int
+       Index of the port of each event, in [0, num_ports)
+    deltas : np.ndarray of int
+       Change in occupancy for each event (see get_occupancy_deltas)
+    num_ports : int
+    initial : np.ndarray of int, optional
+       Occupancy of each port before the first event
+    """
+    order = np.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    cumsum = np.cumsum(deltas[order])
+    # subtract running total of all the ports sorted before each group
+    group_starts = np.searchsorted(sorted_codes, np.arange(num_ports))
+    offsets = np.concatenate([[0], cumsum])[group_starts]
+    occupancy = np.empty(len(codes), dtype=np.int64)
+    occupancy[order] = cumsum - offsets[sorted_codes]
+    if initial is not None:
+        occupancy += np.asarray(initial, dtype=np.int64)[codes]
+    return occupancy
+
+def get_flow_occupancy(src, dequeued, dropped, ports=None, initial=None):
+    """Return DataFrame with the occupancy of every port after each event.
+
+    Events must be sorted by time. Each column is the number of packets from
+    that src port in the queue; the occupancy of a port only changes on events
+    from that port, so it is forward filled in between.
+
+    Parameters:
+    -----------
+    src, dequeued, dropped : array-like
+       Columns of queue log events
+    ports : list of int, optional
+       Ports to compute occupancy for. All ports seen in src must be included.
+       Defaults to the unique values in src.
+    initial : pd.Series, optional
+       Occupancy of each port before the first event, indexed by port.
+       Use the last row of the previous result when processing a log in chunks.
+    """
+    src = np.asarray(src)
+    if ports is None:
+        ports = np.unique(src)
+    ports = np.asarray(ports)
+    if initial is None:
+        initial = np.zeros(len(ports), dtype=np.int64)
+    else:
+        initial = pd.Series(initial).reindex(ports, fill_value=0).values.astype(np.int64)
+    codes = np.searchsorted(ports, src)
+    deltas = get_occupancy_deltas(dequeued, dropped)
+    port_occupancy = get_port_occupancy(codes, deltas, len(ports), initial)
+
+    positions = np.arange(len(src))
+    occupancy = np.empty((len(src), len(ports)), dtype=np.int64)
+    for idx in range(len(ports)):
+        # position of the last event from this port at or before each event
+        last_event = np.maximum.accumulate(np.where(codes == idx, positions, -1))
+        occupancy[:, idx] = np.where(last_event >= 0,
+                                     port_occupancy[np.maximum(last_event, 0)],
+                                     initial[idx])
+    return pd.DataFrame(occupancy, columns=ports.tolist())
@@ -0,0 +1,246 @@
+"""
+Classify a flow from its queue log while the flow is still running.
+
+The offline pipeline waits for the whole flow, stores the queue log and then
+computes features with prediction.resample_dtw: an EWMA of the queue
+occupancy, resampled to one value per RTT. Here the same features are computed
+as queue log events are read, one resample interval at a time, and each new
+value extends the DTW distances to the training flows (dtw.IncrementalDTW)
+instead of recomputing them.
+
+DTW distances of a growing flow can still change order, so there is no
+guarantee the label won't change. The classifier is confident once the
+closest label has been ahead of every other label by a margin for a while;
+the caller can then stop the flow instead of running it for the full 65 s.
+
+classifier = OnlineClassifier(training_flows, queue_size, resample_interval)
+classify_queue_log(queue_log, classifier, is_running=lambda: flow_running())
+results = classifier.results()
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.dtw import IncrementalDTW
+from data_analysis.queue_log import DEFAULT_HOLDBACK, QueueLogTail
+
+# same as prediction.ALPHA, used for the training flows
+ALPHA = 0.002
+# closest label must be this much (relative) closer than the next label ...
+DEFAULT_MARGIN = 0.5
+# ... for this many seconds, after at least this many seconds of the flow
+DEFAULT_PATIENCE = 5
+DEFAULT_MIN_DURATION = 10
+
+_DAY_NS = 24 * 60 * 60 * 10**9
+
+class OnlineFeatures:
+    """Compute resample_dtw features from queue log events as they are read.
+
+    Events can be given in any number of chunks. Each resample interval is
+    only output once an event from a later interval has been seen, so the
+    values output so far never change.
+
+    Parameters:
+    -----------
+    queue_size : int
+       Queue occupancy is divided by this, like in compute_flow_features
+    resample_interval : int
+       Length in ms of each interval (the RTT of the training flows)
+    alpha : float
+       EWMA smoothing factor
+    holdback : int
+       Number of most recent events to hold back until the next chunk, since
+       the queue module can write events slightly out of order
+    """
+    def __init__(self, queue_size, resample_interval, alpha=ALPHA,
+                 holdback=DEFAULT_HOLDBACK):
+        self.queue_size = queue_size
+        self.interval_ns = int(resample_interval * 10**6)
+        self.alpha = alpha
+        self.holdback = holdback
+        self._pending = None
+        self._ewma = None
+        # pandas resample bins start at midnight of the day of the first event
+        self._origin = None
+        self._bin = None
+        self._bin_value = None
+        self.features = []
+
+    def _emit(self, num_bins):
+        values = [round(self._bin_value, 6)] * num_bins
+        self.features.extend(values)
+        return values
+
+    def _process(self, events):
+        """Add sorted events to the EWMA; return values of finished intervals"""
+        if len(events) == 0:
+            return []
+        # keep last of events at the same time, like compute_flow_features
+        events = events.drop_duplicates('time', keep='last')
+        times = events['time'].values.astype(np.int64)
+        occupancy = events['size'].values / self.queue_size
+        if self._ewma is not None:
+            occupancy = np.concatenate([[self._ewma], occupancy])
+        ewma = pd.Series(occupancy).ewm(alpha=self.alpha, adjust=False).mean().values
+        if self._ewma is not None:
+            ewma = ewma[1:]
+        self._ewma = ewma[-1]
+        if self._origin is None:
+            self._origin = times[0] - times[0] % _DAY_NS
+        bins = (times - self._origin) // self.interval_ns
+        # last event of each interval
+        last = np.flatnonzero(np.append(np.diff(bins) != 0, True))
+        values = []
+        for b, value in zip(bins[last], ewma[last]):
+            if self._bin is not None and b > self._bin:
+                # intervals without events repeat the last value (ffill)
+                values.extend(self._emit(b - self._bin))
+            self._bin = b
+            self._bin_value = value
+        return values
+
+    def update(self, events):
+        """Add queue log events; return list of new feature values.
+
+        Parameters:
+        -----------
+        events : pd.DataFrame
+           Queue log events with time and size columns, ex. from QueueLogTail
+        """
+        events = events[['time', 'size']]
+        if self._pending is not None:
+            events = pd.concat([self._pending, events], ignore_index=True)
+        if len(events) == 0:
+            return []
+        events = events.sort_values('time', kind='mergesort')
+        # anything older than the oldest held back event is done
+        watermark = events['time'].iloc[-self.holdback:].min()
+        done = events['time'].values < watermark
+        self._pending = events[~done]
+        return self._process(events[done])
+
+    def flush(self):
+        """Add held back events and output the last interval; return new values"""
+        values = []
+        if self._pending is not None:
+            values = self._process(self._pending)
+            self._pending = None
+        if self._bin_value is not None:
+            values.extend(self._emit(1))
+            self._bin_value = None
+        return values
+
+class OnlineClassifier:
+    """Label a flow with the ccalg of the closest training flow as it runs.
+
+    Parameters:
+    -----------
+    training_flows : dict
+       Training experiment name to its features, see dtw.classify_series
+    queue_size : int
+    resample_interval : int
+       See OnlineFeatures
+    margin : float
+       Min (second closest - closest) / second closest distance between the
+       closest label and any other label to be confident
+    patience : float
+       Seconds the margin has to hold for
+    min_duration : float
+       Seconds of the flow to see before being confident
+    """
+    def __init__(self, training_flows, queue_size, resample_interval,
+                 alpha=ALPHA, margin=DEFAULT_MARGIN, patience=DEFAULT_PATIENCE,
+                 min_duration=DEFAULT_MIN_DURATION):
+        self.training_exp_names = list(training_flows.keys())
+        self.ccalgs = [exp_name.split('-')[0] for exp_name in self.training_exp_names]
+        self.online_features = OnlineFeatures(queue_size, resample_interval,
+                                              alpha=alpha)
+        self.dtw = IncrementalDTW(list(training_flows.values()))
+        self.margin = margin
+        samples_per_second = 1000 / resample_interval
+        self.patience = max(1, int(np.ceil(patience * samples_per_second)))
+        self.min_samples = int(np.ceil(min_duration * samples_per_second))
+        self._num_ahead = 0
+        self.confident = False
+
+    def get_margin(self):
+        """Return relative margin of the closest label over the next closest label"""
+        distances = self.dtw.distances
+        closest = int(np.argmin(distances))
+        others = [distance for ccalg, distance in zip(self.ccalgs, distances)
+                  if ccalg != self.ccalgs[closest]]
+        if len(others) == 0:
+            return 1.0
+        second = min(others)
+        if not np.isfinite(second) or second == 0:
+            return 0.0
+        return (second - distances[closest]) / second
+
+    def _add(self, values):
+        for value in values:
+            self.dtw.append(value)
+            if self.get_margin() >= self.margin:
+                self._num_ahead += 1
+            else:
+                self._num_ahead = 0
+        self.confident = (self.dtw.done
+                          or (self.dtw.num_values >= self.min_samples
+                              and self._num_ahead >= self.patience))
+        return self.confident
+
+    def update(self, events):
+        """Add queue log events; return True once confident in the label"""
+        return self._add(self.online_features.update(events))
+
+    def finish(self):
+        """Add the rest of the flow once it is done; return results"""
+        self._add(self.online_features.flush())
+        return self.results()
+
+    def results(self):
+        """Return dict like dtw.classify_series for the flow seen so far.
+
+        Also has num_samples (number of feature values), margin and confident.
+        """
+        distances = self.dtw.distances
+        if self.dtw.num_values == 0:
+            raise ValueError('No features to classify yet')
+        closest = int(np.argmin(distances))
+        closest_distance = float(distances[closest])
+        results = dict(zip(self.ccalgs, distances.tolist()))
+        results['predicted_label'] = self.ccalgs[closest]
+        results['closest_distance'] = closest_distance
+        results['num_distance_ties'] = int((distances == closest_distance).sum())
+        results['closest_exp_name'] = self.training_exp_names[closest]
+        results['num_samples'] = self.dtw.num_values
+        results['margin'] = self.get_margin()
+        results['confident'] = self.confident
+        return results
+
+def classify_queue_log(queue_log, classifier, is_running, poll_interval=0.5):
+    """Feed queue log to classifier while it is written; return True if confident.
+
+    Returns as soon as the classifier is confident, so the caller can stop the
+    flow. Otherwise reads until is_running() returns False and then finishes
+    the classifier with the rest of the log.
+
+    Parameters:
+    -----------
+    queue_log : str
+       Path to queue log the queue module is writing
+    classifier : OnlineClassifier
+    is_running : callable
+       Returns False once the flow is done
+    poll_interval : float
+       Seconds to wait between reads of the queue log
+    """
+    tail = QueueLogTail(queue_log)
+    while is_running():
+        if classifier.update(tail.read()):
+            return True
+        time.sleep(poll_interval)
+    classifier.update(tail.read())
+    classifier.finish()
+    return classifier.confident
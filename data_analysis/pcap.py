@@ -0,0 +1,389 @@
+"""
+Single pass analysis of the tcpdump pcaps captured during experiments.
+
+For every server pcap we used to run tshark for ack RTTs, capinfos for the
+data bit rate, tshark again for retransmissions and lost segments and tshark
+-2 yet again for per stream timings. Here the pcap is memory mapped and read
+once: a loop over the record headers finds where each packet is, then every
+IPv4/TCP field is gathered for all packets at once with NumPy and the TCP
+analysis is done with pandas group operations. The result is one table with a
+row per packet that all of these consumers read:
+
+time, time_relative, tcp_time_relative, frame_len, is_tcp, stream, src,
+srcport, dst, dstport, seq, ack, flags, tcp_len, ack_rtt, retransmission,
+out_of_order, lost_segment
+
+seq & ack are relative to the first sequence number of each direction, like
+tshark shows them. The TCP analysis approximates tshark's heuristics:
+- lost_segment: sequence number is past everything seen so far in that
+  direction (tshark's "previous segment not captured")
+- retransmission / out_of_order: segment with data that starts before the
+  end of what was already seen in that direction; out_of_order if it came
+  within OUT_OF_ORDER_THRESHOLD of the previous segment, keepalives excluded
+- ack_rtt: on the first ACK of new data, time since the newest segment that
+  ends at the acknowledged sequence number
+
+Write the RTT & capinfos files we keep in the experiment tarball with:
+python3 -m data_analysis.pcap server.pcap --rtt rtt.txt --capinfos capinfos.txt
+"""
+import argparse
+import mmap
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.queue_store import open_queue_store
+
+# magic of the pcap global header as read in either byte order
+_PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': ('<', 10**6),
+               b'\xa1\xb2\xc3\xd4': ('>', 10**6),
+               b'\x4d\x3c\xb2\xa1': ('<', 10**9),
+               b'\xa1\xb2\x3c\x4d': ('>', 10**9)}
+_PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+_GLOBAL_HEADER_SIZE = 24
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+# offset of the network layer header for each link type
+_LINKTYPE_OFFSETS = {LINKTYPE_NULL: 4,
+                     LINKTYPE_ETHERNET: 14,
+                     LINKTYPE_RAW: 0,
+                     LINKTYPE_LINUX_SLL: 16,
+                     LINKTYPE_IPV4: 0,
+                     LINKTYPE_LINUX_SLL2: 20}
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+IPPROTO_TCP = 6
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# tshark's default when it doesn't know the RTT of the connection yet
+OUT_OF_ORDER_THRESHOLD = 0.003
+
+_SEQ_MASK = 0xffffffff
+# enough captured bytes for the IPv4 header & fixed part of the TCP header
+_MIN_IPV4_TCP_LEN = 20 + 20
+
+PCAP_COLUMNS = ['time', 'time_relative', 'tcp_time_relative', 'frame_len',
+                'is_tcp', 'stream', 'src', 'srcport', 'dst', 'dstport', 'seq',
+                'ack', 'flags', 'tcp_len', 'ack_rtt', 'retransmission',
+                'out_of_order', 'lost_segment']
+
+def _read_records(buf):
+    """Return (linktype, times, captured lengths, original lengths, data offsets)"""
+    if len(buf) < _GLOBAL_HEADER_SIZE:
+        raise ValueError('Not a pcap file: too short')
+    magic = bytes(buf[:4])
+    if magic == _PCAPNG_MAGIC:
+        raise ValueError('pcapng files are not supported, write pcap with tcpdump -w')
+    if magic not in _PCAP_MAGIC:
+        raise ValueError('Not a pcap file: bad magic {!r}'.format(magic))
+    byte_order, ticks_per_second = _PCAP_MAGIC[magic]
+    linktype = struct.unpack_from(byte_order + 'I', buf, 20)[0] & 0x0fffffff
+    record_header = struct.Struct(byte_order + 'IIII')
+    seconds, ticks, incl_lens, orig_lens, offsets = [], [], [], [], []
+    pos = _GLOBAL_HEADER_SIZE
+    end = len(buf)
+    while pos + record_header.size <= end:
+        ts_sec, ts_frac, incl_len, orig_len = record_header.unpack_from(buf, pos)
+        pos += record_header.size
+        if pos + incl_len > end:
+            # last packet cut off while tcpdump was writing it
+            break
+        seconds.append(ts_sec)
+        ticks.append(ts_frac)
+        incl_lens.append(incl_len)
+        orig_lens.append(orig_len)
+        offsets.append(pos)
+        pos += incl_len
+    times = (np.array(seconds, dtype=np.float64)
+             + np.array(ticks, dtype=np.float64) / ticks_per_second)
+    return (linktype, times, np.array(incl_lens, dtype=np.int64),
+            np.array(orig_lens, dtype=np.int64), np.array(offsets, dtype=np.int64))
+
+def _gather(data, offsets, nbytes):
+    """Return big endian unsigned ints of nbytes starting at each offset"""
+    value = np.zeros(len(offsets), dtype=np.int64)
+    for i in range(nbytes):
+        value = (value << 8) | data[offsets + i]
+    return value
+
+def _get_network_offsets(data, linktype, offsets, incl_lens):
+    """Return offsets of the network layer & mask of packets that are IPv4"""
+    if linktype not in _LINKTYPE_OFFSETS:
+        raise ValueError('Unsupported pcap link type: {}'.format(linktype))
+    l3 = offsets + _LINKTYPE_OFFSETS[linktype]
+    l3_end = offsets + incl_lens
+    is_ipv4 = l3 < l3_end
+    if linktype == LINKTYPE_ETHERNET:
+        has_ethertype = offsets + 14 <= l3_end
+        ethertype = np.zeros(len(offsets), dtype=np.int64)
+        ethertype[has_ethertype] = _gather(data, offsets[has_ethertype] + 12, 2)
+        is_vlan = ethertype == ETHERTYPE_VLAN
+        has_vlan = is_vlan & (offsets + 18 <= l3_end)
+        ethertype[has_vlan] = _gather(data, offsets[has_vlan] + 16, 2)
+        l3 = l3 + 4 * is_vlan
+        is_ipv4 &= ethertype == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        is_ipv4 &= _gather(data, np.where(is_ipv4, offsets + 14, 0), 2) == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        is_ipv4 &= _gather(data, np.where(is_ipv4, offsets, 0), 2) == ETHERTYPE_IPV4
+    # the version nibble is checked for every link type below
+    return l3, is_ipv4
+
+def _read_packets(filename):
+    """Return DataFrame with the IPv4/TCP header fields of every packet"""
+    with open(filename, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            raise ValueError('Not a pcap file: {} is empty'.format(filename))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            linktype, times, incl_lens, orig_lens, offsets = _read_records(buf)
+            data = np.frombuffer(buf, dtype=np.uint8)
+            try:
+                df = _parse_headers(data, linktype, offsets, incl_lens)
+            finally:
+                # no views of the mmap can be left when it is closed
+                del data
+    df['time'] = times
+    df['frame_len'] = orig_lens
+    return df
+
+def _parse_headers(data, linktype, offsets, incl_lens):
+    l3, is_ipv4 = _get_network_offsets(data, linktype, offsets, incl_lens)
+    l3_end = offsets + incl_lens
+    # only gather from packets that are long enough to have the header
+    rows = np.flatnonzero(is_ipv4 & (l3 + _MIN_IPV4_TCP_LEN <= l3_end))
+    l3, l3_end = l3[rows], l3_end[rows]
+    version_ihl = data[l3].astype(np.int64)
+    ihl = (version_ihl & 0x0f) * 4
+    keep = (((version_ihl >> 4) == 4) & (ihl >= 20)
+            & (data[l3 + 9] == IPPROTO_TCP)
+            # fragments after the first don't have a TCP header
+            & ((_gather(data, l3 + 6, 2) & 0x1fff) == 0)
+            & (l3 + ihl + 20 <= l3_end))
+    rows, l3, ihl = rows[keep], l3[keep], ihl[keep]
+    l4 = l3 + ihl
+    doff = (data[l4 + 12].astype(np.int64) >> 4) * 4
+    fields = {'src': _gather(data, l3 + 12, 4),
+              'dst': _gather(data, l3 + 16, 4),
+              'srcport': _gather(data, l4, 2),
+              'dstport': _gather(data, l4 + 2, 2),
+              'seq': _gather(data, l4 + 4, 4),
+              'ack': _gather(data, l4 + 8, 4),
+              'flags': data[l4 + 13].astype(np.int64),
+              'tcp_len': np.maximum(_gather(data, l3 + 2, 2) - ihl - doff, 0)}
+    is_tcp = np.zeros(len(offsets), dtype=bool)
+    is_tcp[rows] = True
+    columns = {'is_tcp': is_tcp}
+    for col, values in fields.items():
+        columns[col] = np.zeros(len(offsets), dtype=np.int64)
+        columns[col][rows] = values
+    return pd.DataFrame(columns)
+
+def _ip_to_str(ips):
+    unique, inverse = np.unique(ips, return_inverse=True)
+    names = np.array(['{}.{}.{}.{}'.format(ip >> 24 & 0xff, ip >> 16 & 0xff,
+                                           ip >> 8 & 0xff, ip & 0xff)
+                      for ip in unique.tolist()], dtype=object)
+    return names[inverse.reshape(-1)]
+
+def _analyze_tcp(tcp):
+    """Add stream, relative seq/ack & TCP analysis columns to TCP packets"""
+    src = tcp['src'] * 2**16 + tcp['srcport']
+    dst = tcp['dst'] * 2**16 + tcp['dstport']
+    # streams are numbered in the order they are first seen, like tshark
+    ep_lo = np.minimum(src, dst)
+    ep_hi = np.maximum(src, dst)
+    tcp['stream'] = tcp.groupby([ep_lo, ep_hi], sort=False).ngroup()
+    direction = tcp.groupby([src, dst], sort=False)
+
+    isn = direction['seq'].transform('first')
+    syn = (tcp['flags'] & TCP_SYN) > 0
+    fin = (tcp['flags'] & TCP_FIN) > 0
+    rel_seq = (tcp['seq'] - isn) & _SEQ_MASK
+    seg_len = tcp['tcp_len'] + syn + fin
+    seq_end = rel_seq + seg_len
+
+    # initial sequence number of the reverse direction to make acks relative
+    isns = pd.Series(isn.values, index=pd.MultiIndex.from_arrays([src, dst]))
+    isns = isns[~isns.index.duplicated()]
+    reverse_isn = isns.reindex(pd.MultiIndex.from_arrays([dst, src])).values
+    has_ack = ((tcp['flags'] & TCP_ACK) > 0) & ~np.isnan(reverse_isn)
+    rel_ack = pd.Series(np.where(has_ack, (tcp['ack'] - np.nan_to_num(reverse_isn)
+                                           .astype(np.int64)) & _SEQ_MASK, 0),
+                        index=tcp.index)
+
+    # end of everything sent in this direction before each segment
+    prev_max_end = seq_end.groupby([src, dst], sort=False).cummax()
+    prev_max_end = prev_max_end.groupby([src, dst], sort=False).shift(1)
+    since_prev = tcp['time'].groupby([src, dst], sort=False).diff()
+    rst = (tcp['flags'] & TCP_RST) > 0
+    keepalive = (seg_len <= 1) & (rel_seq == prev_max_end - 1) & ~syn & ~fin
+    lost_segment = (rel_seq > prev_max_end) & ~rst
+    behind = (seg_len > 0) & (rel_seq < prev_max_end) & ~keepalive
+    out_of_order = behind & (since_prev < OUT_OF_ORDER_THRESHOLD)
+    retransmission = behind & ~out_of_order
+
+    tcp['seq'] = rel_seq
+    tcp['ack'] = rel_ack
+    tcp['lost_segment'] = lost_segment
+    tcp['retransmission'] = retransmission
+    tcp['out_of_order'] = out_of_order
+    tcp['ack_rtt'] = _get_ack_rtt(tcp, src, dst, seq_end, seg_len, has_ack)
+    tcp['tcp_time_relative'] = (tcp['time']
+                                - tcp.groupby('stream')['time'].transform('first'))
+    return tcp
+
+def _get_ack_rtt(tcp, src, dst, seq_end, seg_len, has_ack):
+    """Return time from the newest segment ending at each new ack to the ack"""
+    segments = pd.DataFrame({'sender': src.values, 'receiver': dst.values,
+                             'value': seq_end.values,
+                             'sent': tcp['time'].values})[(seg_len > 0).values]
+    acks = pd.DataFrame({'sender': dst.values, 'receiver': src.values,
+                         'value': tcp['ack'].values, 'time': tcp['time'].values,
+                         'row': np.arange(len(tcp))})[has_ack.values]
+    # only acks of new data, not duplicate acks
+    prev_max_ack = (acks.groupby(['sender', 'receiver'], sort=False)['value']
+                    .cummax().groupby([acks['sender'], acks['receiver']], sort=False)
+                    .shift(1))
+    acks = acks[~(acks['value'] <= prev_max_ack)]
+    acks = acks.merge(segments, on=['sender', 'receiver', 'value'], how='inner')
+    # newest segment sent before the ack wins, same as tshark, so
+    # retransmitted segments are timed from the retransmission
+    acks = (acks[acks['sent'] <= acks['time']]
+            .drop_duplicates('row', keep='last'))
+    ack_rtt = np.full(len(tcp), np.nan)
+    ack_rtt[acks['row'].values] = (acks['time'] - acks['sent']).values
+    return ack_rtt
+
+def analyze_pcap(filename):
+    """Read pcap once & return DataFrame with one row per packet.
+
+    See the module docstring for the columns. Packets that aren't IPv4/TCP
+    have is_tcp False, stream -1 and no TCP fields.
+
+    Parameters:
+    -----------
+    filename : str
+       Path to pcap written by tcpdump (not pcapng)
+    """
+    df = _read_packets(filename)
+    if len(df) > 0:
+        df['time_relative'] = df['time'] - df['time'].iloc[0]
+    else:
+        df['time_relative'] = pd.Series(dtype=np.float64)
+    tcp = df[df['is_tcp']].copy()
+    if len(tcp) > 0:
+        tcp = _analyze_tcp(tcp)
+    df['stream'] = -1
+    df['tcp_time_relative'] = np.nan
+    df['ack_rtt'] = np.nan
+    for col in ['retransmission', 'out_of_order', 'lost_segment']:
+        df[col] = False
+    for col in ['stream', 'seq', 'ack', 'tcp_time_relative', 'ack_rtt',
+                'retransmission', 'out_of_order', 'lost_segment']:
+        if col in tcp:
+            df.loc[tcp.index, col] = tcp[col].values
+    df['src'] = _ip_to_str(df['src'].values)
+    df['dst'] = _ip_to_str(df['dst'].values)
+    df.loc[~df['is_tcp'], ['src', 'dst']] = ''
+    return df[PCAP_COLUMNS]
+
+def get_pcap_summary(df_pcap):
+    """Return dict with data_bit_rate (bits/s, like capinfos) & TCP analysis counts"""
+    duration = (df_pcap['time'].iloc[-1] - df_pcap['time'].iloc[0]
+                if len(df_pcap) > 0 else 0)
+    data_bit_rate = None
+    if duration > 0:
+        data_bit_rate = float(df_pcap['frame_len'].sum() * 8 / duration)
+    return {'num_packets': len(df_pcap),
+            'data_bit_rate': data_bit_rate,
+            'retransmission': int(df_pcap['retransmission'].sum()),
+            'out_of_order': int(df_pcap['out_of_order'].sum()),
+            'lost_segment': int(df_pcap['lost_segment'].sum())}
+
+def store_pcap_analysis(filename, store_path, key='df_pcap'):
+    """Analyze pcap & write its table to a new queue store; return the table"""
+    df_pcap = analyze_pcap(filename)
+    with open_queue_store(store_path, mode='w') as store:
+        store.put(key, df_pcap, format='table')
+    return df_pcap
+
+def write_rtt_log(df_pcap, rtt_log):
+    """Write frame.time_relative & tcp.analysis.ack_rtt, like tshark -Tfields"""
+    with open(rtt_log, 'w') as f:
+        for time_relative, ack_rtt in zip(df_pcap['time_relative'].values,
+                                          df_pcap['ack_rtt'].values):
+            if np.isnan(ack_rtt):
+                f.write('{:.9f}\t\n'.format(time_relative))
+            else:
+                f.write('{:.9f}\t{:.9f}\n'.format(time_relative, ack_rtt))
+
+def write_tcpdump_fields(df_pcap, filename):
+    """Append fields of every packet, like tshark -T fields -E separator=,
+
+    Columns are frame.time_relative, tcp.len, tcp.srcport, tcp.seq &
+    tcp.analysis.ack_rtt without a header.
+    """
+    df_pcap[['time_relative', 'tcp_len', 'srcport', 'seq', 'ack_rtt']].to_csv(
+        filename, mode='a', header=False, index=False, float_format='%.9f')
+
+def write_stream_log(df_pcap, stream_log, ports=None):
+    """Write per packet stream timings, like tshark -2 -T fields -E separator=,
+
+    Columns are tcp.stream, ip.src, tcp.srcport, ip.dst, tcp.dstport,
+    tcp.time_relative, tcp.len & frame.time_relative without a header.
+
+    Parameters:
+    -----------
+    ports : list of int, optional
+       Only write packets to or from these ports, like -R "tcp.port eq ..."
+    """
+    df = df_pcap[df_pcap['is_tcp']]
+    if ports is not None:
+        ports = [int(port) for port in ports]
+        df = df[df['srcport'].isin(ports) | df['dstport'].isin(ports)]
+    df[['stream', 'src', 'srcport', 'dst', 'dstport', 'tcp_time_relative',
+        'tcp_len', 'time_relative']].to_csv(stream_log, header=False,
+                                            index=False, float_format='%.9f')
+
+def write_capinfos_log(df_pcap, filename, capinfos_log):
+    """Write data bit rate like capinfos -iTm"""
+    data_bit_rate = get_pcap_summary(df_pcap)['data_bit_rate']
+    with open(capinfos_log, 'w') as f:
+        f.write('File name,Data bit rate (bits/sec)\n')
+        f.write('{},{}\n'.format(filename, 'n/a' if data_bit_rate is None
+                                 else '{:.2f}'.format(data_bit_rate)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Analyze a pcap in one pass: RTTs, data bit rate and TCP loss.')
+    parser.add_argument('pcap')
+    parser.add_argument('--rtt', default=None,
+                        help='Write time relative & ack RTT of every packet, like tshark')
+    parser.add_argument('--capinfos', default=None,
+                        help='Write data bit rate, like capinfos -iTm')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Store the per packet table (df_pcap) in this queue store')
+    args = parser.parse_args(argv)
+    if args.output is not None:
+        df_pcap = store_pcap_analysis(args.pcap, args.output)
+    else:
+        df_pcap = analyze_pcap(args.pcap)
+    if args.rtt is not None:
+        write_rtt_log(df_pcap, args.rtt)
+    if args.capinfos is not None:
+        write_capinfos_log(df_pcap, args.pcap, args.capinfos)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
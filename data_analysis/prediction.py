@@ -15,9 +15,8 @@ import matplotlib.gridspec as gridspec
 from sklearn.metrics import adjusted_rand_score
 from sklearn.metrics import accuracy_score
 
-from fastdtw import fastdtw
-from fastdtw import dtw as dtw_slow
 from scipy.spatial.distance import euclidean
+from data_analysis.dtw import dtw_distance, dtw_distances
 
 from scipy.signal import argrelextrema
 import multiprocessing as mp
@@ -378,7 +377,8 @@ def plot_flow_features_histogram(labels, noaxis=False,
     return ax
 
 class CCAlgClassifier:
-    def __init__(self, training_flow_analyzers, testing_flow_analyzers=None, distance_metric=None, normalize=True):
+    def __init__(self, training_flow_analyzers, testing_flow_analyzers=None, distance_metric=None, normalize=True,
+                 dtw_window=None):
         self.training_flow_analyzers = training_flow_analyzers
         self._training_equals_test = False
         self.testing_flow_analyzers = testing_flow_analyzers
@@ -401,6 +401,8 @@ class CCAlgClassifier:
         self._classifier_accuracy = None
         self.normalize = normalize
         self._clusters = None
+        # Sakoe-Chiba window used when distance_metric is dtw or slowdtw
+        self.dtw_window = dtw_window
 
     @property
     def true_labels(self):
@@ -465,14 +467,31 @@ class CCAlgClassifier:
                     self._testing_samples = pd.concat([self._testing_samples, padding], axis=1)
         return self._testing_samples
 
+    @property
+    def _is_dtw(self):
+        return self._distance_metric == dtw or self._distance_metric == slowdtw
+
+    def _classifier_input(self, samples):
+        # DTW distances are computed in batches up front instead of one
+        # pair at a time by sklearn
+        if self._is_dtw:
+            if self._training_equals_test:
+                return self.distances.values
+            return dtw_distances(samples.values, self.training_samples.values,
+                                 window=self.dtw_window)
+        return samples.values
+
     @property
     def classifier(self):
         if self._classifier is None:
             if self._distance_metric is None:
                 self._classifier = neighbors.KNeighborsClassifier(n_neighbors=1)
+            elif self._is_dtw:
+                self._classifier = neighbors.KNeighborsClassifier(n_neighbors=1, metric='precomputed')
             else:
                 self._classifier = neighbors.KNeighborsClassifier(n_neighbors=1,  metric=self._distance_metric, n_jobs=min(len(self.testing_samples), mp.cpu_count()))
-            self._classifier.fit(self.training_samples.values, self.true_labels_training.values.flatten())
+            training_input = self.distances.values if self._is_dtw else self.training_samples.values
+            self._classifier.fit(training_input, self.true_labels_training.values.flatten())
         return self._classifier
 
     @property
@@ -481,6 +500,9 @@ class CCAlgClassifier:
             if self._distance_metric is None:
                 distances = pairwise_distances(X=self.training_samples.values,
                                                 Y=self.training_samples.values)
+            elif self._is_dtw:
+                distances = dtw_distances(self.training_samples.values,
+                                          window=self.dtw_window)
             else:
                 distances = pairwise_distances(X=self.training_samples.values,
                                                 Y=self.training_samples.values,
@@ -564,11 +586,11 @@ class CCAlgClassifier:
                 # use cross validation if training data equals test data
                 predicted_labels = model_selection.cross_val_predict(
                     self.classifier,
-                    self.testing_samples.values,
+                    self._classifier_input(self.testing_samples),
                     self.true_labels.values.flatten()
                 )
             else:
-                predicted_labels = self.classifier.predict(self.testing_samples.values)
+                predicted_labels = self.classifier.predict(self._classifier_input(self.testing_samples))
             # WRITE IN NOTEBOOK: BUG IN THE WAY I WAS MATCHING PREDICTED LABEL FROM ARRAY TO A PARTICULAR EXPERIMENT
             # self._predicted_labels = {}
             #for idx, experiment_name in enumerate(self.testing_flow_analyzers.keys()):
@@ -586,7 +608,7 @@ class CCAlgClassifier:
             self._results['predicted_label'] = self.predicted_labels.sort_index()
             # TODO: use StratifiedKFold to do this computation when training equals test
             if not self._training_equals_test:
-                dist, index_neighbor = self.classifier.kneighbors(self.testing_samples.values)
+                dist, index_neighbor = self.classifier.kneighbors(self._classifier_input(self.testing_samples))
                 dist = dist.flatten()
                 index_neighbor = index_neighbor.flatten()
                 self._results['closest_neighbor'] = list(map(lambda x: self.training_samples.iloc[x].name, index_neighbor))
@@ -602,11 +624,12 @@ def histogram_intersection(h1, h2, bins=None):
         sm += min(h1[i], h2[i])
     return 1-sm
 
-def dtw(x, y):
-    return fastdtw(x, y, dist=euclidean)[0]
+def dtw(x, y, window=None):
+    """DTW distance between x and y, only matching points within window of each other"""
+    return dtw_distance(x, y, window=window)
 
 def slowdtw(x, y):
-    return dtw_slow(x, y, dist=euclidean)[0]
+    return dtw_distance(x, y)
 
 def scale_zero_one(x):
     return (x - x.min()) / (x.max() - x.min())
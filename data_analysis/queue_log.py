@@ -0,0 +1,357 @@
+"""
+Streaming reader for the queue logs written by the BESS Queue module.
+
+Each line of a queue log is one packet event:
+dequeued, time, src, seq, datalen, size, dropped, queued, batch
+where src and seq are hex strings (ex. 0x15b3).
+
+When the Queue module is given a dump_file it instead writes a binary log: a
+32 byte header followed by fixed-width 32 byte records (see queue.h), which is
+read directly as a NumPy structured array with no parsing.
+
+Logs are read in bounded-size chunks so memory stays flat no matter how long
+the experiment ran.
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.occupancy import get_flow_occupancy
+from data_analysis.queue_store import open_queue_store
+
+QUEUE_LOG_COLUMNS = ['dequeued', 'time', 'src', 'seq', 'datalen',
+                     'size', 'dropped', 'queued', 'batch']
+QUEUE_LOG_DTYPES = {'dequeued': bool,
+                    'time': np.uint64,
+                    'src': np.uint16,
+                    'seq': np.uint32,
+                    'datalen': np.uint16,
+                    'size': np.uint32,
+                    'dropped': bool,
+                    'queued': np.uint16,
+                    'batch': np.uint16}
+# number of hex digits used to print src (be16) and seq (be32)
+HEX_WIDTHS = {'src': 4, 'seq': 8}
+DEFAULT_CHUNKSIZE = 1000000
+# events within a flush of the queue module can be out of order, so hold back
+# this many lines at the end of each chunk until the next chunk is read
+DEFAULT_HOLDBACK = 10000
+
+QUEUE_LOG_MAGIC = b'CCQLOG01'
+QUEUE_LOG_VERSION = 1
+# must match QueueLogHeader and QueueLogRecord in queue.h
+QUEUE_LOG_HEADER_DTYPE = np.dtype([('magic', 'S8'),
+                                   ('version', '<u4'),
+                                   ('record_size', '<u4'),
+                                   ('reserved', '<u8', (2,))])
+QUEUE_LOG_RECORD_DTYPE = np.dtype([('time', '<u8'),
+                                   ('seq', '<u4'),
+                                   ('qsize', '<u4'),
+                                   ('port', '<u2'),
+                                   ('datalen', '<u2'),
+                                   ('queued', '<u2'),
+                                   ('batch', '<u2'),
+                                   ('flags', 'u1'),
+                                   ('pad', 'V7')])
+QUEUE_LOG_DEQUEUED = 0x1
+QUEUE_LOG_DROPPED = 0x2
+QUEUE_LOG_FIN = 0x4
+
+_HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+for _value, _char in enumerate(b'0123456789abcdef'):
+    _HEX_DIGITS[_char] = _value
+for _value, _char in enumerate(b'ABCDEF'):
+    _HEX_DIGITS[_char] = 10 + _value
+
+def parse_hex(values, width):
+    """Convert hex strings (with or without 0x prefix) to integers.
+
+    Parameters:
+    -----------
+    values : array-like of str
+    width : int
+       Max number of hex digits, not including the 0x prefix
+
+    Returns: (np.ndarray of uint64, np.ndarray of bool) the parsed values and
+    a mask of malformed values, which are parsed as 0.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    max_len = width + 2
+    chars = np.char.strip(np.asarray(values, dtype=np.bytes_))
+    invalid = np.char.str_len(chars) > max_len
+    chars = np.char.rjust(chars.astype('S{}'.format(max_len)), max_len, b'0')
+    codes = chars.view(np.uint8).reshape(-1, max_len).copy()
+    has_prefix = ((codes[:, 0] == ord('0'))
+                  & ((codes[:, 1] == ord('x')) | (codes[:, 1] == ord('X'))))
+    codes[has_prefix, 1] = ord('0')
+    digits = _HEX_DIGITS[codes]
+    invalid |= (digits == 255).any(axis=1)
+    weights = np.uint64(16) ** np.arange(max_len - 1, -1, -1, dtype=np.uint64)
+    parsed = (digits.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+    parsed[invalid] = 0
+    return parsed, invalid
+
+def is_binary_queue_log(queue_log):
+    """Return True if queue_log is a path to a binary queue log"""
+    if not isinstance(queue_log, str):
+        return False
+    with open(queue_log, 'rb') as f:
+        return f.read(len(QUEUE_LOG_MAGIC)) == QUEUE_LOG_MAGIC
+
+def read_binary_queue_log(queue_log):
+    """Return records of a binary queue log as a read-only memory mapped array.
+
+    Records the queue module didn't get to write before exiting (the file is
+    only trimmed to the last record on a clean shutdown) are left out.
+    """
+    header = np.fromfile(queue_log, dtype=QUEUE_LOG_HEADER_DTYPE, count=1)
+    if (len(header) == 0 or header['magic'][0] != QUEUE_LOG_MAGIC
+            or header['version'][0] != QUEUE_LOG_VERSION
+            or header['record_size'][0] != QUEUE_LOG_RECORD_DTYPE.itemsize):
+        raise ValueError('{} is not a version {} binary queue log'.format(
+            queue_log, QUEUE_LOG_VERSION))
+    with open(queue_log, 'rb') as f:
+        f.seek(0, 2)
+        num_records = ((f.tell() - QUEUE_LOG_HEADER_DTYPE.itemsize)
+                       // QUEUE_LOG_RECORD_DTYPE.itemsize)
+    if num_records <= 0:
+        return np.zeros(0, dtype=QUEUE_LOG_RECORD_DTYPE)
+    records = np.memmap(queue_log, dtype=QUEUE_LOG_RECORD_DTYPE, mode='r',
+                        offset=QUEUE_LOG_HEADER_DTYPE.itemsize,
+                        shape=(num_records,))
+    # unwritten records are all zeros and every real event has a timestamp
+    written = np.flatnonzero(records['time'])
+    num_written = written[-1] + 1 if len(written) else 0
+    return records[:num_written]
+
+def _binary_chunk(records):
+    """Convert binary queue log records to a DataFrame of queue log events"""
+    flags = records['flags']
+    return pd.DataFrame({'dequeued': (flags & QUEUE_LOG_DEQUEUED) != 0,
+                         'time': records['time'],
+                         'src': records['port'],
+                         'seq': records['seq'],
+                         'datalen': records['datalen'],
+                         'size': records['qsize'],
+                         'dropped': (flags & QUEUE_LOG_DROPPED) != 0,
+                         'queued': records['queued'],
+                         'batch': records['batch']},
+                        columns=QUEUE_LOG_COLUMNS).astype(QUEUE_LOG_DTYPES)
+
+def _iter_chunks(queue_log, chunksize):
+    """Yield (cleaned chunk, number of bad lines) from a text or binary log"""
+    if is_binary_queue_log(queue_log):
+        records = read_binary_queue_log(queue_log)
+        for start in range(0, len(records), chunksize):
+            yield _binary_chunk(records[start:start + chunksize]), 0
+        return
+    reader = pd.read_csv(queue_log, names=QUEUE_LOG_COLUMNS,
+                         usecols=range(len(QUEUE_LOG_COLUMNS)),
+                         dtype=str, skip_blank_lines=True,
+                         chunksize=chunksize)
+    for raw_chunk in reader:
+        chunk = _clean_chunk(raw_chunk)
+        yield chunk, len(raw_chunk) - len(chunk)
+
+def _clean_chunk(chunk):
+    """Drop malformed lines from a raw chunk and convert columns to their dtypes"""
+    chunk = chunk.dropna(axis='rows', how='any')
+    # check digits before converting so time never goes through a float
+    is_valid = np.ones(len(chunk), dtype=bool)
+    for col in QUEUE_LOG_COLUMNS:
+        if col not in HEX_WIDTHS:
+            values = np.char.strip(np.asarray(chunk[col].values, dtype=np.bytes_))
+            is_valid &= np.char.isdigit(values)
+    chunk = chunk[is_valid].copy()
+    for col in QUEUE_LOG_COLUMNS:
+        if col not in HEX_WIDTHS:
+            chunk[col] = pd.to_numeric(chunk[col])
+    for col, width in HEX_WIDTHS.items():
+        parsed, invalid = parse_hex(chunk[col].values, width)
+        if invalid.any():
+            print('Value error converting {} {} value(s) from hex'.format(
+                invalid.sum(), col))
+        chunk[col] = parsed
+    return chunk.astype(QUEUE_LOG_DTYPES)
+
+def read_queue_log(queue_log, chunksize=DEFAULT_CHUNKSIZE,
+                   holdback=DEFAULT_HOLDBACK):
+    """Yield DataFrames of at most about chunksize queue log events sorted by time.
+
+    Malformed lines (ex. interleaved glog output or truncated lines) are dropped.
+    Binary queue logs are detected by their header and yield the same columns.
+    Each chunk has a lineno column with the line number of the event in the
+    cleaned, sorted log.
+
+    Parameters:
+    -----------
+    queue_log : str or file-like
+       Path to queue log
+    chunksize : int
+       Number of lines to read at a time
+    holdback : int
+       Number of lines at the end of each chunk to carry over to the next chunk
+       so events flushed out of order across a chunk boundary are still sorted.
+    """
+    pending = None
+    lineno = 1
+    num_bad_lines = 0
+    for chunk, bad_lines in _iter_chunks(queue_log, chunksize):
+        num_bad_lines += bad_lines
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        # anything older than the oldest event in the held back lines is done
+        watermark = chunk['time'].iloc[-holdback:].min() if len(chunk) else 0
+        chunk = chunk.sort_values('time', kind='mergesort')
+        done = chunk['time'].values < watermark
+        pending = chunk[~done]
+        chunk = chunk[done]
+        if len(chunk) > 0:
+            yield _number_lines(chunk, lineno)
+            lineno += len(chunk)
+    if pending is not None and len(pending) > 0:
+        yield _number_lines(pending, lineno)
+    if num_bad_lines > 0:
+        print('Dropped {} bad lines'.format(num_bad_lines))
+
+def _number_lines(chunk, lineno):
+    chunk = chunk.reset_index(drop=True)
+    chunk['lineno'] = np.arange(lineno, lineno + len(chunk))
+    return chunk
+
+def get_queue_log_ports(queue_log, chunksize=DEFAULT_CHUNKSIZE):
+    """Return sorted list of all src ports seen in the queue log.
+
+    Only reads the src column, so it is cheap compared to a full read.
+    """
+    if is_binary_queue_log(queue_log):
+        records = read_binary_queue_log(queue_log)
+        ports = set()
+        for start in range(0, len(records), chunksize):
+            ports.update(np.unique(records['port'][start:start + chunksize]).tolist())
+        return sorted(ports)
+    reader = pd.read_csv(queue_log, names=QUEUE_LOG_COLUMNS, usecols=['src'],
+                         dtype=str, skip_blank_lines=True, chunksize=chunksize)
+    ports = set()
+    for chunk in reader:
+        src = chunk['src'].dropna().unique()
+        parsed, invalid = parse_hex(src, HEX_WIDTHS['src'])
+        ports.update(parsed[~invalid].tolist())
+    return sorted(ports)
+
+def store_queue_log(queue_log, hdf_queue, chunksize=DEFAULT_CHUNKSIZE,
+                    key='df_queue'):
+    """Stream queue log into a new queue store, one chunk at a time.
+
+    The stored table is indexed by time and has one column per src port with
+    the number of packets from that port in the queue.
+
+    Parameters:
+    -----------
+    queue_log : str
+       Path to queue log. Read twice, once to get all ports seen in the log.
+    hdf_queue : str
+       Path to store to create, using the backend set by the
+       CCTESTBED_QUEUE_STORE environment variable (HDF5 by default)
+    """
+    ports = get_queue_log_ports(queue_log, chunksize=chunksize)
+    occupancy = pd.Series(0, index=ports, dtype=np.int64)
+    with open_queue_store(hdf_queue, mode='w') as store:
+        for chunk in read_queue_log(queue_log, chunksize=chunksize):
+            df_flows = get_flow_occupancy(chunk['src'], chunk['dequeued'],
+                                          chunk['dropped'], ports=ports,
+                                          initial=occupancy)
+            if len(df_flows) > 0:
+                occupancy = df_flows.iloc[-1]
+            df = (chunk
+                  .join(df_flows.astype(np.uint32))
+                  .assign(time=lambda df: pd.to_datetime(df.time, unit='ns'))
+                  .set_index('time'))
+            store.append(key,
+                         df,
+                         format='table',
+                         data_columns=['src', 'dropped', 'dequeued'])
+
+def _empty_chunk():
+    return pd.DataFrame({col: pd.Series(dtype=dtype)
+                         for col, dtype in QUEUE_LOG_DTYPES.items()},
+                        columns=QUEUE_LOG_COLUMNS)
+
+class QueueLogTail:
+    """Read events appended to a queue log while the queue module writes it.
+
+    Each call to read() returns the events written since the last call. Text
+    lines are only returned once their newline is written, binary records
+    once their timestamp is. Events are returned in the order they were
+    written, which can be slightly out of time order (see read_queue_log).
+
+    Parameters:
+    -----------
+    queue_log : str
+       Path to queue log, doesn't have to exist yet
+    """
+    def __init__(self, queue_log):
+        self.queue_log = queue_log
+        self._offset = 0
+        self._binary = None
+        self._partial_line = b''
+
+    def _read_header(self, f):
+        magic = f.read(len(QUEUE_LOG_MAGIC))
+        if len(magic) < len(QUEUE_LOG_MAGIC):
+            return False
+        self._binary = magic == QUEUE_LOG_MAGIC
+        if self._binary:
+            f.seek(0)
+            header = np.frombuffer(f.read(QUEUE_LOG_HEADER_DTYPE.itemsize),
+                                   dtype=QUEUE_LOG_HEADER_DTYPE)
+            if len(header) == 0:
+                self._binary = None
+                return False
+            if (header['version'][0] != QUEUE_LOG_VERSION
+                    or header['record_size'][0] != QUEUE_LOG_RECORD_DTYPE.itemsize):
+                raise ValueError('{} is not a version {} binary queue log'.format(
+                    self.queue_log, QUEUE_LOG_VERSION))
+            self._offset = QUEUE_LOG_HEADER_DTYPE.itemsize
+        return True
+
+    def _read_records(self, f):
+        f.seek(self._offset)
+        data = f.read()
+        num_records = len(data) // QUEUE_LOG_RECORD_DTYPE.itemsize
+        records = np.frombuffer(data[:num_records * QUEUE_LOG_RECORD_DTYPE.itemsize],
+                                dtype=QUEUE_LOG_RECORD_DTYPE)
+        # the log can be preallocated, unwritten records are all zeros
+        unwritten = np.flatnonzero(records['time'] == 0)
+        if len(unwritten) > 0:
+            records = records[:unwritten[0]]
+        self._offset += len(records) * QUEUE_LOG_RECORD_DTYPE.itemsize
+        return _binary_chunk(records)
+
+    def _read_lines(self, f):
+        f.seek(self._offset)
+        data = f.read()
+        self._offset += len(data)
+        data = self._partial_line + data
+        end = data.rfind(b'\n') + 1
+        data, self._partial_line = data[:end], data[end:]
+        if len(data) == 0:
+            return _empty_chunk()
+        chunk = pd.read_csv(io.BytesIO(data), names=QUEUE_LOG_COLUMNS,
+                            usecols=range(len(QUEUE_LOG_COLUMNS)),
+                            dtype=str, skip_blank_lines=True)
+        return _clean_chunk(chunk)
+
+    def read(self):
+        """Return DataFrame of events written since the last read"""
+        if not os.path.isfile(self.queue_log):
+            return _empty_chunk()
+        with open(self.queue_log, 'rb') as f:
+            if self._binary is None and not self._read_header(f):
+                return _empty_chunk()
+            if self._binary:
+                return self._read_records(f)
+            return self._read_lines(f)
@@ -0,0 +1,298 @@
+"""
+Storage backends for processed queue data (the df_queue table).
+
+The default backend is a PyTables HDF5 store. The parquet backend writes the
+same logical tables as a directory of parquet files, one file per appended
+chunk, so readers only load the columns and row groups they need.
+
+Set the backend used for new stores with the CCTESTBED_QUEUE_STORE environment
+variable (hdf or parquet). Existing stores are always opened with the backend
+they were written with, so readers never need to know which one was used.
+
+Both backends support the subset of the pd.HDFStore API used by the analysis
+code: select, get, put, append, keys and use as a context manager.
+"""
+import json
+import os
+import re
+import shutil
+
+import pandas as pd
+
+HDF = 'hdf'
+PARQUET = 'parquet'
+QUEUE_STORE_BACKEND = os.environ.get('CCTESTBED_QUEUE_STORE', HDF)
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+def open_queue_store(path, mode='r', backend=None):
+    """Open queue store at path.
+
+    Parameters:
+    -----------
+    path : str
+       Path to store. For the parquet backend this is a small JSON manifest and
+       the data is stored in a directory next to it.
+    mode : str
+       One of 'r', 'a' or 'w', same as pd.HDFStore
+    backend : str, optional
+       Backend to use when creating a new store. Defaults to QUEUE_STORE_BACKEND.
+       Ignored when opening an existing store.
+    """
+    if mode != 'w' and os.path.isfile(path):
+        backend = get_queue_store_backend(path)
+    elif backend is None:
+        backend = QUEUE_STORE_BACKEND
+    if backend == HDF:
+        return pd.HDFStore(path, mode=mode)
+    elif backend == PARQUET:
+        return ParquetQueueStore(path, mode=mode)
+    else:
+        raise ValueError('Unknown queue store backend: {}'.format(backend))
+
+def get_queue_store_backend(path):
+    """Return backend of existing store at path"""
+    with open(path, 'rb') as f:
+        signature = f.read(len(HDF5_SIGNATURE))
+    if signature == HDF5_SIGNATURE:
+        return HDF
+    return PARQUET
+
+class ParquetQueueStore:
+    """Queue store backed by a directory of parquet files.
+
+    Each key is a directory of parts; append adds a part and put replaces all
+    parts. Port columns (ints) are stored with string names and converted back
+    when read.
+    """
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.data_path = os.path.splitext(path)[0] + '.parquet'
+        if mode == 'w':
+            if os.path.isdir(self.data_path):
+                shutil.rmtree(self.data_path)
+            self._manifest = {'format': PARQUET, 'tables': {}}
+            self._write_manifest()
+        elif mode == 'a' and not os.path.isfile(path):
+            self._manifest = {'format': PARQUET, 'tables': {}}
+            self._write_manifest()
+        else:
+            with open(path) as f:
+                self._manifest = json.load(f)
+
+    def _write_manifest(self):
+        os.makedirs(self.data_path, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self._manifest, f)
+
+    def _check_writable(self):
+        if self.mode == 'r':
+            raise ValueError('Queue store {} opened read only'.format(self.path))
+
+    def _table_path(self, key):
+        return os.path.join(self.data_path, key.strip('/'))
+
+    def keys(self):
+        return ['/' + key for key in self._manifest['tables']]
+
+    def __contains__(self, key):
+        return key.strip('/') in self._manifest['tables']
+
+    def append(self, key, value, **kwargs):
+        """Add value as a new part of table key.
+
+        Extra keyword args (ex. format, data_columns) are accepted for
+        compatibility with pd.HDFStore.append and ignored.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._check_writable()
+        key = key.strip('/')
+        table_info = {'series': isinstance(value, pd.Series),
+                      'index': value.index.name or 'index'}
+        df = value.to_frame() if table_info['series'] else value
+        table_info['int_columns'] = [str(col) for col in df.columns
+                                     if not isinstance(col, str)]
+        table_info['name'] = (str(df.columns[0]) if table_info['series']
+                              else None)
+        df = (df
+              .rename(columns=str)
+              .rename_axis(table_info['index'])
+              .reset_index())
+        table_path = self._table_path(key)
+        os.makedirs(table_path, exist_ok=True)
+        part = len(os.listdir(table_path))
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       os.path.join(table_path, 'part-{:05d}.parquet'.format(part)))
+        self._manifest['tables'][key] = table_info
+        self._write_manifest()
+
+    def put(self, key, value, **kwargs):
+        """Replace table key with value"""
+        self._check_writable()
+        self.remove(key)
+        self.append(key, value)
+
+    def remove(self, key):
+        self._check_writable()
+        key = key.strip('/')
+        if os.path.isdir(self._table_path(key)):
+            shutil.rmtree(self._table_path(key))
+        if self._manifest['tables'].pop(key, None) is not None:
+            self._write_manifest()
+
+    def get(self, key):
+        return self.select(key)
+
+    def select(self, key, where=None, columns=None):
+        """Read table key, optionally only some columns & rows.
+
+        Parameters:
+        -----------
+        where : str, optional
+           PyTables style where clause, ex. 'dequeued=1 & (src=5555 | src=5556)'.
+           Filters are pushed down to the parquet reader.
+        columns : list, optional
+           Columns to read, the index is always read.
+        """
+        import pyarrow.dataset as ds
+
+        if key not in self:
+            raise KeyError('No object named {} in the file'.format(key))
+        table_info = self._manifest['tables'][key.strip('/')]
+        dataset = ds.dataset(self._table_path(key), format='parquet')
+        if columns is not None:
+            columns = [table_info['index']] + [str(col) for col in columns]
+        if where is not None:
+            where = parse_where(where, dataset.schema)
+        df = (dataset
+              .to_table(columns=columns, filter=where)
+              .to_pandas()
+              .set_index(table_info['index']))
+        if table_info['index'] == 'index':
+            df.index.name = None
+        int_columns = set(table_info['int_columns'])
+        df = df.rename(columns=lambda col: int(col) if col in int_columns else col)
+        if table_info['series']:
+            df = df.iloc[:, 0]
+            df.name = (int(table_info['name']) if table_info['name'] in int_columns
+                       else table_info['name'])
+        return df
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return 'ParquetQueueStore({})'.format(self.path)
+
+_WHERE_TOKENS = re.compile(r'\s*(?:(\d+)|([A-Za-z_]\w*)|(==|!=|<=|>=|=|<|>|&|\||~|\(|\)))')
+
+def _tokenize_where(where):
+    tokens = []
+    where = where.strip()
+    pos = 0
+    while pos < len(where):
+        match = _WHERE_TOKENS.match(where, pos)
+        if match is None:
+            raise ValueError('Cannot parse where clause: {}'.format(where))
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(('number', int(number)))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+        pos = match.end()
+    return tokens
+
+def parse_where(where, schema):
+    """Convert PyTables style where clause to a pyarrow dataset expression.
+
+    Supports comparisons between a column and an int (or True/False) combined
+    with &, |, ~ and parentheses, which covers the queries used on df_queue.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if isinstance(where, (list, tuple)):
+        where = ' & '.join('({})'.format(clause) for clause in where)
+    tokens = _tokenize_where(where)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def take(expected=None):
+        nonlocal pos
+        token = peek()
+        if token[0] is None or (expected is not None and token[1] != expected):
+            raise ValueError('Cannot parse where clause: {}'.format(where))
+        pos += 1
+        return token
+
+    def parse_or():
+        expr = parse_and()
+        while peek() == ('op', '|'):
+            take()
+            expr = expr | parse_and()
+        return expr
+
+    def parse_and():
+        expr = parse_not()
+        while peek() == ('op', '&'):
+            take()
+            expr = expr & parse_not()
+        return expr
+
+    def parse_not():
+        if peek() == ('op', '~'):
+            take()
+            return ~parse_not()
+        if peek() == ('op', '('):
+            take()
+            expr = parse_or()
+            take(')')
+            return expr
+        return parse_comparison()
+
+    def parse_comparison():
+        kind, column = take()
+        if kind != 'name' or column not in schema.names:
+            raise ValueError('Unknown column {} in where clause: {}'.format(column, where))
+        kind, op = take()
+        if kind != 'op':
+            raise ValueError('Cannot parse where clause: {}'.format(where))
+        kind, value = take()
+        if kind == 'name' and value in ('True', 'False'):
+            value = (value == 'True')
+        elif kind != 'number':
+            raise ValueError('Cannot parse where clause: {}'.format(where))
+        if pa.types.is_boolean(schema.field(column).type):
+            value = bool(value)
+        field = ds.field(column)
+        if op in ('=', '=='):
+            return field == value
+        elif op == '!=':
+            return field != value
+        elif op == '<':
+            return field < value
+        elif op == '<=':
+            return field <= value
+        elif op == '>':
+            return field > value
+        elif op == '>=':
+            return field >= value
+        raise ValueError('Cannot parse where clause: {}'.format(where))
+
+    expr = parse_or()
+    if pos != len(tokens):
+        raise ValueError('Cannot parse where clause: {}'.format(where))
+    return expr
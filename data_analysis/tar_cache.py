@@ -0,0 +1,254 @@
+"""
+Cache of files extracted from experiment tarballs.
+
+gzip can't seek, so extracting each log from an experiment tarball with its own
+tar command decompresses the whole archive every time. Instead, the first
+request for any member of an archive unpacks every member in a single pass.
+Members are stored by the sha256 of their contents, so the same file in two
+archives is only stored once. The least recently used members are evicted
+when the cache grows past its disk budget.
+
+Indexed tarballs (see data_analysis.indexed_tar) can be read one member at a
+time, so members are extracted from them directly without using the cache.
+
+Set the cache location and budget (in bytes) with the CCTESTBED_TAR_CACHE and
+CCTESTBED_TAR_CACHE_BUDGET environment variables.
+
+Can also be used from the command line in place of tar -xzf:
+python3 -m data_analysis.tar_cache -C data-raw/ exp.tar.gz queue-exp.txt
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from data_analysis.indexed_tar import extract_indexed_member, read_index
+
+TAR_CACHE_DIR = os.environ.get('CCTESTBED_TAR_CACHE', '/tmp/cctestbed-tar-cache')
+TAR_CACHE_BUDGET = int(os.environ.get('CCTESTBED_TAR_CACHE_BUDGET', 20 * 2**30))
+
+_COPY_BUFSIZE = 1 << 20
+# times to look up a member that is evicted by another job while being used
+_GET_ATTEMPTS = 3
+
+# everything tar -x fails on: member not in archive, archive missing,
+# truncated or not a gzipped tarball
+EXTRACT_ERRORS = (KeyError, tarfile.TarError, EOFError, zlib.error, OSError)
+
+class TarCache:
+    """Content addressed cache of tarball members with LRU eviction.
+
+    Parameters:
+    -----------
+    cache_dir : str
+       Directory to store cached members in
+    budget : int
+       Max total size in bytes of cached members
+    """
+    def __init__(self, cache_dir=TAR_CACHE_DIR, budget=TAR_CACHE_BUDGET):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.archives_dir = os.path.join(cache_dir, 'archives')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.archives_dir, exist_ok=True)
+
+    def _archive_key(self, tar_filename):
+        # an archive is identified by its path and stat, so a tarball that is
+        # replaced (ex. experiment rerun) is unpacked again
+        stat = os.stat(tar_filename)
+        key = '{}:{}:{}'.format(os.path.realpath(tar_filename), stat.st_size,
+                                stat.st_mtime_ns)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _read_index(self, archive_key):
+        try:
+            with open(os.path.join(self.archives_dir, archive_key + '.json')) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # any evicted member means the archive has to be unpacked again
+        for digest in index.values():
+            if not os.path.isfile(self._object_path(digest)):
+                return None
+        return index
+
+    def _write_index(self, archive_key, index):
+        index_path = os.path.join(self.archives_dir, archive_key + '.json')
+        with tempfile.NamedTemporaryFile('w', dir=self.archives_dir,
+                                         delete=False) as f:
+            json.dump(index, f)
+        os.replace(f.name, index_path)
+
+    @contextmanager
+    def _lock(self, archive_key):
+        # don't let parallel jobs unpack the same archive at the same time
+        with open(os.path.join(self.archives_dir, archive_key + '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _store_member(self, fileobj):
+        """Copy member into the cache; return its digest"""
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.objects_dir,
+                                         delete=False) as f:
+            while True:
+                buf = fileobj.read(_COPY_BUFSIZE)
+                if not buf:
+                    break
+                sha256.update(buf)
+                f.write(buf)
+        digest = sha256.hexdigest()
+        object_path = self._object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(f.name, object_path)
+        return digest
+
+    def _unpack(self, tar_filename):
+        """Store every file in the archive in one pass; return member index"""
+        print('Unpacking {} into cache {}'.format(tar_filename, self.cache_dir))
+        index = {}
+        with tarfile.open(tar_filename, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    index[member.name] = self._store_member(tar.extractfile(member))
+        return index
+
+    def index(self, tar_filename):
+        """Return dict of member name to cached path, unpacking archive if needed"""
+        archive_key = self._archive_key(tar_filename)
+        index = self._read_index(archive_key)
+        if index is None:
+            with self._lock(archive_key):
+                index = self._read_index(archive_key)
+                if index is None:
+                    index = self._unpack(tar_filename)
+                    self._write_index(archive_key, index)
+                    self.evict(keep=index.values())
+        return {name: self._object_path(digest) for name, digest in index.items()}
+
+    def get(self, tar_filename, member):
+        """Return path to cached copy of member; raises KeyError if not in archive.
+
+        The returned file is shared by the cache and must not be modified.
+        """
+        member = os.path.normpath(member)
+        for attempt in range(_GET_ATTEMPTS):
+            index = self.index(tar_filename)
+            paths = [path for name, path in index.items()
+                     if os.path.normpath(name) == member]
+            if len(paths) == 0:
+                raise KeyError('{} not found in {}'.format(member, tar_filename))
+            try:
+                # mtime tracks when a member was last used for LRU eviction
+                os.utime(paths[0])
+                return paths[0]
+            except FileNotFoundError:
+                # evicted by another job since the index was read; a cache
+                # miss, so the next index() unpacks the archive again
+                if attempt == _GET_ATTEMPTS - 1:
+                    raise
+
+    def extract(self, tar_filename, member, untar_dir, strip_components=0):
+        """Copy member to untar_dir like tar -C untar_dir -xf; return its path"""
+        parts = os.path.normpath(member).split(os.sep)[strip_components:]
+        if not parts:
+            raise ValueError('Cannot strip {} components from {}'.format(
+                strip_components, member))
+        localpath = os.path.join(untar_dir, *parts)
+        index = read_index(tar_filename)
+        if index is not None:
+            if os.path.normpath(member) not in index:
+                raise KeyError('{} not found in {}'.format(member, tar_filename))
+            os.makedirs(os.path.dirname(localpath) or '.', exist_ok=True)
+            return extract_indexed_member(tar_filename, member, localpath,
+                                          index=index)
+        os.makedirs(os.path.dirname(localpath) or '.', exist_ok=True)
+        for attempt in range(_GET_ATTEMPTS):
+            cached_path = self.get(tar_filename, member)
+            try:
+                # copy instead of link, some callers modify the extracted file in place
+                shutil.copyfile(cached_path, localpath)
+                return localpath
+            except FileNotFoundError:
+                # evicted between get() and the copy
+                if attempt == _GET_ATTEMPTS - 1:
+                    raise
+
+    def evict(self, keep=()):
+        """Remove least recently used members until the cache fits its budget"""
+        keep = {self._object_path(digest) for digest in keep}
+        objects = []
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if total_size <= self.budget:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+        return total_size
+
+_tar_cache = None
+
+def get_tar_cache():
+    """Return the default cache, set up from TAR_CACHE_DIR and TAR_CACHE_BUDGET"""
+    global _tar_cache
+    if _tar_cache is None:
+        _tar_cache = TarCache()
+    return _tar_cache
+
+def extract_member(tar_filename, member, untar_dir, strip_components=0):
+    """Extract member of tar_filename to untar_dir using the default cache"""
+    return get_tar_cache().extract(tar_filename, member, untar_dir,
+                                   strip_components=strip_components)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Extract members of a tarball through the tar cache.')
+    parser.add_argument('-C', '--directory', default='.',
+                        help='Directory to extract members to')
+    parser.add_argument('--strip-components', type=int, default=0)
+    parser.add_argument('tar_filename')
+    parser.add_argument('members', nargs='+')
+    args = parser.parse_args(argv)
+    returncode = 0
+    for member in args.members:
+        try:
+            print(extract_member(args.tar_filename, member, args.directory,
+                                 strip_components=args.strip_components))
+        except KeyError as e:
+            print(e.args[0], file=sys.stderr)
+            returncode = 2
+        except EXTRACT_ERRORS as e:
+            print('Could not extract {} from {}: {}'.format(
+                member, args.tar_filename, e), file=sys.stderr)
+            returncode = 2
+    return returncode
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Read tcpprobe logs written by tcp_bbr_measure/tcp_probe_ray.ko.
+
+The module logs every ACK a flow receives. Reading /proc/net/tcpprobe formats
+each record as a line of text, which then has to be sent back over ssh and
+parsed again here. /proc/net/tcpprobe_bin returns the same records packed
+(struct tcp_log_record), after a 16 byte header:
+
+magic (TCPPROBE) | version (uint32) | record size (uint32) | records
+
+Binary logs are memory mapped straight into a NumPy structured array with
+TCPPROBE_RECORD_DTYPE. read_tcpprobe reads either kind of log into the same
+DataFrame, so analysis code doesn't need to know which one an experiment
+wrote. Endpoints are stored as integers (ip << 16 | port) rather than
+'ip:port' strings, so filtering by sender compares integers.
+
+process_tcpprobe converts the raw values to the units used in analysis and
+store_tcpprobe caches the result, with typed columns, in a queue store.
+"""
+import struct
+
+import numpy as np
+import pandas as pd
+
+from data_analysis.queue_store import open_queue_store
+
+TCPPROBE_MAGIC = b'TCPPROBE'
+TCPPROBE_VERSION = 1
+AF_INET = 2
+
+# struct tcp_log_record, x86 byte order except for addresses & ports
+TCPPROBE_RECORD_DTYPE = np.dtype([('tstamp_ns', '<u8'),
+                                  ('saddr', '>u4'),
+                                  ('daddr', '>u4'),
+                                  ('sport', '>u2'),
+                                  ('dport', '>u2'),
+                                  ('family', '<u2'),
+                                  ('length', '<u2'),
+                                  ('snd_nxt', '<u4'),
+                                  ('snd_una', '<u4'),
+                                  ('snd_cwnd', '<u4'),
+                                  ('ssthresh', '<u4'),
+                                  ('snd_wnd', '<u4'),
+                                  ('srtt', '<u4'),
+                                  ('rcv_wnd', '<u4'),
+                                  ('bbr_bw_lo', '<u4'),
+                                  ('bbr_bw_hi', '<u4'),
+                                  ('bbr_min_rtt', '<u4'),
+                                  ('bbr_pacing_gain', '<u4'),
+                                  ('bbr_cwnd_gain', '<u4')])
+
+_HEADER = struct.Struct('<8sII')
+
+# BBR bandwidth is in packets/us << 24, 1500 * 8 * 10**6 / 2**24 ~ 715 bits/s
+BBR_BW_TO_BPS = 715
+# BBR gains are fixed point with 8 fractional bits
+BBR_UNIT = 256
+MICROSECONDS_TO_MILLISECONDS = 1.0 / 1000
+
+TCPPROBE_KEY = 'df_tcpprobe'
+
+# columns of the text log, in order
+TCPPROBE_COLUMNS = ['time', 'sender', 'receiver', 'bytes', 'next', 'unack',
+                    'cwnd', 'ssthresh', 'swnd', 'srtt', 'rwnd', 'bbr_bw_lo',
+                    'bbr_bw_hi', 'bbr_min_rtt', 'bbr_pacing_gain',
+                    'bbr_cwnd_gain']
+
+# text log column for each record field
+_RECORD_COLUMNS = {'length': 'bytes', 'snd_nxt': 'next', 'snd_una': 'unack',
+                   'snd_cwnd': 'cwnd', 'ssthresh': 'ssthresh',
+                   'snd_wnd': 'swnd', 'srtt': 'srtt', 'rcv_wnd': 'rwnd',
+                   'bbr_bw_lo': 'bbr_bw_lo', 'bbr_bw_hi': 'bbr_bw_hi',
+                   'bbr_min_rtt': 'bbr_min_rtt',
+                   'bbr_pacing_gain': 'bbr_pacing_gain',
+                   'bbr_cwnd_gain': 'bbr_cwnd_gain'}
+
+def is_binary_tcpprobe_log(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(TCPPROBE_MAGIC)) == TCPPROBE_MAGIC
+
+def read_tcpprobe_records(filename):
+    """Memory map binary tcpprobe log; return structured array of its records.
+
+    A record cut off at the end of the log, ex. when cat was killed while
+    writing it, is left out.
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError('{} is not a binary tcpprobe log'.format(filename))
+    magic, version, record_size = _HEADER.unpack(header)
+    if magic != TCPPROBE_MAGIC:
+        raise ValueError('{} is not a binary tcpprobe log'.format(filename))
+    if version != TCPPROBE_VERSION or record_size != TCPPROBE_RECORD_DTYPE.itemsize:
+        raise ValueError('{} is a version {} tcpprobe log with {} byte records, '
+                         'expected version {} with {} byte records'.format(
+                             filename, version, record_size, TCPPROBE_VERSION,
+                             TCPPROBE_RECORD_DTYPE.itemsize))
+    with open(filename, 'rb') as f:
+        num_records = (f.seek(0, 2) - _HEADER.size) // record_size
+    if num_records == 0:
+        return np.zeros(0, dtype=TCPPROBE_RECORD_DTYPE)
+    return np.memmap(filename, dtype=TCPPROBE_RECORD_DTYPE, mode='r',
+                     offset=_HEADER.size, shape=(num_records,))
+
+def get_endpoint(ip, port):
+    """Return integer code of endpoint ip:port, as used in sender & receiver"""
+    a, b, c, d = (int(octet) for octet in ip.split('.'))
+    return (((a << 24) | (b << 16) | (c << 8) | d) << 16) | int(port)
+
+def get_endpoint_port(codes):
+    """Return ports of endpoint codes, ex. sender or receiver"""
+    return codes & 0xffff
+
+def _encode_endpoints(family, addrs, ports):
+    # the module doesn't copy IPv6 addresses into binary records
+    addrs = np.where(family == AF_INET, addrs.astype(np.int64), 0)
+    return (addrs << 16) | ports.astype(np.int64)
+
+def _parse_endpoints(endpoints):
+    """Return integer codes of 'ip:port' strings, parsing each endpoint once"""
+    unique, inverse = np.unique(np.asarray(endpoints, dtype=str),
+                                return_inverse=True)
+    codes = []
+    for endpoint in unique.tolist():
+        ip, port = endpoint.rsplit(':', 1)
+        # IPv6 endpoints are logged as [addr]:port, keep only the port
+        codes.append(get_endpoint(ip, port) if '.' in ip else int(port))
+    return np.array(codes, dtype=np.int64)[inverse.reshape(-1)]
+
+def format_endpoints(codes):
+    """Return 'ip:port' strings of endpoint codes, ex. sender or receiver"""
+    unique, inverse = np.unique(np.asarray(codes, dtype=np.int64),
+                                return_inverse=True)
+    names = []
+    for code in unique.tolist():
+        addr = code >> 16
+        names.append('{}.{}.{}.{}:{}'.format(addr >> 24, addr >> 16 & 0xff,
+                                            addr >> 8 & 0xff, addr & 0xff,
+                                            code & 0xffff))
+    return np.array(names, dtype=object)[inverse.reshape(-1)]
+
+def get_tcpprobe_df(records):
+    """Return DataFrame with TCPPROBE_COLUMNS from binary tcpprobe records"""
+    family = records['family']
+    columns = {'time': pd.to_timedelta(records['tstamp_ns'].astype(np.int64), unit='ns'),
+               'sender': _encode_endpoints(family, records['saddr'], records['sport']),
+               'receiver': _encode_endpoints(family, records['daddr'], records['dport'])}
+    for field, col in _RECORD_COLUMNS.items():
+        columns[col] = records[field].astype(np.int64)
+    return pd.DataFrame(columns, columns=TCPPROBE_COLUMNS)
+
+def _parse_hex(values):
+    """Return ints of hex strings written with %#x (0 has no 0x prefix)"""
+    unique, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return np.array([int(value, 16) for value in unique.tolist()],
+                    dtype=np.int64)[inverse.reshape(-1)]
+
+def read_tcpprobe_text(filename):
+    """Return DataFrame with TCPPROBE_COLUMNS from text tcpprobe log"""
+    tcpprobe = pd.read_csv(filename, sep=r'\s+', header=None,
+                           names=TCPPROBE_COLUMNS,
+                           dtype={'next': str, 'unack': str})
+    tcpprobe['time'] = pd.to_timedelta(tcpprobe['time'], unit='s')
+    tcpprobe['sender'] = _parse_endpoints(tcpprobe['sender'])
+    tcpprobe['receiver'] = _parse_endpoints(tcpprobe['receiver'])
+    tcpprobe['next'] = _parse_hex(tcpprobe['next'])
+    tcpprobe['unack'] = _parse_hex(tcpprobe['unack'])
+    return tcpprobe
+
+def read_tcpprobe(filename):
+    """Return DataFrame with TCPPROBE_COLUMNS from binary or text tcpprobe log.
+
+    time is a timedelta since the log was opened, sender & receiver are
+    integer endpoint codes (see get_endpoint & format_endpoints) and every
+    other column is the raw value logged.
+    """
+    if is_binary_tcpprobe_log(filename):
+        return get_tcpprobe_df(read_tcpprobe_records(filename))
+    return read_tcpprobe_text(filename)
+
+def process_tcpprobe(tcpprobe, senders=None):
+    """Convert raw tcpprobe columns to the units used in analysis.
+
+    Returns a new DataFrame indexed by time. Bandwidth (bbr_bw_lo) is in
+    Mbps, gains are ratios and RTTs (srtt, bbr_min_rtt) are in ms.
+
+    Parameters:
+    -----------
+    tcpprobe : pd.DataFrame
+       From read_tcpprobe
+    senders : list of int, optional
+       Endpoint codes of the senders to keep, see get_endpoint. Defaults to
+       every sender.
+    """
+    if senders is not None:
+        tcpprobe = tcpprobe[tcpprobe['sender'].isin(senders)]
+    tcpprobe = tcpprobe.assign(
+        bbr_bw_lo=tcpprobe['bbr_bw_lo'] * BBR_BW_TO_BPS / 1e6,
+        bbr_pacing_gain=tcpprobe['bbr_pacing_gain'] / BBR_UNIT,
+        bbr_cwnd_gain=tcpprobe['bbr_cwnd_gain'] / BBR_UNIT,
+        bbr_min_rtt=tcpprobe['bbr_min_rtt'] * MICROSECONDS_TO_MILLISECONDS,
+        srtt=tcpprobe['srtt'] * MICROSECONDS_TO_MILLISECONDS)
+    return tcpprobe.set_index('time')
+
+def store_tcpprobe(tcpprobe, path, key=TCPPROBE_KEY):
+    """Cache processed tcpprobe DataFrame in a new queue store with typed columns"""
+    with open_queue_store(path, mode='w') as store:
+        store.put(key, tcpprobe, format='table')
+
+def load_tcpprobe(path, key=TCPPROBE_KEY):
+    """Load tcpprobe DataFrame cached by store_tcpprobe"""
+    with open_queue_store(path) as store:
+        tcpprobe = store.select(key)
+    # HDF5 tables store the timedelta index as ns
+    if not pd.api.types.is_timedelta64_dtype(tcpprobe.index):
+        tcpprobe.index = pd.to_timedelta(tcpprobe.index, unit='ns')
+        tcpprobe.index.name = 'time'
+    return tcpprobe
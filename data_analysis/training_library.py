@@ -0,0 +1,202 @@
+"""
+Training flows used to classify websites, compiled into a single file.
+
+The training directory has a .features (queue occupancy series) and .metadata
+(JSON) file for every training experiment, named
+{ccalg}-{btlbw}bw-{rtt}rtt-{queue_size}q-local-{exp_time}. Instead of globbing
+the directory for every network condition and reading each CSV when it is
+needed, the library stores every series and its metadata in one file:
+
+magic (8 bytes) | header length (uint64) | JSON header | float64 series
+
+The header is an index of every experiment with the offset and length of its
+series. The series are memory mapped, so loading the library only reads the
+header and lookups by network condition are dict lookups.
+
+The library is rebuilt when a training file is added, removed or rewritten.
+Build it by hand with: python3 -m data_analysis.training_library /opt/cctestbed/data-training
+"""
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+TRAINING_LIBRARY_MAGIC = b'CCTRAIN1'
+TRAINING_LIBRARY_VERSION = 1
+TRAINING_LIBRARY_FILENAME = 'training-library.bin'
+TRAINING_DIR = os.environ.get('CCTESTBED_TRAINING_DIR',
+                              '/opt/cctestbed/data-training')
+
+_HEADER = struct.Struct('<8sQ')
+_EXP_NAME_REGEX = re.compile(r'^(.+?)-(\d+)bw-(\d+)rtt-(\d+)q-local-.*$')
+
+def parse_training_exp_name(exp_name):
+    """Return (ccalg, btlbw, rtt, queue_size) of a training experiment name"""
+    match = _EXP_NAME_REGEX.match(exp_name)
+    if match is None:
+        raise ValueError('Not a training experiment name: {}'.format(exp_name))
+    ccalg, btlbw, rtt, queue_size = match.groups()
+    return ccalg, int(btlbw), int(rtt), int(queue_size)
+
+def get_ntwrk_conditions(btlbw, rtt, queue_size):
+    return '{}bw-{}rtt-{}q'.format(btlbw, rtt, queue_size)
+
+def build_training_library(training_dir, library_filename=None):
+    """Compile features & metadata in training_dir into a library file.
+
+    Returns path to the library, by default training_dir/training-library.bin
+    """
+    if library_filename is None:
+        library_filename = os.path.join(training_dir, TRAINING_LIBRARY_FILENAME)
+    experiments = []
+    series = []
+    offset = 0
+    for filename in sorted(os.listdir(training_dir)):
+        if not filename.endswith('.features'):
+            continue
+        exp_name = filename[:-len('.features')]
+        try:
+            ccalg, btlbw, rtt, queue_size = parse_training_exp_name(exp_name)
+        except ValueError:
+            continue
+        features = (pd.read_csv(os.path.join(training_dir, filename))
+                    .squeeze('columns').values.astype(np.float64))
+        metadata = None
+        metadata_filename = os.path.join(training_dir, exp_name + '.metadata')
+        if os.path.isfile(metadata_filename):
+            with open(metadata_filename) as f:
+                metadata = json.load(f)
+        experiments.append({'exp_name': exp_name, 'ccalg': ccalg,
+                            'btlbw': btlbw, 'rtt': rtt,
+                            'queue_size': queue_size, 'offset': offset,
+                            'length': len(features), 'metadata': metadata})
+        series.append(features)
+        offset += len(features)
+    header = json.dumps({'version': TRAINING_LIBRARY_VERSION,
+                         'experiments': experiments}).encode('utf-8')
+    # keep the series 8 byte aligned so they can be memory mapped
+    header += b' ' * (-(_HEADER.size + len(header)) % 8)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(library_filename) or '.',
+                                     delete=False) as f:
+        f.write(_HEADER.pack(TRAINING_LIBRARY_MAGIC, len(header)))
+        f.write(header)
+        for features in series:
+            f.write(features.astype('<f8').tobytes())
+    os.replace(f.name, library_filename)
+    # replacing the file changes the directory's mtime, don't look stale
+    os.utime(library_filename)
+    return library_filename
+
+class TrainingLibrary:
+    """Read only view of a training library file.
+
+    Parameters:
+    -----------
+    library_filename : str
+       Path to library created by build_training_library
+    """
+    def __init__(self, library_filename):
+        self.library_filename = library_filename
+        with open(library_filename, 'rb') as f:
+            magic, header_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != TRAINING_LIBRARY_MAGIC:
+                raise ValueError('{} is not a training library'.format(library_filename))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        if header['version'] != TRAINING_LIBRARY_VERSION:
+            raise ValueError('{} is not a version {} training library'.format(
+                library_filename, TRAINING_LIBRARY_VERSION))
+        num_values = sum(exp['length'] for exp in header['experiments'])
+        if num_values > 0:
+            self._series = np.memmap(library_filename, dtype='<f8', mode='r',
+                                     offset=_HEADER.size + header_len,
+                                     shape=(num_values,))
+        else:
+            self._series = np.zeros(0)
+        self.experiments = {exp['exp_name']: exp for exp in header['experiments']}
+        self._by_key = {}
+        self._by_ntwrk_conditions = {}
+        for exp_name, exp in sorted(self.experiments.items()):
+            key = (exp['ccalg'], exp['btlbw'], exp['rtt'], exp['queue_size'])
+            # newest experiment wins, names end with the experiment time
+            self._by_key[key] = exp_name
+            ntwrk_conditions = get_ntwrk_conditions(exp['btlbw'], exp['rtt'],
+                                                    exp['queue_size'])
+            self._by_ntwrk_conditions.setdefault(ntwrk_conditions, []).append(exp_name)
+
+    def __len__(self):
+        return len(self.experiments)
+
+    def __contains__(self, exp_name):
+        return exp_name in self.experiments
+
+    def get_exp_name(self, ccalg, btlbw, rtt, queue_size):
+        """Return name of the newest training experiment; raises KeyError"""
+        return self._by_key[(ccalg, btlbw, rtt, queue_size)]
+
+    def get_exp_names(self, btlbw, rtt, queue_size):
+        """Return names of all training experiments for a network condition"""
+        return list(self._by_ntwrk_conditions.get(
+            get_ntwrk_conditions(btlbw, rtt, queue_size), []))
+
+    def features(self, exp_name):
+        """Return queue occupancy series of experiment (read only)"""
+        exp = self.experiments[exp_name]
+        return self._series[exp['offset']:exp['offset'] + exp['length']]
+
+    def metadata(self, exp_name):
+        return self.experiments[exp_name]['metadata']
+
+    def get_training_flows(self, exp_names):
+        """Return dict of experiment name to series for the given experiments"""
+        return {exp_name: self.features(exp_name) for exp_name in exp_names}
+
+def _is_stale(library_filename, training_dir):
+    try:
+        library_mtime = os.stat(library_filename).st_mtime
+    except FileNotFoundError:
+        return True
+    # adding or removing training experiments changes the directory's mtime,
+    # rewriting one in place only changes its own
+    mtimes = [os.stat(training_dir).st_mtime]
+    with os.scandir(training_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(('.features', '.metadata')):
+                mtimes.append(entry.stat().st_mtime)
+    return max(mtimes) > library_mtime
+
+_training_libraries = {}
+
+def load_training_library(training_dir=TRAINING_DIR):
+    """Return library of training_dir, building it first if it is out of date.
+
+    Libraries are cached per directory, so each process only loads one once.
+    """
+    library_filename = os.path.join(training_dir, TRAINING_LIBRARY_FILENAME)
+    if training_dir not in _training_libraries:
+        if _is_stale(library_filename, training_dir):
+            print('Building training library {}'.format(library_filename))
+            build_training_library(training_dir, library_filename)
+        _training_libraries[training_dir] = TrainingLibrary(library_filename)
+    return _training_libraries[training_dir]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compile training features & metadata into a training library.')
+    parser.add_argument('training_dir', nargs='?', default=TRAINING_DIR)
+    parser.add_argument('--output', '-o', default=None,
+                        help='Library file to write, defaults to {} in training_dir'.format(
+                            TRAINING_LIBRARY_FILENAME))
+    args = parser.parse_args(argv)
+    library_filename = build_training_library(args.training_dir, args.output)
+    print('Wrote {} training experiments to {}'.format(
+        len(TrainingLibrary(library_filename)), library_filename))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -30,6 +30,13 @@
 
 #include "queue.h"
 
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include <cerrno>
+#include <cstring>
+
 #include "../mem_alloc.h"
 #include "../utils/format.h"
 
@@ -53,7 +60,9 @@ const Commands Queue::cmds = {
     {"set_size", "QueueCommandSetSizeArg",
      MODULE_CMD_FUNC(&Queue::CommandSetSize), Command::THREAD_UNSAFE},
     {"get_status", "QueueCommandGetStatusArg",
-     MODULE_CMD_FUNC(&Queue::CommandGetStatus), Command::THREAD_SAFE}};
+     MODULE_CMD_FUNC(&Queue::CommandGetStatus), Command::THREAD_SAFE},
+    {"set_dump_file", "QueueCommandSetDumpFileArg",
+     MODULE_CMD_FUNC(&Queue::CommandSetDumpFile), Command::THREAD_UNSAFE}};
 
 int Queue::Resize(int slots) {
   struct llring *old_queue = queue_;
@@ -134,20 +143,136 @@ CommandResponse Queue::Init(const bess::pb::QueueArg &arg) {
   dump_enq_ << std::endl;
   dump_deq_ << std::endl;
   flow_stats_ = {};
+
+  if (!arg.dump_file().empty()) {
+    int ret = OpenDumpFile(arg.dump_file());
+    if (ret) {
+      return CommandFailure(-ret, "Could not open dump file %s",
+                            arg.dump_file().c_str());
+    }
+  }
   
   return CommandSuccess();
 }
 
-void Queue::DeInit() {
-  // ADDED BY RAY
-  std::cout << dump_deq_.str();
-  std::cout << dump_enq_.str();
+int Queue::MapDumpWindow(uint64_t offset) {
+  if (dump_map_) {
+    munmap(dump_map_, kDumpMapBytes);
+    dump_map_ = nullptr;
+  }
+
+  if (ftruncate(dump_fd_, offset + kDumpMapBytes) < 0) {
+    return -errno;
+  }
+
+  void *addr = mmap(nullptr, kDumpMapBytes, PROT_READ | PROT_WRITE, MAP_SHARED,
+                    dump_fd_, offset);
+  if (addr == MAP_FAILED) {
+    return -errno;
+  }
+
+  dump_map_ = static_cast<char *>(addr);
+  dump_map_offset_ = offset;
+  dump_pos_ = 0;
+  return 0;
+}
+
+int Queue::OpenDumpFile(const std::string &path) {
+  CloseDumpFile();
+
+  dump_fd_ = ::open(path.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0644);
+  if (dump_fd_ < 0) {
+    return -errno;
+  }
+
+  int ret = MapDumpWindow(0);
+  if (ret) {
+    ::close(dump_fd_);
+    dump_fd_ = -1;
+    return ret;
+  }
+
+  QueueLogHeader *header = reinterpret_cast<QueueLogHeader *>(dump_map_);
+  memcpy(header->magic, QUEUE_LOG_MAGIC, sizeof(header->magic));
+  header->version = QUEUE_LOG_VERSION;
+  header->record_size = sizeof(QueueLogRecord);
+  dump_pos_ = sizeof(QueueLogHeader);
+  return 0;
+}
+
+void Queue::CloseDumpFile() {
+  if (dump_fd_ < 0) {
+    return;
+  }
+
+  if (dump_map_) {
+    munmap(dump_map_, kDumpMapBytes);
+    dump_map_ = nullptr;
+  }
+
+  // cut off the unused end of the last window so the file only has full records
+  if (ftruncate(dump_fd_, dump_map_offset_ + dump_pos_) < 0) {
+    PLOG(ERROR) << "ftruncate() of queue dump file";
+  }
+  ::close(dump_fd_);
+  dump_fd_ = -1;
+  dump_map_offset_ = 0;
+  dump_pos_ = 0;
+}
+
+void Queue::DumpRecord(uint64_t now_ns, be16_t port, uint32_t seq,
+                       uint32_t datalen, uint32_t qsize, uint8_t flags,
+                       uint32_t queued, uint32_t batch) {
+  if (dump_pos_ + sizeof(QueueLogRecord) > kDumpMapBytes) {
+    int ret = MapDumpWindow(dump_map_offset_ + kDumpMapBytes);
+    if (ret) {
+      LOG(ERROR) << "Could not grow queue dump file (" << strerror(-ret)
+                 << "), no longer logging packets for " << name();
+      CloseDumpFile();
+      return;
+    }
+  }
+
+  QueueLogRecord *record =
+      reinterpret_cast<QueueLogRecord *>(dump_map_ + dump_pos_);
+  record->time = now_ns;
+  record->seq = seq;
+  record->qsize = qsize;
+  record->port = port.value();
+  record->datalen = datalen;
+  record->queued = queued;
+  record->batch = batch;
+  record->flags = flags;
+  dump_pos_ += sizeof(QueueLogRecord);
+}
+
+void Queue::FlushTextDump() {
+  *dump_out_ << dump_deq_.str();
+  *dump_out_ << dump_enq_.str();
+  ResetTextDump();
+}
+
+void Queue::ResetTextDump() {
   dump_deq_.str("");
   dump_enq_.str("");
   dump_deq_.clear();
   dump_enq_.clear();
-  dump_deq_ << "\n";
-  dump_enq_ << "\n";
+  // lines written to stdout are appended to glog output, so start on a new
+  // line; a dump file only ever has whole lines
+  if (dump_out_ == &std::cout) {
+    dump_deq_ << "\n";
+    dump_enq_ << "\n";
+  }
+}
+
+void Queue::DeInit() {
+  // ADDED BY RAY
+  CloseDumpFile();
+  FlushTextDump();
+  if (dump_text_.is_open()) {
+    dump_text_.close();
+  }
+  dump_out_ = &std::cout;
   
   bess::Packet *pkt;
 
@@ -200,7 +325,14 @@ void Queue::ProcessBatch(Context *, bess::PacketBatch *batch) {
             
       // output flow stats:
       // enqueued, timestamp, dst port, seq num, datalen, queue size, dropped, queued, batch size
-      if ( i >= queued ) {   // packet is dropped ctx.current_ns()
+      if (dump_fd_ >= 0) {
+        if (i < queued) {
+          flow_stats_[tcp->dst_port]++;
+        }
+        DumpRecord(now_ns, tcp->dst_port, tcp->seq_num.value(), datalen, qsize,
+                   (i >= queued) ? QUEUE_LOG_DROPPED : 0, queued, batch->cnt());
+      }
+      else if ( i >= queued ) {   // packet is dropped ctx.current_ns()
 	dump_enq_ << "0," << now_ns << "," <<  tcp->dst_port << "," << tcp->seq_num << "," << datalen << "," << qsize << ",1," << queued << "," << batch->cnt() << "\n";
       }
       else {  // packet isn't dropped
@@ -256,6 +388,17 @@ struct task_result Queue::RunTask(Context *ctx, bess::PacketBatch *batch,
       Tcp *tcp = reinterpret_cast<Tcp *>(reinterpret_cast<uint8_t *>(ip) + ip_bytes);
       uint32_t datalen = ip->length.value() - (tcp->offset * 4) - (ip->header_length * 4);
       flow_stats_[tcp->dst_port]--;
+
+      if (dump_fd_ >= 0) {
+        uint8_t flags = QUEUE_LOG_DEQUEUED;
+        if (tcp->flags & Tcp::Flag::kFin) {
+          flags |= QUEUE_LOG_FIN;
+        }
+        DumpRecord(now_ns, tcp->dst_port, tcp->seq_num.value(), datalen, qsize,
+                   flags, cnt, batch->cnt());
+        continue;
+      }
+
       num_pkts_ = num_pkts_ + 1;
       
       dump_deq_ << "1," << now_ns << "," << tcp->dst_port << "," << tcp->seq_num << "," << datalen << "," << qsize << ",0," << cnt << "," << batch->cnt() << "\n";
@@ -265,28 +408,14 @@ struct task_result Queue::RunTask(Context *ctx, bess::PacketBatch *batch,
       if (datalen == 0) {
 	if (tcp->flags & Tcp::Flag::kFin) {
 	  num_pkts_ = 0;
-	  std::cout << dump_deq_.str();
-	  std::cout << dump_enq_.str();
-	  dump_deq_.str("");
-	  dump_enq_.str("");
-	  dump_deq_.clear();
-	  dump_enq_.clear();
-	  dump_deq_ << "\n";
-	  dump_enq_ << "\n";
+	  FlushTextDump();
 	}
       }
     }
     // output dump and clear
     if (num_pkts_ >= 10) {
       num_pkts_ = 0;
-      std::cout << dump_deq_.str();
-      std::cout << dump_enq_.str();
-      dump_deq_.str("");
-      dump_enq_.str("");
-      dump_deq_.clear();
-      dump_enq_.clear();
-      dump_deq_ << "\n";
-      dump_enq_ << "\n";
+      FlushTextDump();
     }
   }
     
@@ -359,6 +488,41 @@ CommandResponse Queue::CommandGetStatus(
   return CommandSuccess(resp);
 }
 
+CommandResponse Queue::CommandSetDumpFile(
+    const bess::pb::QueueCommandSetDumpFileArg &arg) {
+  // finish whatever log is currently being written
+  FlushTextDump();
+  CloseDumpFile();
+  if (dump_text_.is_open()) {
+    dump_text_.close();
+  }
+  dump_out_ = &std::cout;
+  num_pkts_ = 0;
+  ResetTextDump();
+
+  if (arg.dump_file().empty()) {
+    return CommandSuccess();
+  }
+
+  if (arg.text()) {
+    dump_text_.open(arg.dump_file(), std::ios::out | std::ios::trunc);
+    if (!dump_text_.is_open()) {
+      return CommandFailure(errno, "Could not open dump file %s",
+                            arg.dump_file().c_str());
+    }
+    dump_out_ = &dump_text_;
+    ResetTextDump();
+    return CommandSuccess();
+  }
+
+  int ret = OpenDumpFile(arg.dump_file());
+  if (ret) {
+    return CommandFailure(-ret, "Could not open dump file %s",
+                          arg.dump_file().c_str());
+  }
+  return CommandSuccess();
+}
+
 void Queue::AdjustWaterLevels() {
   high_water_ = static_cast<uint64_t>(size_ * kHighWaterRatio);
   low_water_ = static_cast<uint64_t>(size_ * kLowWaterRatio);
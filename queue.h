@@ -36,11 +36,48 @@
 #include "../pb/module_msg.pb.h"
 
 #include "../utils/ip.h"
+#include <fstream>
 #include <iostream>
+#include <string>
 #include <unordered_map>
 
 using bess::utils::be16_t;
 
+// ADDED BY RAY -- binary queue log
+// When QueueArg.dump_file is set, every packet event is written to that file
+// as a fixed-width QueueLogRecord instead of a line of text on stdout.
+// The file starts with a QueueLogHeader. Both structs must match
+// QUEUE_LOG_HEADER_DTYPE and QUEUE_LOG_RECORD_DTYPE in
+// data_analysis/queue_log.py.
+#define QUEUE_LOG_MAGIC "CCQLOG01"
+#define QUEUE_LOG_VERSION 1
+
+#define QUEUE_LOG_DEQUEUED 0x1
+#define QUEUE_LOG_DROPPED 0x2
+#define QUEUE_LOG_FIN 0x4
+
+struct QueueLogHeader {
+  char magic[8];         // QUEUE_LOG_MAGIC
+  uint32_t version;      // QUEUE_LOG_VERSION
+  uint32_t record_size;  // sizeof(QueueLogRecord)
+  uint64_t reserved[2];
+} __attribute__((packed));
+
+struct QueueLogRecord {
+  uint64_t time;     // ns, same clock as the text log
+  uint32_t seq;      // TCP sequence number
+  uint32_t qsize;    // queue occupancy when the event happened
+  uint16_t port;     // TCP dst port
+  uint16_t datalen;  // TCP payload length
+  uint16_t queued;   // number of packets enqueued/dequeued with this batch
+  uint16_t batch;    // batch size
+  uint8_t flags;     // QUEUE_LOG_DEQUEUED | QUEUE_LOG_DROPPED | QUEUE_LOG_FIN
+  uint8_t pad[7];
+} __attribute__((packed));
+
+static_assert(sizeof(QueueLogHeader) == 32, "QueueLogHeader must be 32 bytes");
+static_assert(sizeof(QueueLogRecord) == 32, "QueueLogRecord must be 32 bytes");
+
 class Queue : public Module {
  public:
   static const Commands cmds;
@@ -57,7 +94,13 @@ class Queue : public Module {
         stats_(),
     dump_enq_(),
     dump_deq_(),
-    num_pkts_() {
+    num_pkts_(),
+    dump_fd_(-1),
+    dump_map_(),
+    dump_map_offset_(),
+    dump_pos_(),
+    dump_text_(),
+    dump_out_(&std::cout) {
     is_task_ = true;
     propagate_workers_ = false;
     max_allowed_workers_ = Worker::kMaxWorkers;
@@ -77,6 +120,8 @@ class Queue : public Module {
   CommandResponse CommandSetSize(const bess::pb::QueueCommandSetSizeArg &arg);
   CommandResponse CommandGetStatus(
       const bess::pb::QueueCommandGetStatusArg &arg);
+  CommandResponse CommandSetDumpFile(
+      const bess::pb::QueueCommandSetDumpFileArg &arg);
 
   CheckConstraintResult CheckModuleConstraints() const override;
 
@@ -91,6 +136,21 @@ class Queue : public Module {
 
   CommandResponse SetSize(uint64_t size);
 
+  // Open/close the binary queue log; records are written through a mmap'd
+  // window of the file that is moved forward whenever it fills up.
+  int OpenDumpFile(const std::string &path);
+  void CloseDumpFile();
+  int MapDumpWindow(uint64_t offset);
+  void DumpRecord(uint64_t now_ns, be16_t port, uint32_t seq, uint32_t datalen,
+                  uint32_t qsize, uint8_t flags, uint32_t queued,
+                  uint32_t batch);
+
+  // Write buffered text events to dump_out_ and reset the buffers.
+  void FlushTextDump();
+  void ResetTextDump();
+
+  static const size_t kDumpMapBytes = 64 << 20;
+
   struct llring *queue_;
   bool prefetch_;
 
@@ -120,6 +180,16 @@ class Queue : public Module {
   uint32_t num_pkts_;
 
   std::unordered_map<be16_t, uint64_t> flow_stats_;
+
+  // binary queue log, dump_fd_ is -1 if events are logged as text
+  int dump_fd_;
+  char *dump_map_;
+  uint64_t dump_map_offset_;
+  size_t dump_pos_;
+
+  // text queue log, events go to stdout unless set_dump_file gave a file
+  std::ofstream dump_text_;
+  std::ostream *dump_out_;
   
 };
 
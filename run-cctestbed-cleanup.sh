@@ -1,3 +1,4 @@
+CCTESTBED_DIR=$(cd "$(dirname "$0")" && pwd)
 EXP_NAME=$1
 TAR_FILENAME=$2
 EXP_CONFIG_FILENAME=$3
@@ -29,36 +30,55 @@ move_config_file() {
     fi
 }
 
-get_tcpdump_rtts() {
-    tshark -r "$SERVER_TCPDUMP" -Tfields -e frame.time_relative -e tcp.analysis.ack_rtt > /tmp/rtt-$EXP_NAME.txt
+# ack rtts & data bit rate from one pass over the pcap (used to be tshark & capinfos)
+analyze_tcpdump() {
+    PYTHONPATH=$CCTESTBED_DIR python3 -m data_analysis.pcap "$SERVER_TCPDUMP" \
+	      --rtt /tmp/rtt-$EXP_NAME.txt --capinfos /tmp/capinfos-$EXP_NAME.txt
 }
 
-get_bitrate() {
-    capinfos -iTm $SERVER_TCPDUMP > /tmp/capinfos-$EXP_NAME.txt
+# indexed tarball, so analysis can read any one log without decompressing the others
+create_tarfile() {
+    PYTHONPATH=$CCTESTBED_DIR python3 -m data_analysis.indexed_tar $TAR_FILENAME "$@"
+}
+
+# record the finished experiment so scripts don't have to glob for its tarball
+catalog_experiment() {
+    PYTHONPATH=$CCTESTBED_DIR python3 -m data_analysis.experiment_catalog add /tmp/data-raw/$(basename $TAR_FILENAME)
+}
+
+# queue log is written by bessd as root; it is chown'd to the user when the
+# experiment ends, but if the run died before that only root can rm it
+remove_logs() {
+    cd /tmp/ && rm -f $LOGS
+    if [ -e $QUEUE_FILE ]
+    then
+	sudo rm -f $QUEUE_FILE
+    fi
 }
 
 if queue_has_data
 then
-    get_tcpdump_rtts
-    get_bitrate
+    analyze_tcpdump
     if move_config_file
     then
-	cd /tmp && tar -czf $TAR_FILENAME $(cd /tmp/ && ls $LOGS $(basename $EXP_CONFIG_FILENAME) 2> /dev/null)
+	cd /tmp && create_tarfile $(cd /tmp/ && ls $LOGS $(basename $EXP_CONFIG_FILENAME) 2> /dev/null)
 	rm -f /tmp/$(basename $EXP_CONFIG_FILENAME)
-	cd /tmp/ && rm -f $LOGS
+	remove_logs
 	# added for website experiments 
 	mkdir -p /tmp/data-tmp/
 	cp $TAR_FILENAME /tmp/data-tmp/
 	mkdir -p /tmp/data-raw/
 	mv $TAR_FILENAME /tmp/data-raw/
+	catalog_experiment
     else
-	cd /tmp && tar -czf $TAR_FILENAME $(ls $LOGS 2> /dev/null)
-	cd /tmp/ && rm -f $LOGS
+	cd /tmp && create_tarfile $(ls $LOGS 2> /dev/null)
+	remove_logs
 	# added for website experiments 
 	mkdir -p /tmp/data-tmp/
 	cp $TAR_FILENAME /tmp/data-tmp/
 	mkdir -p /tmp/data-raw/
 	mv $TAR_FILENAME /tmp/data-raw/
+	catalog_experiment
     fi
 else
     :
@@ -56,6 +56,7 @@ MODULE_PARM_DESC(full, "Full log (1=every ack packet received,  0=only cwnd chan
 module_param(full, int, 0);
 
 static const char procname[] = "tcpprobe";
+static const char procname_bin[] = "tcpprobe_bin";
 
 // ADDED by RAY from tcp_bbr.c
 /* BBR congestion control block */
@@ -134,6 +135,42 @@ struct tcp_log {
   // END
 };
 
+/*
+ * Records read from /proc/net/tcpprobe_bin: a header and then one packed
+ * record per logged packet, in host byte order except for addresses and
+ * ports. Read with data_analysis/tcpprobe.py; keep the two in sync.
+ */
+#define TCPPROBE_BIN_MAGIC	"TCPPROBE"
+#define TCPPROBE_BIN_VERSION	1
+
+struct tcp_log_bin_header {
+	char	magic[8];
+	u32	version;
+	u32	record_size;
+} __packed;
+
+struct tcp_log_record {
+	u64	tstamp_ns;	/* since the log was opened */
+	__be32	saddr;		/* 0 for IPv6 sockets */
+	__be32	daddr;
+	__be16	sport;
+	__be16	dport;
+	u16	family;
+	u16	length;
+	u32	snd_nxt;
+	u32	snd_una;
+	u32	snd_cwnd;
+	u32	ssthresh;
+	u32	snd_wnd;
+	u32	srtt;
+	u32	rcv_wnd;
+	u32	bbr_bw_lo;
+	u32	bbr_bw_hi;
+	u32	bbr_min_rtt;
+	u32	bbr_pacing_gain;
+	u32	bbr_cwnd_gain;
+} __packed;
+
 static struct {
 	spinlock_t	lock;
 	wait_queue_head_t wait;
@@ -329,6 +366,103 @@ static const struct file_operations tcpprobe_fops = {
 	.llseek  = noop_llseek,
 };
 
+static void tcpprobe_fill_record(struct tcp_log_record *r)
+{
+	const struct tcp_log *p = tcp_probe.log + tcp_probe.tail;
+
+	memset(r, 0, sizeof(*r));
+	r->tstamp_ns = ktime_to_ns(ktime_sub(p->tstamp, tcp_probe.start));
+	r->family = p->src.raw.sa_family;
+	if (r->family == AF_INET) {
+		r->saddr = p->src.v4.sin_addr.s_addr;
+		r->daddr = p->dst.v4.sin_addr.s_addr;
+		r->sport = p->src.v4.sin_port;
+		r->dport = p->dst.v4.sin_port;
+	} else {
+		r->sport = p->src.v6.sin6_port;
+		r->dport = p->dst.v6.sin6_port;
+	}
+	r->length = p->length;
+	r->snd_nxt = p->snd_nxt;
+	r->snd_una = p->snd_una;
+	r->snd_cwnd = p->snd_cwnd;
+	r->ssthresh = p->ssthresh;
+	r->snd_wnd = p->snd_wnd;
+	r->srtt = p->srtt;
+	r->rcv_wnd = p->rcv_wnd;
+	r->bbr_bw_lo = p->bbr_bw_lo;
+	r->bbr_bw_hi = p->bbr_bw_hi;
+	r->bbr_min_rtt = p->bbr_min_rtt;
+	r->bbr_pacing_gain = p->bbr_pacing_gain;
+	r->bbr_cwnd_gain = p->bbr_cwnd_gain;
+}
+
+/*
+ * Same log as tcpprobe_read, without formatting every record as text.
+ * Blocks until there is at least one record, then returns as many whole
+ * records as are logged and fit in the buffer.
+ */
+static ssize_t tcpprobe_bin_read(struct file *file, char __user *buf,
+				 size_t len, loff_t *ppos)
+{
+	int error = 0;
+	size_t cnt = 0;
+
+	if (!buf)
+		return -EINVAL;
+
+	if (*ppos == 0) {
+		struct tcp_log_bin_header hdr = {
+			.version = TCPPROBE_BIN_VERSION,
+			.record_size = sizeof(struct tcp_log_record),
+		};
+
+		memcpy(hdr.magic, TCPPROBE_BIN_MAGIC, sizeof(hdr.magic));
+		if (len < sizeof(hdr))
+			return -EINVAL;
+		if (copy_to_user(buf, &hdr, sizeof(hdr)))
+			return -EFAULT;
+		cnt += sizeof(hdr);
+	}
+
+	while (cnt + sizeof(struct tcp_log_record) <= len) {
+		struct tcp_log_record rec;
+
+		/* Wait for data in buffer */
+		error = wait_event_interruptible(tcp_probe.wait,
+						 tcp_probe_used() > 0);
+		if (error)
+			break;
+
+		spin_lock_bh(&tcp_probe.lock);
+		if (tcp_probe.head == tcp_probe.tail) {
+			/* multiple readers race? */
+			spin_unlock_bh(&tcp_probe.lock);
+			continue;
+		}
+		tcpprobe_fill_record(&rec);
+		tcp_probe.tail = (tcp_probe.tail + 1) & (bufsize - 1);
+		spin_unlock_bh(&tcp_probe.lock);
+
+		if (copy_to_user(buf + cnt, &rec, sizeof(rec)))
+			return -EFAULT;
+		cnt += sizeof(rec);
+
+		if (tcp_probe_used() == 0)
+			break;
+	}
+
+	*ppos += cnt;
+	return cnt == 0 ? error : cnt;
+}
+
+static const struct file_operations tcpprobe_bin_fops = {
+	.owner	 = THIS_MODULE,
+	.open	 = tcpprobe_open,
+	.read    = tcpprobe_bin_read,
+	.llseek  = noop_llseek,
+};
+
 static __init int tcpprobe_init(void)
 {
 	int ret = -ENOMEM;
@@ -354,13 +488,20 @@ static __init int tcpprobe_init(void)
 	if (!proc_create(procname, S_IRUSR, init_net.proc_net, &tcpprobe_fops))
 		goto err0;
 
+	/* both files read the same log, only use one of them at a time */
+	if (!proc_create(procname_bin, S_IRUSR, init_net.proc_net,
+			 &tcpprobe_bin_fops))
+		goto err1;
+
 	ret = register_jprobe(&tcp_jprobe);
 	if (ret)
-		goto err1;
+		goto err2;
 
 	pr_info("probe registered (port=%d/fwmark=%u) bufsize=%u version=1.0\n",
 		port, fwmark, bufsize);
 	return 0;
+ err2:
+	remove_proc_entry(procname_bin, init_net.proc_net);
  err1:
 	remove_proc_entry(procname, init_net.proc_net);
  err0:
@@ -372,6 +513,7 @@ module_init(tcpprobe_init);
 static __exit void tcpprobe_exit(void)
 {
 	remove_proc_entry(procname, init_net.proc_net);
+	remove_proc_entry(procname_bin, init_net.proc_net);
 	unregister_jprobe(&tcp_jprobe);
 	kfree(tcp_probe.log);
 }
@@ -83,5 +83,7 @@ def is_local_process_running(pid):
         return True
 
 def check_open_fileobjs():
+    # pooled ssh connections stay open on purpose, only count leaked ones
+    cctestbed.close_ssh_clients()
     this_proc = psutil.Process()
     return this_proc.open_files(), this_proc.connections()
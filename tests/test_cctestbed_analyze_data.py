@@ -0,0 +1,25 @@
+import data_analysis.cctestbed_analyze_data as mut
+import data_analysis.cctestbed_analyze_data_v2 as mut_v2
+from data_analysis.tcpprobe import process_tcpprobe, read_tcpprobe
+from tests.test_tcpprobe import TCPPROBE_EVENTS, write_binary_log
+from cctestbedv2 import Flow
+from types import SimpleNamespace
+import pytest
+
+def get_analyzer(tmpdir, monkeypatch, module):
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    write_binary_log(filename, TCPPROBE_EVENTS)
+    df_tcpprobe = process_tcpprobe(read_tcpprobe(filename))
+    monkeypatch.setattr(module.ExperimentAnalyzer, 'df_tcpprobe',
+                        property(lambda self: df_tcpprobe))
+    flows = [Flow('cubic', 0, 60, 35, 5555, port, None, None, 'iperf', None)
+             for port in (5201, 5202)]
+    return module.ExperimentAnalyzer(SimpleNamespace(flows=flows))
+
+@pytest.mark.parametrize('module', [mut, mut_v2])
+def test_get_tcpprobe_columns_per_flow(tmpdir, monkeypatch, module):
+    analyzer = get_analyzer(tmpdir, monkeypatch, module)
+    cwnd = module.get_tcpprobe_columns_per_flow(analyzer, 'cwnd')
+    assert(list(cwnd.columns) == ['cubic', 'cubic-2'])
+    assert(cwnd['cubic'].dropna().tolist() == [10, 24])
+    assert(cwnd['cubic-2'].dropna().tolist() == [2])
@@ -0,0 +1,145 @@
+import cctestbed_dispatch as mut
+from contextlib import contextmanager
+import pytest
+import socket
+import threading
+import yaml
+
+def test_load_testbeds(tmpdir):
+    testbeds_file = tmpdir.join('testbeds.yaml')
+    testbeds_file.write(yaml.safe_dump({
+        'bess-1': {'ip_wan': '10.0.0.1', 'username': 'rware',
+                   'server': {'ip_wan': '10.0.0.2'},
+                   'client': {'ip_wan': '10.0.0.3'}},
+        'bess-2': {'ip_wan': '10.0.1.1', 'username': 'rware',
+                   'cctestbed_dir': '/users/rware/cctestbed'}}))
+    testbeds = {testbed.name: testbed
+                for testbed in mut.load_testbeds(str(testbeds_file))}
+    assert(testbeds['bess-1'].server == {'ip_wan': '10.0.0.2'})
+    assert(testbeds['bess-1'].cctestbed_dir == '/opt/cctestbed')
+    assert(testbeds['bess-2'].server is None)
+    assert(testbeds['bess-2'].cctestbed_dir == '/users/rware/cctestbed')
+
+def test_get_testbed_config():
+    config = {'server': {'ip_wan': 'old-server'}, 'client': {'ip_wan': 'old-client'},
+              'experiments': {'exp': {'btlbw': 10}}}
+    testbed = mut.Testbed(name='bess-1', ip_wan='10.0.0.1', username='rware',
+                          key_filename=None, server={'ip_wan': 'new-server'},
+                          client=None, cctestbed_dir='/opt/cctestbed',
+                          python='python3.6')
+    testbed_config = mut.get_testbed_config(config, testbed)
+    assert(testbed_config['server'] == {'ip_wan': 'new-server'})
+    assert(testbed_config['client'] == {'ip_wan': 'old-client'})
+    assert(testbed_config['experiments'] == config['experiments'])
+    # original config is left alone
+    assert(config['server'] == {'ip_wan': 'old-server'})
+
+EXPERIMENT_NAMES = ['exp0', 'exp1', 'exp2', 'exp3']
+
+def make_testbed(name):
+    return mut.Testbed(name=name, ip_wan=name, username='rware', key_filename=None,
+                       server=None, client=None, cctestbed_dir='/opt/cctestbed',
+                       python='python3.6')
+
+class FakeDispatcher(mut.Dispatcher):
+    """Dispatcher whose testbeds run experiments with run_experiment(testbed, name)"""
+    def __init__(self, testbeds, archive_dir, run_experiment,
+                 experiment_names=EXPERIMENT_NAMES):
+        config = {'experiments': {name: {} for name in experiment_names}}
+        super().__init__(config, testbeds, archive_dir)
+        self.run_experiment = run_experiment
+        # (testbed name, experiment name) in the order experiments were run
+        self.assigned = []
+        self.stopped = {testbed.name: threading.Event() for testbed in testbeds}
+
+    def _worker(self, testbed):
+        try:
+            super()._worker(testbed)
+        finally:
+            self.stopped[testbed.name].set()
+
+    def _upload_config(self, ssh_client, testbed):
+        return '/tmp/config.yaml'
+
+    def _run_experiment(self, ssh_client, testbed, config_filename, experiment_name):
+        with self._lock:
+            self.assigned.append((testbed.name, experiment_name))
+        return self.run_experiment(testbed, experiment_name)
+
+@pytest.fixture
+def ssh_clients(monkeypatch):
+    """Testbeds whose name is in unreachable can't be connected to"""
+    unreachable = set()
+    @contextmanager
+    def get_ssh_client(ip_addr, username=None, key_filename=None):
+        if ip_addr in unreachable:
+            raise socket.error('Connection refused')
+        yield None
+    monkeypatch.setattr(mut, 'get_ssh_client', get_ssh_client)
+    return unreachable
+
+def test_dispatch_across_testbeds(tmpdir, ssh_clients):
+    # both testbeds have to be running an experiment before either can finish
+    barrier = threading.Barrier(2, timeout=10)
+    def run_experiment(testbed, experiment_name):
+        if experiment_name in ('exp0', 'exp1'):
+            barrier.wait()
+        return ['{}-{}.tar.gz'.format(experiment_name, testbed.name)]
+    dispatcher = FakeDispatcher([make_testbed('bess-1'), make_testbed('bess-2')],
+                                str(tmpdir), run_experiment)
+    assert(dispatcher.run() == [])
+    # each experiment runs once; exp0 & exp1 ran at the same time on different testbeds
+    assert(sorted(name for _, name in dispatcher.assigned) == EXPERIMENT_NAMES)
+    assert(sorted(dispatcher.assigned[:2]) in ([('bess-1', 'exp0'), ('bess-2', 'exp1')],
+                                               [('bess-1', 'exp1'), ('bess-2', 'exp0')]))
+    # each testbed takes experiments in config order
+    for testbed in ('bess-1', 'bess-2'):
+        names = [name for other, name in dispatcher.assigned if other == testbed]
+        assert(names == sorted(names))
+    assert(sorted(dispatcher.completed.keys()) == EXPERIMENT_NAMES)
+    for testbed, name in dispatcher.assigned:
+        assert(dispatcher.completed[name] == ['{}-{}.tar.gz'.format(name, testbed)])
+    assert(dispatcher.failed == [])
+
+def test_requeue_failed_testbed(tmpdir, ssh_clients):
+    def run_experiment(testbed, experiment_name):
+        if testbed.name == 'bess-1':
+            raise mut.TestbedBusyError('locked')
+        # wait until bess-1 has given its experiment back
+        assert(dispatcher.stopped['bess-1'].wait(timeout=10))
+        return ['{}.tar.gz'.format(experiment_name)]
+    dispatcher = FakeDispatcher([make_testbed('bess-1'), make_testbed('bess-2')],
+                                str(tmpdir), run_experiment)
+    assert(dispatcher.run() == [])
+    # bess-1 stops after its first experiment, which goes to the back of the queue
+    bess_1 = [name for testbed, name in dispatcher.assigned if testbed == 'bess-1']
+    bess_2 = [name for testbed, name in dispatcher.assigned if testbed == 'bess-2']
+    assert(len(bess_1) == 1)
+    assert(bess_2 == [name for name in EXPERIMENT_NAMES if name != bess_1[0]] + bess_1)
+    assert(sorted(dispatcher.completed.keys()) == EXPERIMENT_NAMES)
+
+def test_shutdown_without_testbeds(tmpdir, ssh_clients):
+    def run_experiment(testbed, experiment_name):
+        if experiment_name == 'exp1':
+            raise socket.error('Connection reset')
+        # ran but produced no tarball
+        return []
+    ssh_clients.add('bess-2')
+    dispatcher = FakeDispatcher([make_testbed('bess-1'), make_testbed('bess-2')],
+                                str(tmpdir), run_experiment)
+    # bess-2 never connects & bess-1 stops at exp1, leaving the rest not run
+    assert(dispatcher.run() == ['exp2', 'exp3', 'exp1'])
+    assert(dispatcher.assigned == [('bess-1', 'exp0'), ('bess-1', 'exp1')])
+    assert(dispatcher.failed == ['exp0'])
+    assert(dispatcher.completed == {})
+
+def test_skip_archived_experiments(tmpdir, ssh_clients):
+    tmpdir.join('exp1-20190101T120000.tar.gz').write('')
+    dispatcher = FakeDispatcher([make_testbed('bess-1')], str(tmpdir),
+                                lambda testbed, name: ['{}.tar.gz'.format(name)])
+    assert(dispatcher.run() == [])
+    assert([name for _, name in dispatcher.assigned] == ['exp0', 'exp2', 'exp3'])
+    dispatcher = FakeDispatcher([make_testbed('bess-1')], str(tmpdir),
+                                lambda testbed, name: ['{}.tar.gz'.format(name)])
+    dispatcher.run(experiment_names=['exp1'], force=True)
+    assert(dispatcher.assigned == [('bess-1', 'exp1')])
@@ -0,0 +1,77 @@
+import classify_service as mut
+from multiprocessing import AuthenticationError
+import json
+import os
+import pytest
+import stat
+import threading
+
+def fake_classify_website(tmpdir):
+    def classify_website(website, url, sequential=False, in_process=False):
+        assert(in_process)
+        if website == 'broken.com':
+            raise RuntimeError('could not reach website')
+        results_filename = str(tmpdir.join('{}.results'.format(website)))
+        with open(results_filename, 'w') as f:
+            json.dump({'website': website, 'url': url,
+                       'predicted_label': 'bbr' if sequential else 'cubic'}, f)
+        return results_filename
+    return classify_website
+
+def get_service(tmpdir, monkeypatch):
+    monkeypatch.delenv('CCTESTBED_CLASSIFY_AUTHKEY', raising=False)
+    monkeypatch.setattr(mut, 'AUTHKEY_PATH', str(tmpdir.join('keys', 'classify.authkey')))
+    monkeypatch.setattr(mut.classify_websites, 'classify_website',
+                        fake_classify_website(tmpdir))
+    monkeypatch.setattr(mut, 'load_training_library', lambda training_dir: [])
+    return mut.ClassifyService().start()
+
+def test_classify_service(tmpdir, monkeypatch):
+    service = get_service(tmpdir, monkeypatch)
+    job_id = service.submit([('cnn.com', 'http://cnn.com/a.jpg'),
+                             ('broken.com', 'http://broken.com/a.jpg')])
+    other_job_id = service.submit([['bbc.com', 'http://bbc.com/a.jpg']], sequential=True)
+    job = service.wait(job_id, timeout=10)
+    assert(job['status'] == mut.DONE)
+    assert(job['results'][0]['predicted_label'] == 'cubic')
+    assert(job['results'][1]['predicted_label'] is None)
+    assert('could not reach website' in job['results'][1]['error'])
+    assert(service.wait(other_job_id, timeout=10)['results'][0]['predicted_label'] == 'bbr')
+    assert(len(service.status()) == 2)
+    service.stop()
+
+def test_classify_client(tmpdir, monkeypatch):
+    service = get_service(tmpdir, monkeypatch)
+    address = str(tmpdir.join('classify.sock'))
+    threading.Thread(target=mut.serve, args=(service, address), daemon=True).start()
+    for _ in range(100):
+        try:
+            client = mut.ClassifyClient(address=address)
+            break
+        except OSError:
+            threading.Event().wait(0.05)
+    with client:
+        job_id = client.submit([('cnn.com', 'http://cnn.com/a.jpg')])
+        job = client.wait(job_id, timeout=10)
+        assert(job['results'][0]['predicted_label'] == 'cubic')
+        assert(client.status(job_id)['status'] == mut.DONE)
+    assert(stat.S_IMODE(os.stat(address).st_mode) == 0o600)
+    with pytest.raises(AuthenticationError):
+        mut.ClassifyClient(address=address, authkey=b'cctestbed')
+    # still serving
+    with mut.ClassifyClient(address=address) as client:
+        assert(client.status(job_id)['status'] == mut.DONE)
+    service.stop()
+
+def test_get_authkey(tmpdir, monkeypatch):
+    monkeypatch.delenv('CCTESTBED_CLASSIFY_AUTHKEY', raising=False)
+    path = str(tmpdir.join('keys', 'classify.authkey'))
+    authkey = mut.get_authkey(path)
+    assert(len(authkey) == 64)
+    assert(stat.S_IMODE(os.stat(path).st_mode) == 0o600)
+    assert(stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700)
+    # same key every time
+    assert(mut.get_authkey(path) == authkey)
+    assert(mut.get_authkey(str(tmpdir.join('other.authkey'))) != authkey)
+    monkeypatch.setenv('CCTESTBED_CLASSIFY_AUTHKEY', 'secret')
+    assert(mut.get_authkey(path) == b'secret')
@@ -0,0 +1,32 @@
+import classify_websites as mut
+import json
+import os
+
+def test_get_decided_label():
+    assert(mut.get_decided_label({}, 12) is None)
+    assert(mut.get_decided_label({'cubic': 6}, 6) is None)
+    assert(mut.get_decided_label({'cubic': 7}, 5) == 'cubic')
+    # invalid experiments never count towards a label
+    assert(mut.get_decided_label({'unknown': 5}, 7) is None)
+    assert(mut.get_decided_label({'unknown': 7}, 5) == 'unknown')
+    assert(mut.get_decided_label({'unknown': 6, 'bbr': 3}, 3) == 'unknown')
+    assert(mut.get_decided_label({'cubic': 2, 'bbr': 2}, 0) == 'unknown')
+    assert(mut.get_decided_label({'cubic': 3, 'bbr': 2}, 0) == 'cubic')
+
+def test_get_num_to_decide():
+    assert(mut.get_num_to_decide({}, 12) == 6)
+    assert(mut.get_num_to_decide({'cubic': 6}, 6) == 1)
+    assert(mut.get_num_to_decide({'cubic': 3, 'bbr': 3}, 6) == 3)
+    assert(mut.get_num_to_decide({'cubic': 5, 'unknown': 1}, 1) == 1)
+
+def test_order_network_conditions(tmpdir):
+    website_dir = tmpdir.mkdir('website-20190101T000000')
+    for idx, (network, mark_invalid) in enumerate([((5, 35), True), ((5, 35), True),
+                                                   ((10, 85), False)]):
+        with open(str(website_dir.join('exp-{}.results'.format(idx))), 'w') as f:
+            json.dump({'btlbw': network[0], 'rtt': network[1],
+                       'mark_invalid': mark_invalid}, f)
+    # website results don't have network conditions
+    website_dir.join('website.results').write(json.dumps({'experiments': []}))
+    assert(mut.order_network_conditions([(5, 35), (5, 85), (10, 85)], str(tmpdir))
+           == [(10, 85), (5, 85), (5, 35)])
@@ -33,6 +33,8 @@ def test_remote_command(experiment):
     assert(not is_remote_process_running(experiment.server.ip_wan, pid))
     assert(os.path.isfile(experiment.flows[0].server_log))
     os.remove(experiment.flows[0].server_log)
+    # ssh connections are kept open in the pool until closed
+    mut.close_ssh_clients()
     assert(len(this_proc.open_files()) == 0)
     assert(len(this_proc.connections()) == 0)
 
@@ -62,5 +64,7 @@ def test_remote_command_failure(experiment):
     assert(not is_remote_process_running(experiment.server.ip_wan, pid))
     assert(os.path.isfile(experiment.flows[0].server_log))
     os.remove(experiment.flows[0].server_log)
+    # ssh connections are kept open in the pool until closed
+    mut.close_ssh_clients()
     assert(len(this_proc.open_files()) == 0)
     assert(len(this_proc.connections()) == 0)
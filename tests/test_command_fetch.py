@@ -0,0 +1,123 @@
+import command as mut
+import gzip
+import io
+import os
+
+class FakeStdout:
+    def __init__(self, data, exit_status):
+        self._data = io.BytesIO(data)
+        self.channel = self
+        self._exit_status = exit_status
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+    def recv_exit_status(self):
+        return self._exit_status
+
+class FakeSSHClient:
+    """Runs the gzip fetch of one file; attempts is a list of (data, exit_status)"""
+    def __init__(self, attempts):
+        self.attempts = list(attempts)
+        self.cmds = []
+
+    def exec_command(self, cmd, timeout=None):
+        self.cmds.append(cmd)
+        data, exit_status = self.attempts.pop(0)
+        return None, FakeStdout(data, exit_status), io.BytesIO(b'gzip: error')
+
+def fetch(tmpdir, ssh_client, retries=3):
+    return mut.fetch_remote_files(ssh_client, '10.0.0.1', ['/tmp/queue.txt'],
+                                  local_dir=str(tmpdir), compress=True, retries=retries)
+
+def test_fetch_gzip(tmpdir):
+    data = b'queue log\n' * 1000
+    ssh_client = FakeSSHClient([(gzip.compress(data), 0)])
+    assert(fetch(tmpdir, ssh_client) == ['/tmp/queue.txt'])
+    assert(tmpdir.join('queue.txt').read_binary() == data)
+    assert(os.listdir(str(tmpdir)) == ['queue.txt'])
+
+def test_fetch_gzip_missing_file(tmpdir):
+    ssh_client = FakeSSHClient([(b'', mut._MISSING_FILE_STATUS)])
+    assert(fetch(tmpdir, ssh_client) == [])
+    # not retried
+    assert(len(ssh_client.cmds) == 1)
+    assert(os.listdir(str(tmpdir)) == [])
+
+def test_fetch_gzip_failure(tmpdir):
+    data = b'queue log\n' * 1000
+    compressed = gzip.compress(data)
+    ssh_client = FakeSSHClient([
+        # gzip failed partway through
+        (compressed[:len(compressed) // 2], 1),
+        # stream cut short
+        (compressed[:len(compressed) // 2], 0),
+        # corrupt stream
+        (b'not gzip data', 0)])
+    assert(fetch(tmpdir, ssh_client) == [])
+    assert(len(ssh_client.cmds) == 3)
+    # no empty or truncated file left behind
+    assert(os.listdir(str(tmpdir)) == [])
+    # retried after failing
+    ssh_client = FakeSSHClient([(b'not gzip data', 0), (compressed, 0)])
+    assert(fetch(tmpdir, ssh_client) == ['/tmp/queue.txt'])
+    assert(tmpdir.join('queue.txt').read_binary() == data)
+
+class FailingFile:
+    """Remote file that fails after returning its first half"""
+    def __init__(self, data):
+        self._data = io.BytesIO(data[:len(data) // 2])
+
+    def seek(self, offset):
+        self._data.seek(offset)
+
+    def prefetch(self, size):
+        pass
+
+    def read(self, size):
+        buf = self._data.read(size)
+        if not buf:
+            raise EOFError('connection lost')
+        return buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class FailingSFTPClient:
+    def __init__(self, data):
+        self.data = data
+        self.opened = 0
+
+    def open_sftp(self):
+        return self
+
+    def get_channel(self):
+        return self
+
+    def settimeout(self, timeout):
+        pass
+
+    def stat(self, path):
+        return os.stat_result((0,) * 6 + (len(self.data),) + (0,) * 3)
+
+    def open(self, path, mode):
+        self.opened += 1
+        return FailingFile(self.data)
+
+    def close(self):
+        pass
+
+def test_fetch_sftp_failure(tmpdir):
+    ssh_client = FailingSFTPClient(b'queue log\n' * 1000)
+    assert(mut.fetch_remote_files(ssh_client, '10.0.0.1', ['/tmp/queue.txt'],
+                                  local_dir=str(tmpdir), retries=2) == [])
+    assert(ssh_client.opened == 2)
+    # no truncated file left behind
+    assert(os.listdir(str(tmpdir)) == [])
+    # unless partial, which keeps it to resume next time
+    assert(mut.fetch_remote_files(ssh_client, '10.0.0.1', ['/tmp/queue.txt'],
+                                  local_dir=str(tmpdir), retries=1, partial=True) == [])
+    assert(os.listdir(str(tmpdir)) == ['queue.txt' + mut.PARTIAL_SUFFIX])
@@ -0,0 +1,89 @@
+import numpy as np
+
+from data_analysis import dtw as mut
+
+def reference_dtw(x, y, window=None):
+    # same recurrence as fastdtw.dtw, one cell at a time
+    if window is not None:
+        window = max(window, abs(len(x) - len(y)))
+    D = np.full((len(x) + 1, len(y) + 1), np.inf)
+    D[0, 0] = 0
+    for i in range(1, len(x) + 1):
+        for j in range(1, len(y) + 1):
+            if window is not None and abs(i - j) > window:
+                continue
+            D[i, j] = abs(x[i-1] - y[j-1]) + min(D[i-1, j], D[i, j-1], D[i-1, j-1])
+    return D[-1, -1]
+
+def test_dtw_distance():
+    rng = np.random.RandomState(0)
+    for n, m in [(1, 1), (1, 7), (7, 1), (20, 20), (15, 31), (40, 9)]:
+        x = rng.rand(n)
+        y = rng.rand(m)
+        expected = reference_dtw(x, y)
+        assert(np.isclose(mut.dtw_distance(x, y), expected))
+        assert(np.isclose(mut.dtw_distance(y, x), expected))
+        assert(mut.dtw_lower_bound(x, y) <= expected + 1e-9)
+        assert(mut.dtw_distance(x, y, max_distance=expected * 0.5) == np.inf)
+        assert(np.isclose(mut.dtw_distance(x, y, max_distance=expected + 1e-9),
+                          expected))
+
+def test_dtw_distance_window():
+    rng = np.random.RandomState(2)
+    for n, m, window in [(20, 20, 0), (20, 20, 3), (25, 18, 2), (12, 30, 40)]:
+        x = rng.rand(n)
+        y = rng.rand(m)
+        expected = reference_dtw(x, y, window=window)
+        assert(np.isclose(mut.dtw_distance(x, y, window=window), expected))
+        assert(np.isclose(mut.dtw_distance(y, x, window=window), expected))
+        assert(mut.dtw_lower_bound(x, y, window=window) <= expected + 1e-9)
+    # window of 0 is the euclidean (L1) distance
+    assert(np.isclose(mut.dtw_distance(x[:10], y[:10], window=0),
+                      np.abs(x[:10] - y[:10]).sum()))
+
+def test_dtw_distances():
+    rng = np.random.RandomState(3)
+    X = rng.rand(4, 15)
+    Y = rng.rand(3, 12)
+    for window in [None, 4]:
+        expected = np.array([[reference_dtw(x, y, window=window) for y in Y]
+                             for x in X])
+        assert(np.allclose(mut.dtw_distances(X, Y, window=window), expected))
+        assert(np.allclose(mut.dtw_distances(X[0], Y, window=window), expected[0]))
+        expected = np.array([[reference_dtw(x, y, window=window) for y in X]
+                             for x in X])
+        assert(np.allclose(mut.dtw_distances(X, window=window), expected))
+
+def test_dtw_nearest_neighbor():
+    rng = np.random.RandomState(1)
+    query = np.sin(np.linspace(0, 10, 50))
+    candidates = [rng.rand(50) for _ in range(10)]
+    candidates.insert(3, query + 0.01)
+    candidates.append(query + 0.01)
+    closest, distances = mut.dtw_nearest_neighbor(query, candidates)
+    expected = [reference_dtw(query, candidate) for candidate in candidates]
+    # first of the tied candidates wins
+    assert(closest == 3)
+    assert(np.isclose(distances[3], min(expected)))
+    assert(np.isclose(distances[-1], min(expected)))
+    for distance, expected_distance in zip(distances, expected):
+        assert(distance is None or np.isclose(distance, expected_distance))
+
+def test_classify_flow(tmpdir):
+    def write_features(name, values):
+        path = tmpdir.join('{}.features'.format(name))
+        path.write('queue_occupancy\n' + '\n'.join(str(v) for v in values) + '\n')
+        return str(path)
+    testing_flow = np.linspace(0, 1, 30)
+    testing_features = write_features('10bw-35rtt-32q-website', testing_flow)
+    training_features = [
+        write_features('cubic-10bw-35rtt-32q-local-1', np.linspace(1, 0, 40)),
+        write_features('bbr-10bw-35rtt-32q-local-2', np.linspace(0, 1, 25)),
+        write_features('reno-10bw-35rtt-32q-local-3', np.full(30, 0.5))]
+    results = mut.classify_flow(testing_features, training_features)
+    assert(results['predicted_label'] == 'bbr')
+    assert(results['closest_exp_name'] == 'bbr-10bw-35rtt-32q-local-2')
+    assert(np.isclose(results['bbr'], reference_dtw(testing_flow[:25],
+                                                   np.linspace(0, 1, 25))))
+    assert(results['closest_distance'] == results['bbr'])
+    assert(results['num_distance_ties'] == 1)
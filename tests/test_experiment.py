@@ -0,0 +1,43 @@
+import data_analysis.experiment as mut
+import pickle
+from data_analysis.tar_cache import TarCache
+import pytest
+
+def get_experiment():
+    return mut.Experiment(name='cubic-bbr', exp_time='20190101T000000',
+                          tarfile_localpath='/tmp/cubic-bbr-20190101T000000.tar.gz',
+                          logs={'queue_log': '/tmp/queue-cubic-bbr-20190101T000000.txt',
+                                'tcpprobe_log': '/tmp/tcpprobe-cubic-bbr-20190101T000000.bin'})
+
+def test_num_loader_processes(monkeypatch):
+    monkeypatch.setattr(mut, 'LOADER_PROCESSES', None)
+    monkeypatch.setattr(mut.os, 'sched_getaffinity', lambda pid: {0, 1, 2, 3}, raising=False)
+    assert(mut.get_num_loader_processes(1000) == 4)
+    assert(mut.get_num_loader_processes(1000, remote=True) == 4 * mut.REMOTE_LOADER_PROCESSES_PER_CPU)
+    assert(mut.get_num_loader_processes(2, remote=True) == 2)
+    assert(mut.get_num_loader_processes(0) == 1)
+    monkeypatch.setattr(mut.os, 'sched_getaffinity', lambda pid: set(range(64)))
+    assert(mut.get_num_loader_processes(1000) == mut.MAX_LOADER_PROCESSES)
+    monkeypatch.setattr(mut, 'LOADER_PROCESSES', '3')
+    assert(mut.get_num_loader_processes(1000, remote=True) == 3)
+
+def test_analyzer_from_handle(tmpdir):
+    analyzer = mut.ExperimentAnalyzer(get_experiment())
+    analyzer._hdf_queue_path = str(tmpdir.join('queue-cubic-bbr-20190101T000000.h5'))
+    handle = pickle.loads(pickle.dumps(analyzer.handle))
+    assert(handle.tcpprobe_path is None)
+    copy = mut.ExperimentAnalyzer.from_handle(handle)
+    assert(copy == analyzer)
+    assert(copy.experiment.logs == analyzer.experiment.logs)
+    assert(copy._hdf_queue_path == analyzer._hdf_queue_path)
+    assert(copy._df_tcpprobe is None)
+
+def test_untarfile_corrupt_archive(tmpdir, monkeypatch):
+    monkeypatch.setattr(mut, 'extract_member',
+                        TarCache(str(tmpdir.join('cache'))).extract)
+    tar_filename = tmpdir.join('exp.tar.gz')
+    tar_filename.write('not a tarball')
+    # reported like a failed tar -x, then the file is missing
+    with pytest.raises(FileNotFoundError):
+        with mut.untarfile(str(tar_filename), 'exp.json', untar_dir=str(tmpdir)):
+            pass
@@ -0,0 +1,119 @@
+import data_analysis.experiment_catalog as mut
+from data_analysis.indexed_tar import write_indexed_tar
+import hashlib
+import json
+import pytest
+
+def write_archive(directory, exp_name, flows=(('cubic', 0, 60, 35),), btlbw=5, queue_size=64):
+    description = {'name': exp_name.rsplit('-', 1)[0], 'btlbw': btlbw,
+                   'queue_size': queue_size,
+                   'flows': [list(flow) + [5201, 5555, None, None, 'iperf', None]
+                             for flow in flows]}
+    directory.join('{}.json'.format(exp_name)).write(json.dumps(description))
+    archive_path = str(directory.join('{}.tar.gz'.format(exp_name)))
+    write_indexed_tar(archive_path, ['{}.json'.format(exp_name)], base_dir=str(directory))
+    return archive_path
+
+@pytest.fixture
+def catalog(tmpdir):
+    with mut.ExperimentCatalog(str(tmpdir.join('catalog.db'))) as catalog:
+        yield catalog
+
+def test_parse_exp_name():
+    assert(mut.parse_exp_name('5bw-35rtt-64q-cnn.com-20190101T120000') ==
+           ('5bw-35rtt-64q-cnn.com', '20190101T120000'))
+    with pytest.raises(ValueError):
+        mut.parse_exp_name('5bw-35rtt-64q-cnn.com')
+
+def test_add_experiment(tmpdir, catalog):
+    archive_path = write_archive(tmpdir, '5bw-35rtt-64q-cnn.com-20190101T120000')
+    exp_name = catalog.add(archive_path)
+    assert(exp_name == '5bw-35rtt-64q-cnn.com-20190101T120000')
+    experiment = catalog.get(exp_name)
+    assert(experiment['name'] == '5bw-35rtt-64q-cnn.com')
+    assert(experiment['date'] == '20190101')
+    assert((experiment['btlbw'], experiment['rtt'], experiment['queue_size']) == (5, 35, 64))
+    assert(experiment['website'] == 'cnn.com')
+    assert(experiment['state'] == mut.COMPLETED)
+    with open(archive_path, 'rb') as f:
+        assert(experiment['archive_sha256'] == hashlib.sha256(f.read()).hexdigest())
+    # adding again replaces the experiment
+    catalog.add(archive_path, checksum=False)
+    assert(len(catalog.find()) == 1)
+    assert(catalog.get(exp_name)['archive_sha256'] is None)
+
+def test_find_experiments(tmpdir, catalog):
+    catalog.add(write_archive(tmpdir, 'cubic-bbr-20190101T120000',
+                              flows=[('cubic', 0, 60, 35), ('bbr', 0, 60, 35)]))
+    catalog.add(write_archive(tmpdir, 'cubic-20190102T120000', btlbw=10))
+    catalog.add(write_archive(tmpdir, '5bw-35rtt-64q-cnn.com-20190103T120000'))
+    assert([e['name'] for e in catalog.find(ccalg='bbr')] == ['cubic-bbr'])
+    assert([e['name'] for e in catalog.find(ccalg='cubic')] ==
+           ['cubic-bbr', 'cubic', '5bw-35rtt-64q-cnn.com'])
+    assert([e['name'] for e in catalog.find(btlbw=10)] == ['cubic'])
+    assert([e['name'] for e in catalog.find(rtt=35, queue_size=64, website='cnn.com')] ==
+           ['5bw-35rtt-64q-cnn.com'])
+    assert([e['name'] for e in catalog.find(pattern='cubic*')] == ['cubic-bbr', 'cubic'])
+    assert([e['name'] for e in catalog.find(min_date='20190102')] ==
+           ['cubic', '5bw-35rtt-64q-cnn.com'])
+    # names are matched exactly, unlike globbing for cubic-*.tar.gz
+    assert(catalog.is_completed('cubic'))
+    assert(catalog.is_completed('cubic', date='20190102'))
+    assert(not catalog.is_completed('cubic', date='20190101'))
+    assert(not catalog.is_completed('bbr'))
+
+def test_experiment_state(tmpdir, catalog):
+    exp_name = catalog.add(write_archive(tmpdir, 'cubic-20190101T120000'))
+    assert(catalog.set_state(exp_name, mut.PROCESSED))
+    assert(catalog.is_completed('cubic'))
+    assert(not catalog.is_completed('cubic', states=(mut.COMPLETED,)))
+    assert(catalog.set_state(exp_name, mut.REMOVED))
+    assert(not catalog.is_completed('cubic'))
+    assert(not catalog.set_state('bbr-20190101T120000', mut.REMOVED))
+    with pytest.raises(ValueError):
+        catalog.set_state(exp_name, 'done')
+
+def test_scan(tmpdir, catalog):
+    write_archive(tmpdir, 'cubic-20190101T120000')
+    write_archive(tmpdir, 'bbr-20190101T120000')
+    tmpdir.join('results.tar.gz').write('')
+    assert(catalog.scan(str(tmpdir)) == ['bbr-20190101T120000', 'cubic-20190101T120000'])
+    assert(catalog.scan(str(tmpdir)) == [])
+
+def test_main(tmpdir, capsys):
+    catalog_path = str(tmpdir.join('catalog.db'))
+    archive_path = write_archive(tmpdir, 'cubic-20190101T120000')
+    assert(mut.main(['--catalog', catalog_path, 'add', archive_path]) == 0)
+    assert(mut.main(['--catalog', catalog_path, 'state', 'cubic-20190101T120000', 'processed']) == 0)
+    assert(mut.main(['--catalog', catalog_path, 'find', '--ccalg', 'cubic']) == 0)
+    assert(capsys.readouterr().out.strip() == archive_path)
+
+def test_manifest(tmpdir, catalog):
+    archive_path = write_archive(tmpdir, 'cubic-20190101T120000')
+    catalog.add(archive_path)
+    catalog.add(write_archive(tmpdir, 'bbr-20190101T120000'))
+    manifest = catalog.get_manifest(['cubic*', '*cubic*'])
+    assert(len(manifest) == 1)
+    assert(manifest[0]['path'] == archive_path)
+    assert(manifest[0]['sha256'] == catalog.get('cubic-20190101T120000')['archive_sha256'])
+    tmpdir.join('cubic-20190101T120000.tar.gz').remove()
+    assert(catalog.get_manifest(['*']) == [catalog.get_manifest(['bbr*'])[0]])
+
+def test_is_completed_uncataloged_archive(tmpdir, catalog):
+    archive_dir = tmpdir.mkdir('archives')
+    # written before the catalog existed
+    write_archive(archive_dir, 'cubic-20190101T120000')
+    write_archive(archive_dir, 'cubic-bbr-20190102T120000')
+    assert(not catalog.is_completed('cubic'))
+    assert(not catalog.is_completed('cubic', date='20190102', archive_dir=str(archive_dir)))
+    assert(catalog.is_completed('cubic', archive_dir=str(archive_dir)))
+    # the archive found is recorded, cubic-bbr only matched the glob
+    assert(catalog.get('cubic-20190101T120000')['archive_path'] ==
+           str(archive_dir.join('cubic-20190101T120000.tar.gz')))
+    assert(catalog.get('cubic-bbr-20190102T120000') is None)
+    assert(catalog.is_completed('cubic'))
+    # experiments in the catalog aren't looked for in archive_dir
+    catalog.set_state('cubic-20190101T120000', mut.PROCESSED)
+    write_archive(archive_dir, 'cubic-20190103T120000')
+    assert(not catalog.is_completed('cubic', states=(mut.COMPLETED,),
+                                    archive_dir=str(archive_dir)))
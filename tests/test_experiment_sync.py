@@ -0,0 +1,188 @@
+import data_analysis.experiment_sync as mut
+from data_analysis.experiment_catalog import ExperimentCatalog, get_sha256
+from contextlib import contextmanager
+import json
+import os
+import pytest
+
+EXP_NAMES = ['cubic-20190101T120000', 'bbr-20190101T120000', 'cubic-bbr-20190102T120000']
+
+class FakeFile:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+
+    def prefetch(self, size):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+class FakeSFTP:
+    """sftp on the local filesystem"""
+    def __init__(self, opened):
+        self.opened = opened
+
+    def get_channel(self):
+        return self
+
+    def settimeout(self, timeout):
+        pass
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode):
+        self.opened.append(path)
+        return FakeFile(path)
+
+    def close(self):
+        pass
+
+class FakeStdout:
+    def __init__(self, output, exit_status):
+        self._output = output.encode('utf-8')
+        self.channel = self
+        self._exit_status = exit_status
+
+    def read(self):
+        return self._output
+
+    def recv_exit_status(self):
+        return self._exit_status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class FakeSSHClient:
+    """Remote machine with archives in remote_dir & a catalog of some of them"""
+    def __init__(self, remote_dir, catalog_entries=None):
+        self.remote_dir = remote_dir
+        self.catalog_entries = catalog_entries
+        self.cmds = []
+        self.opened = []
+
+    def exec_command(self, cmd, timeout=None):
+        self.cmds.append(cmd)
+        if cmd.startswith('find'):
+            lines = ['{}\t{}\t{}\n'.format(os.path.join(self.remote_dir, filename),
+                                           os.path.getsize(os.path.join(self.remote_dir, filename)),
+                                           1546300800.0)
+                     for filename in sorted(os.listdir(self.remote_dir))]
+            return None, FakeStdout(''.join(lines), 0), None
+        if self.catalog_entries is None:
+            return None, FakeStdout('', 1), None
+        return None, FakeStdout(json.dumps(self.catalog_entries), 0), None
+
+    def open_sftp(self):
+        return FakeSFTP(self.opened)
+
+@pytest.fixture
+def remote_dir(tmpdir):
+    remote_dir = tmpdir.mkdir('remote')
+    for exp_name in EXP_NAMES:
+        remote_dir.join('{}.tar.gz'.format(exp_name)).write(exp_name * 1000)
+    return remote_dir
+
+@pytest.fixture
+def catalog(tmpdir):
+    with ExperimentCatalog(str(tmpdir.join('catalog.db'))) as catalog:
+        yield catalog
+
+def sync(monkeypatch, ssh_client, local_dir, catalog, **kwargs):
+    @contextmanager
+    def get_ssh_client(ip_addr, username, key_filename=None):
+        yield ssh_client
+    monkeypatch.setattr(mut, 'get_ssh_client', get_ssh_client)
+    return mut.sync_experiments('10.0.0.1', 'cctestbed', ['*cubic*'], str(local_dir),
+                                catalog=catalog, remote_dir=ssh_client.remote_dir, **kwargs)
+
+def test_remote_manifest(remote_dir):
+    path = str(remote_dir.join('cubic-20190101T120000.tar.gz'))
+    ssh_client = FakeSSHClient(str(remote_dir), catalog_entries=[
+        {'exp_name': 'cubic-20190101T120000', 'path': path,
+         'size': os.path.getsize(path), 'mtime': 1546300800.0, 'sha256': get_sha256(path)},
+        # out of date, size doesn't match the listing
+        {'exp_name': 'bbr-20190101T120000', 'path': str(remote_dir.join('bbr-20190101T120000.tar.gz')),
+         'size': 1, 'mtime': 1546300800.0, 'sha256': 'ab'}])
+    manifest = mut.get_remote_manifest(ssh_client, ['*cubic*'], remote_dir=str(remote_dir))
+    assert(sorted(manifest.keys()) == sorted(EXP_NAMES))
+    assert(manifest['cubic-20190101T120000'].sha256 == get_sha256(path))
+    assert(manifest['bbr-20190101T120000'].sha256 is None)
+    assert("-name '*cubic*.tar.gz'" in ssh_client.cmds[0])
+
+def test_sync_experiments(tmpdir, remote_dir, catalog, monkeypatch):
+    local_dir = tmpdir.mkdir('local')
+    ssh_client = FakeSSHClient(str(remote_dir))
+    archives = sync(monkeypatch, ssh_client, local_dir, catalog)
+    assert([os.path.basename(path) for path in archives] ==
+           sorted('{}.tar.gz'.format(exp_name) for exp_name in EXP_NAMES))
+    for exp_name in EXP_NAMES:
+        filename = '{}.tar.gz'.format(exp_name)
+        assert(local_dir.join(filename).read() == remote_dir.join(filename).read())
+        assert(catalog.get(exp_name)['archive_path'] == str(local_dir.join(filename)))
+    # nothing left to copy
+    manifest = mut.get_remote_manifest(ssh_client, ['*'], remote_dir=str(remote_dir))
+    assert(mut.diff_manifest(manifest, catalog, str(local_dir))[1] == [])
+    # changed on the remote machine
+    remote_dir.join('bbr-20190101T120000.tar.gz').write('rerun')
+    manifest = mut.get_remote_manifest(ssh_client, ['*'], remote_dir=str(remote_dir))
+    up_to_date, to_copy = mut.diff_manifest(manifest, catalog, str(local_dir))
+    assert([entry.exp_name for entry in to_copy] == ['bbr-20190101T120000'])
+    assert(len(up_to_date) == 2)
+
+def test_resume_partial_copy(tmpdir, remote_dir, catalog, monkeypatch):
+    local_dir = tmpdir.mkdir('local')
+    filename = 'cubic-20190101T120000.tar.gz'
+    # interrupted copy of the first half
+    data = remote_dir.join(filename).read()
+    local_dir.join(filename + '.part').write(data[:len(data) // 2])
+    sync(monkeypatch, FakeSSHClient(str(remote_dir)), local_dir, catalog)
+    assert(local_dir.join(filename).read() == data)
+    assert(not local_dir.join(filename + '.part').check())
+
+def test_checksum_mismatch(tmpdir, remote_dir, catalog, monkeypatch):
+    local_dir = tmpdir.mkdir('local')
+    path = str(remote_dir.join('cubic-20190101T120000.tar.gz'))
+    ssh_client = FakeSSHClient(str(remote_dir), catalog_entries=[
+        {'exp_name': 'cubic-20190101T120000', 'path': path,
+         'size': os.path.getsize(path), 'mtime': 1546300800.0, 'sha256': '0' * 64}])
+    archives = sync(monkeypatch, ssh_client, local_dir, catalog)
+    assert(len(archives) == len(EXP_NAMES) - 1)
+    assert(not local_dir.join('cubic-20190101T120000.tar.gz').check())
+    assert(catalog.get('cubic-20190101T120000') is None)
+
+def test_filter_manifest():
+    manifest = {exp_name: mut.ManifestEntry(exp_name, '/tmp/{}.tar.gz'.format(exp_name), 1, 0.0, None)
+                for exp_name in ['cubic-20190101T120000', 'cubic-20190103T120000',
+                                 'bbr-20181231T120000', 'bbr-20190102T120000']}
+    assert(mut.filter_manifest(manifest) == manifest)
+    assert(sorted(mut.filter_manifest(manifest, min_date='20190102').keys()) ==
+           ['bbr-20190102T120000', 'cubic-20190103T120000'])
+    assert(sorted(mut.filter_manifest(manifest, remove_duplicates=True).keys()) ==
+           ['bbr-20190102T120000', 'cubic-20190103T120000'])
+    assert(sorted(mut.filter_manifest(manifest, min_date='20190103', remove_duplicates=True).keys()) ==
+           ['cubic-20190103T120000'])
+
+def test_filtered_archives_not_copied(tmpdir, remote_dir, catalog, monkeypatch):
+    local_dir = tmpdir.mkdir('local')
+    # superseded by cubic-20190101T120000
+    remote_dir.join('cubic-20181231T120000.tar.gz').write('old run')
+    ssh_client = FakeSSHClient(str(remote_dir))
+    archives = sync(monkeypatch, ssh_client, local_dir, catalog,
+                    min_date='20190102', remove_duplicates=True)
+    assert([os.path.basename(path) for path in archives] == ['cubic-bbr-20190102T120000.tar.gz'])
+    assert(ssh_client.opened == [str(remote_dir.join('cubic-bbr-20190102T120000.tar.gz'))])
+    assert(sorted(os.listdir(str(local_dir))) == ['cubic-bbr-20190102T120000.tar.gz'])
+    # without min_date only the superseded run is skipped
+    archives = sync(monkeypatch, ssh_client, local_dir, catalog, remove_duplicates=True)
+    assert(not local_dir.join('cubic-20181231T120000.tar.gz').check())
+    assert(len(archives) == len(EXP_NAMES))
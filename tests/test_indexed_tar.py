@@ -0,0 +1,46 @@
+import data_analysis.indexed_tar as mut
+import data_analysis.tar_cache as tar_cache
+import os
+import pytest
+import tarfile
+
+FILES = {'exp.json': b'{"name": "exp"}',
+         'queue-exp.txt': b'0,100,0x15b3,0x0000000a,1448,1,0,1,1\n' * 1000,
+         'empty.txt': b''}
+
+@pytest.fixture
+def tar_filename(tmpdir):
+    for name, data in FILES.items():
+        tmpdir.join(name).write_binary(data)
+    tar_filename = str(tmpdir.join('exp.tar.gz'))
+    mut.main(['-C', str(tmpdir), tar_filename] + list(FILES))
+    return tar_filename
+
+def test_read_as_tarfile(tar_filename):
+    with tarfile.open(tar_filename) as tar:
+        assert(tar.getnames() == list(FILES) + [mut.INDEX_NAME])
+        for name, data in FILES.items():
+            assert(tar.extractfile(name).read() == data)
+
+def test_iter_member(tar_filename):
+    index = mut.read_index(tar_filename)
+    assert(sorted(index) == sorted(FILES))
+    for name, data in FILES.items():
+        assert(b''.join(mut.iter_member(tar_filename, name)) == data)
+    with pytest.raises(KeyError):
+        list(mut.iter_member(tar_filename, 'missing.txt'))
+
+def test_not_indexed(tmpdir):
+    tmpdir.join('exp.json').write_binary(FILES['exp.json'])
+    tar_filename = str(tmpdir.join('exp.tar.gz'))
+    with tarfile.open(tar_filename, 'w:gz') as tar:
+        tar.add(str(tmpdir.join('exp.json')), arcname='exp.json')
+    assert(not mut.is_indexed_tar(tar_filename))
+
+def test_tar_cache_skips_cache(tar_filename, tmpdir):
+    cache = tar_cache.TarCache(str(tmpdir.join('cache')))
+    untar_dir = str(tmpdir.mkdir('untar'))
+    localpath = cache.extract(tar_filename, 'exp.json', untar_dir)
+    with open(localpath, 'rb') as f:
+        assert(f.read() == FILES['exp.json'])
+    assert(cache.evict() == 0)
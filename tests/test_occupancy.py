@@ -0,0 +1,42 @@
+import data_analysis.occupancy as mut
+import numpy as np
+import pandas as pd
+
+SRC = [5555, 5556, 5556, 5555, 5556, 5555]
+DEQUEUED = [False, False, False, True, True, False]
+DROPPED = [False, False, True, False, False, True]
+
+def test_get_occupancy_deltas():
+    deltas = mut.get_occupancy_deltas(DEQUEUED, DROPPED)
+    assert(deltas.tolist() == [1, 1, 0, -1, -1, 0])
+
+def test_get_flow_occupancy():
+    occupancy = mut.get_flow_occupancy(SRC, DEQUEUED, DROPPED)
+    assert(occupancy.columns.tolist() == [5555, 5556])
+    assert(occupancy[5555].tolist() == [1, 1, 1, 0, 0, 0])
+    assert(occupancy[5556].tolist() == [0, 1, 1, 1, 0, 0])
+
+def test_get_flow_occupancy_chunks():
+    ports = [5555, 5556, 5557]
+    expected = mut.get_flow_occupancy(SRC, DEQUEUED, DROPPED, ports=ports)
+    first = mut.get_flow_occupancy(SRC[:3], DEQUEUED[:3], DROPPED[:3], ports=ports)
+    second = mut.get_flow_occupancy(SRC[3:], DEQUEUED[3:], DROPPED[3:], ports=ports,
+                                    initial=first.iloc[-1])
+    occupancy = pd.concat([first, second], ignore_index=True)
+    assert((occupancy.values == expected.values).all())
+    assert(occupancy[5557].tolist() == [0] * len(SRC))
+
+def test_get_flow_occupancy_matches_dummies():
+    rng = np.random.RandomState(0)
+    src = rng.randint(5555, 5555 + 16, size=1000)
+    dequeued = rng.rand(1000) < 0.5
+    dropped = ~dequeued & (rng.rand(1000) < 0.1)
+    df = pd.DataFrame({'src': src, 'dequeued': dequeued, 'dropped': dropped})
+    df_enq = pd.get_dummies(df[(~df.dequeued) & (~df.dropped)]['src']).astype(np.int64)
+    df_deq = -pd.get_dummies(df[df.dequeued]['src']).astype(np.int64)
+    expected = (pd.concat([df_enq, df_deq])
+                .reindex(df.index)
+                .fillna(0)
+                .cumsum())
+    occupancy = mut.get_flow_occupancy(src, dequeued, dropped)
+    assert((occupancy.values == expected[occupancy.columns].values).all())
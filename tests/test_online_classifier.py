@@ -0,0 +1,89 @@
+import data_analysis.online_classifier as mut
+from data_analysis.dtw import dtw_distance
+import numpy as np
+import pandas as pd
+import pytest
+
+def reference_features(times, sizes, queue_size, resample_interval):
+    # compute_flow_features & prediction.resample_dtw on a whole queue log
+    df_queue = pd.Series(sizes, index=pd.to_datetime(times, unit='ns'))
+    df_queue = df_queue.sort_index(kind='mergesort')
+    df_queue = df_queue[~df_queue.index.duplicated(keep='last')] / queue_size
+    resampled = df_queue.ewm(alpha=mut.ALPHA, adjust=False).mean()
+    resampled = resampled.resample('{}ms'.format(resample_interval)).last().ffill()
+    return resampled.round(6).values
+
+def get_events(num_events=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    start = 1542112000 * 10**9
+    times = start + np.cumsum(rng.randint(0, 400000, size=num_events))
+    # written slightly out of order
+    times[1::7], times[2::7] = times[2::7].copy(), times[1::7].copy()
+    sizes = np.abs(np.cumsum(rng.randint(-2, 3, size=num_events)))
+    return pd.DataFrame({'time': times.astype(np.uint64), 'size': sizes})
+
+@pytest.mark.parametrize('chunksize', [1, 50, 3000])
+def test_online_features(chunksize):
+    events = get_events()
+    online_features = mut.OnlineFeatures(64, 35, holdback=10)
+    values = []
+    for start in range(0, len(events), chunksize):
+        values.extend(online_features.update(events[start:start + chunksize]))
+    values.extend(online_features.flush())
+    expected = reference_features(events['time'].values.astype(np.int64),
+                                  events['size'].values, 64, 35)
+    assert(np.allclose(values, expected))
+    assert(online_features.features == values)
+
+def test_incremental_dtw():
+    rng = np.random.RandomState(1)
+    x = rng.rand(30)
+    series = [rng.rand(10), rng.rand(40), rng.rand(1)]
+    incremental = mut.IncrementalDTW(series)
+    for i, value in enumerate(x):
+        incremental.append(value)
+        for y, distance in zip(series, incremental.distances):
+            length = min(i + 1, len(y))
+            assert(np.isclose(distance, dtw_distance(x[:length], y[:length])))
+    assert(not incremental.done)
+    incremental.extend(x[:10])
+    assert(incremental.done)
+
+def test_online_classifier():
+    rng = np.random.RandomState(2)
+    training_flows = {'cubic-10bw-35rtt-32q-local-20181113T122426': np.linspace(0, 1, 200),
+                      'reno-10bw-35rtt-32q-local-20181113T122426': rng.rand(200),
+                      'bbr-10bw-35rtt-32q-local-20181113T122426': np.full(200, 0.5)}
+    classifier = mut.OnlineClassifier(training_flows, 32, 35, margin=0.5,
+                                      patience=0.5, min_duration=1)
+    assert(classifier.patience == 15)
+    assert(classifier.min_samples == 29)
+    confident = False
+    for value in training_flows['bbr-10bw-35rtt-32q-local-20181113T122426']:
+        confident = classifier._add([value])
+        if confident:
+            break
+    assert(confident)
+    results = classifier.results()
+    assert(results['predicted_label'] == 'bbr')
+    assert(results['closest_distance'] == 0)
+    assert(results['num_samples'] < 200)
+    assert(results['closest_exp_name'] == 'bbr-10bw-35rtt-32q-local-20181113T122426')
+
+def test_classify_queue_log(tmpdir):
+    events = get_events(num_events=500)
+    queue_log = str(tmpdir.join('queue-test.txt'))
+    with open(queue_log, 'w') as f:
+        for time, size in zip(events['time'], events['size']):
+            f.write('0,{},0x15b3,0x0000000a,1448,{},0,1,1\n'.format(time, size))
+    expected = reference_features(events['time'].values.astype(np.int64),
+                                  events['size'].values, 32, 35)
+    training_flows = {'cubic-10bw-35rtt-32q-local-20181113T122426': expected,
+                      'reno-10bw-35rtt-32q-local-20181113T122426': expected + 1}
+    classifier = mut.OnlineClassifier(training_flows, 32, 35, margin=2)
+    # margin is never reached, but the whole training flow was seen
+    assert(mut.classify_queue_log(queue_log, classifier, is_running=lambda: False))
+    results = classifier.results()
+    assert(results['predicted_label'] == 'cubic')
+    assert(results['num_samples'] == len(expected))
+    assert(np.isclose(results['closest_distance'], 0))
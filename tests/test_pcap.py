@@ -0,0 +1,142 @@
+import data_analysis.pcap as mut
+import socket
+import struct
+import numpy as np
+import pandas as pd
+import pytest
+
+SERVER = ('192.0.2.1', 5201)
+CLIENT = ('192.0.2.2', 40000)
+SERVER_ISN = 1000
+CLIENT_ISN = 4294967000 # wraps around
+
+def tcp_packet(src, dst, seq, ack, flags, payload_len=0, vlan=False):
+    tcp = struct.pack('!HHIIBBHHH', src[1], dst[1], seq & 0xffffffff,
+                      ack & 0xffffffff, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + payload_len,
+                     0, 0, 64, 6, 0, socket.inet_aton(src[0]),
+                     socket.inet_aton(dst[0]))
+    ethernet = b'\0' * 12
+    if vlan:
+        ethernet += struct.pack('!HH', 0x8100, 1)
+    ethernet += struct.pack('!H', 0x0800)
+    return ethernet + ip + tcp + b'x' * payload_len
+
+def write_pcap(filename, packets, nanoseconds=False):
+    """packets are (time, bytes), written little endian"""
+    magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', magic, 2, 4, 0, 0, 65535, 1))
+        for time, packet in packets:
+            seconds = int(time)
+            frac = round((time - seconds) * (10**9 if nanoseconds else 10**6))
+            f.write(struct.pack('<IIII', seconds, frac, len(packet), len(packet)))
+            f.write(packet)
+
+def get_packets():
+    S, A, F = mut.TCP_SYN, mut.TCP_ACK, mut.TCP_FIN
+    return [
+        (10.0, tcp_packet(CLIENT, SERVER, CLIENT_ISN, 0, S)),
+        (10.1, tcp_packet(SERVER, CLIENT, SERVER_ISN, CLIENT_ISN + 1, S | A)),
+        (10.2, tcp_packet(CLIENT, SERVER, CLIENT_ISN + 1, SERVER_ISN + 1, A)),
+        # data from the server
+        (10.3, tcp_packet(SERVER, CLIENT, SERVER_ISN + 1, CLIENT_ISN + 1, A, 100)),
+        (10.31, tcp_packet(SERVER, CLIENT, SERVER_ISN + 101, CLIENT_ISN + 1, A, 100)),
+        # 201-301 never captured
+        (10.32, tcp_packet(SERVER, CLIENT, SERVER_ISN + 301, CLIENT_ISN + 1, A, 100)),
+        (10.4, tcp_packet(CLIENT, SERVER, CLIENT_ISN + 1, SERVER_ISN + 201, A)),
+        # duplicate ack
+        (10.41, tcp_packet(CLIENT, SERVER, CLIENT_ISN + 1, SERVER_ISN + 201, A)),
+        # retransmission of the lost segment long after
+        (10.5, tcp_packet(SERVER, CLIENT, SERVER_ISN + 201, CLIENT_ISN + 1, A, 100)),
+        # arrives right after the retransmission, out of order
+        (10.501, tcp_packet(SERVER, CLIENT, SERVER_ISN + 101, CLIENT_ISN + 1, A, 100)),
+        (10.6, tcp_packet(CLIENT, SERVER, CLIENT_ISN + 1, SERVER_ISN + 401, A)),
+        (10.7, tcp_packet(SERVER, CLIENT, SERVER_ISN + 401, CLIENT_ISN + 1, F | A)),
+        # arp request, not TCP
+        (10.8, b'\xff' * 12 + b'\x08\x06' + b'\0' * 28),
+        (10.9, tcp_packet(CLIENT, SERVER, CLIENT_ISN + 1, SERVER_ISN + 402, A, vlan=True)),
+    ]
+
+@pytest.fixture(params=[False, True], ids=['us', 'ns'])
+def pcap(tmpdir, request):
+    filename = str(tmpdir.join('server-tcpdump.pcap'))
+    write_pcap(filename, get_packets(), nanoseconds=request.param)
+    return filename
+
+def test_analyze_pcap(pcap):
+    df = mut.analyze_pcap(pcap)
+    assert(list(df.columns) == mut.PCAP_COLUMNS)
+    assert(len(df) == len(get_packets()))
+    assert(np.allclose(df['time_relative'], [time - 10 for time, _ in get_packets()]))
+    assert(df['is_tcp'].tolist() == [True] * 12 + [False, True])
+    tcp = df[df['is_tcp']]
+    assert((tcp['stream'] == 0).all())
+    assert(df['stream'].iloc[12] == -1)
+    server = tcp[tcp['src'] == SERVER[0]]
+    assert((server['srcport'] == SERVER[1]).all())
+    assert(server['seq'].tolist() == [0, 1, 101, 301, 201, 101, 401])
+    assert(server['tcp_len'].tolist() == [0, 100, 100, 100, 100, 100, 0])
+    client = tcp[tcp['src'] == CLIENT[0]]
+    assert(client['seq'].tolist() == [0, 1, 1, 1, 1, 1])
+    assert(client['ack'].tolist() == [0, 1, 201, 201, 401, 402])
+    assert(df.index[df['lost_segment']].tolist() == [5])
+    assert(df.index[df['retransmission']].tolist() == [8])
+    assert(df.index[df['out_of_order']].tolist() == [9])
+    ack_rtt = df['ack_rtt'].dropna()
+    # acks of SYN, SYN/ACK, 101-201 (not the later out of order copy), 301-401 & FIN
+    assert(ack_rtt.index.tolist() == [1, 2, 6, 10, 13])
+    assert(np.allclose(ack_rtt, [0.1, 0.1, 0.09, 0.28, 0.2]))
+    assert(np.allclose(df.loc[[0, 13], 'tcp_time_relative'], [0, 0.9]))
+
+def test_pcap_summary(pcap):
+    df = mut.analyze_pcap(pcap)
+    summary = mut.get_pcap_summary(df)
+    num_bytes = sum(len(packet) for _, packet in get_packets())
+    assert(np.isclose(summary['data_bit_rate'], num_bytes * 8 / 0.9))
+    assert(summary['retransmission'] == 1)
+    assert(summary['out_of_order'] == 1)
+    assert(summary['lost_segment'] == 1)
+
+def test_pcap_logs(pcap, tmpdir):
+    rtt_log = str(tmpdir.join('rtt.txt'))
+    capinfos_log = str(tmpdir.join('capinfos.txt'))
+    assert(mut.main([pcap, '--rtt', rtt_log, '--capinfos', capinfos_log]) == 0)
+    df_rtt = pd.read_csv(rtt_log, sep='\t', header=None)
+    assert(len(df_rtt) == len(get_packets()))
+    assert(df_rtt[1].notnull().sum() == 5)
+    with open(capinfos_log) as f:
+        lines = f.read().split('\n')
+    assert(lines[0] == 'File name,Data bit rate (bits/sec)')
+    assert(lines[1].startswith(pcap + ','))
+    num_bytes = sum(len(packet) for _, packet in get_packets())
+    assert(np.isclose(float(lines[1].split(',')[-1]), num_bytes * 8 / 0.9))
+
+def test_stream_log(pcap, tmpdir):
+    df = mut.analyze_pcap(pcap)
+    stream_log = str(tmpdir.join('exp.tshark'))
+    mut.write_stream_log(df, stream_log, ports=[SERVER[1]])
+    df_stream = pd.read_csv(stream_log, header=None,
+                            names=['stream', 'src', 'srcport', 'dst', 'dstport',
+                                   'time_relative', 'len', 'time'])
+    assert(len(df_stream) == 13)
+    assert((df_stream['stream'] == 0).all())
+    assert(df_stream['len'].sum() == 500)
+    mut.write_stream_log(df, stream_log, ports=[80])
+    with open(stream_log) as f:
+        assert(f.read() == '')
+
+def test_not_a_pcap(tmpdir):
+    filename = str(tmpdir.join('capture.pcapng'))
+    with open(filename, 'wb') as f:
+        f.write(b'\x0a\x0d\x0d\x0a' + b'\0' * 60)
+    with pytest.raises(ValueError):
+        mut.analyze_pcap(filename)
+
+def test_truncated_pcap(tmpdir):
+    filename = str(tmpdir.join('server-tcpdump.pcap'))
+    write_pcap(filename, get_packets())
+    with open(filename, 'rb+') as f:
+        f.truncate(f.seek(0, 2) - 10)
+    df = mut.analyze_pcap(filename)
+    assert(len(df) == len(get_packets()) - 1)
@@ -0,0 +1,29 @@
+import subprocess
+import threading
+
+import cctestbed_pipeline as mut
+
+def test_pipeline_postprocess(tmpdir):
+    postprocess_cmd = 'touch {}/{{exp_name}}.done'.format(tmpdir)
+    with mut.ExperimentPipeline(postprocess_cmd=postprocess_cmd) as pipeline:
+        pipeline.submit(subprocess.Popen(['true']), 'exp-ok')
+        pipeline.submit(subprocess.Popen(['false']), 'exp-fail')
+    assert(tmpdir.join('exp-ok.done').check())
+    assert(not tmpdir.join('exp-fail.done').check())
+    assert(pipeline.failed == ['exp-fail'])
+
+def test_pipeline_backpressure():
+    pipeline = mut.ExperimentPipeline(workers=1, max_pending=1)
+    proc = subprocess.Popen(['sleep', '0.5'])
+    pipeline.submit(proc)
+    submitted = threading.Event()
+    thread = threading.Thread(
+        target=lambda: (pipeline.submit(subprocess.Popen(['true'])),
+                        submitted.set()))
+    thread.start()
+    # second submit has to wait for the first experiment to finish
+    assert(not submitted.wait(0.2))
+    assert(submitted.wait(5))
+    assert(proc.returncode == 0)
+    thread.join()
+    pipeline.join()
@@ -0,0 +1,84 @@
+import data_analysis.queue_log as mut
+import numpy as np
+import pandas as pd
+import pytest
+
+QUEUE_LOG = ('0,100,0x15b3,0x0000000a,1448,1,0,1,1\n'
+             'I0101 12:00:00.000000 bessd.cc:1] garbage from glog\n'
+             '1,300,0x15b3,0x0000000a,1448,0,0,1,1\n'
+             '0,200,0x15b4,0x0000000b,1448,2,0,1,1\n'
+             '0,250,0x15b4,0x0000000c,1448,2,1,1,1\n'
+             '0,400,0x15b3\n'
+             '\n'
+             '1,500,0x15b4,0x0000000b,1448,0,0,1,1\n')
+
+@pytest.fixture
+def queue_log(tmpdir):
+    queue_log = tmpdir.join('queue-test.txt')
+    queue_log.write(QUEUE_LOG)
+    return str(queue_log)
+
+def test_parse_hex():
+    parsed, invalid = mut.parse_hex(['0x15b3', '15B3', '0xzz', '0x123456'], 4)
+    assert(parsed.tolist() == [5555, 5555, 0, 0])
+    assert(invalid.tolist() == [False, False, True, True])
+
+def test_get_queue_log_ports(queue_log):
+    assert(mut.get_queue_log_ports(queue_log) == [5555, 5556])
+
+@pytest.mark.parametrize('chunksize', [2, 3, 100])
+def test_read_queue_log(queue_log, chunksize):
+    df = pd.concat(list(mut.read_queue_log(queue_log, chunksize=chunksize,
+                                           holdback=2)))
+    assert(df['time'].tolist() == [100, 200, 250, 300, 500])
+    assert(df['lineno'].tolist() == [1, 2, 3, 4, 5])
+    assert(df['src'].tolist() == [5555, 5556, 5556, 5555, 5556])
+
+@pytest.fixture
+def binary_queue_log(tmpdir):
+    header = np.zeros(1, dtype=mut.QUEUE_LOG_HEADER_DTYPE)
+    header['magic'] = mut.QUEUE_LOG_MAGIC
+    header['version'] = mut.QUEUE_LOG_VERSION
+    header['record_size'] = mut.QUEUE_LOG_RECORD_DTYPE.itemsize
+    # last record was never written, like after bessd is killed
+    records = np.zeros(6, dtype=mut.QUEUE_LOG_RECORD_DTYPE)
+    records['time'][:5] = [100, 200, 250, 300, 500]
+    records['port'][:5] = [5555, 5556, 5556, 5555, 5556]
+    records['qsize'][:5] = [1, 2, 2, 0, 0]
+    records['flags'][:5] = [0, 0, mut.QUEUE_LOG_DROPPED, mut.QUEUE_LOG_DEQUEUED,
+                            mut.QUEUE_LOG_DEQUEUED | mut.QUEUE_LOG_FIN]
+    queue_log = str(tmpdir.join('queue-test.bin'))
+    with open(queue_log, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+    return queue_log
+
+def test_read_binary_queue_log(queue_log, binary_queue_log):
+    assert(not mut.is_binary_queue_log(queue_log))
+    assert(mut.is_binary_queue_log(binary_queue_log))
+    assert(len(mut.read_binary_queue_log(binary_queue_log)) == 5)
+    assert(mut.get_queue_log_ports(binary_queue_log) == [5555, 5556])
+    df = pd.concat(list(mut.read_queue_log(binary_queue_log, chunksize=2,
+                                           holdback=2)))
+    assert(df['time'].tolist() == [100, 200, 250, 300, 500])
+    assert(df['dequeued'].tolist() == [False, False, False, True, True])
+    assert(df['dropped'].tolist() == [False, False, True, False, False])
+    assert(df['lineno'].tolist() == [1, 2, 3, 4, 5])
+
+def test_queue_log_tail(tmpdir, binary_queue_log):
+    queue_log = str(tmpdir.join('queue-tail.txt'))
+    tail = mut.QueueLogTail(queue_log)
+    assert(len(tail.read()) == 0)
+    lines = QUEUE_LOG.split('\n')
+    with open(queue_log, 'w') as f:
+        # last line is only partly written
+        f.write('\n'.join(lines[:3]) + '\n' + lines[3][:10])
+    assert(tail.read()['time'].tolist() == [100, 300])
+    with open(queue_log, 'a') as f:
+        f.write(lines[3][10:] + '\n' + '\n'.join(lines[4:]))
+    assert(tail.read()['time'].tolist() == [200, 250, 500])
+    assert(len(tail.read()) == 0)
+
+    tail = mut.QueueLogTail(binary_queue_log)
+    assert(tail.read()['time'].tolist() == [100, 200, 250, 300, 500])
+    assert(len(tail.read()) == 0)
@@ -0,0 +1,50 @@
+import data_analysis.queue_store as mut
+from data_analysis.queue_log import store_queue_log
+from tests.test_queue_log import QUEUE_LOG
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('tables')
+
+@pytest.fixture(params=[mut.HDF, mut.PARQUET])
+def queue_store(tmpdir, request, monkeypatch):
+    monkeypatch.setattr(mut, 'QUEUE_STORE_BACKEND', request.param)
+    queue_log = tmpdir.join('queue-test.txt')
+    queue_log.write(QUEUE_LOG)
+    queue_store = str(tmpdir.join('queue-test.h5'))
+    store_queue_log(str(queue_log), queue_store)
+    assert(mut.get_queue_store_backend(queue_store) == request.param)
+    return queue_store
+
+def test_select(queue_store):
+    with mut.open_queue_store(queue_store) as store:
+        df = store.select('df_queue')
+        dequeued = store.select('df_queue',
+                                where='dequeued=1 & (src=5555 | src=5556)',
+                                columns=['src', 'datalen'])
+        flow = store.select('df_queue', where='src=5555', columns=[5555])
+    assert(df.index.name == 'time')
+    assert(len(df) == 5)
+    assert(dequeued.columns.tolist() == ['src', 'datalen'])
+    assert(dequeued['src'].tolist() == [5555, 5556])
+    assert(flow.columns.tolist() == [5555])
+    assert(flow[5555].tolist() == [1, 0])
+
+def test_put_get(queue_store):
+    goodput = pd.Series([1.5, 2.5], index=['cubic', 'bbr'])
+    with mut.open_queue_store(queue_store, mode='a') as store:
+        with pytest.raises(KeyError):
+            store.get('df_goodput_total')
+        store.put(key='df_goodput_total', value=goodput, format='fixed')
+    with mut.open_queue_store(queue_store) as store:
+        assert(store.get('df_goodput_total').equals(goodput))
+
+def test_parse_where_errors():
+    pa = pytest.importorskip('pyarrow')
+    schema = pa.schema([('src', pa.uint16()), ('dequeued', pa.bool_())])
+    mut.parse_where('dequeued=1 & ~(src=5555)', schema)
+    with pytest.raises(ValueError):
+        mut.parse_where('index > Timestamp("2018")', schema)
+    with pytest.raises(ValueError):
+        mut.parse_where('src=5555 &', schema)
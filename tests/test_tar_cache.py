@@ -0,0 +1,88 @@
+import data_analysis.tar_cache as mut
+import io
+import os
+import pytest
+import tarfile
+
+@pytest.fixture
+def tar_filename(tmpdir):
+    tar_filename = str(tmpdir.join('exp.tar.gz'))
+    with tarfile.open(tar_filename, 'w:gz') as tar:
+        for name, data in [('queue-exp.txt', b'0,100,0x15b3\n'),
+                           ('exp.json', b'{}'),
+                           ('data-raw/ping-exp.txt', b'0,100,0x15b3\n')]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return tar_filename
+
+@pytest.fixture
+def cache(tmpdir):
+    return mut.TarCache(str(tmpdir.join('cache')), budget=1024)
+
+def test_extract(cache, tar_filename, tmpdir, monkeypatch):
+    untar_dir = str(tmpdir.mkdir('untar'))
+    localpath = cache.extract(tar_filename, 'queue-exp.txt', untar_dir)
+    assert(localpath == os.path.join(untar_dir, 'queue-exp.txt'))
+    with open(localpath, 'rb') as f:
+        assert(f.read() == b'0,100,0x15b3\n')
+    # every member was unpacked in the first pass
+    def fail(*args, **kwargs):
+        raise AssertionError('archive unpacked twice')
+    monkeypatch.setattr(mut.tarfile, 'open', fail)
+    localpath = cache.extract(tar_filename, 'data-raw/ping-exp.txt', untar_dir,
+                              strip_components=1)
+    assert(localpath == os.path.join(untar_dir, 'ping-exp.txt'))
+    # members with the same contents are only stored once
+    assert(cache.evict() == len(b'0,100,0x15b3\n') + len(b'{}'))
+    with pytest.raises(KeyError):
+        cache.get(tar_filename, 'missing.txt')
+
+def test_evict(cache, tar_filename):
+    queue_log = cache.get(tar_filename, 'queue-exp.txt')
+    description = cache.get(tar_filename, 'exp.json')
+    os.utime(queue_log, (0, 0))
+    cache.budget = 2
+    cache.evict()
+    assert(not os.path.exists(queue_log))
+    assert(os.path.exists(description))
+    # evicted member is unpacked again when needed
+    assert(os.path.exists(cache.get(tar_filename, 'queue-exp.txt')))
+
+def test_main(tar_filename, tmpdir, monkeypatch):
+    monkeypatch.setattr(mut, '_tar_cache', mut.TarCache(str(tmpdir.join('cache'))))
+    untar_dir = str(tmpdir.mkdir('untar'))
+    assert(mut.main(['-C', untar_dir, tar_filename, 'exp.json']) == 0)
+    assert(os.path.isfile(os.path.join(untar_dir, 'exp.json')))
+    assert(mut.main(['-C', untar_dir, tar_filename, 'missing.txt']) != 0)
+
+def test_corrupt_archive(cache, tar_filename, tmpdir, monkeypatch):
+    with open(tar_filename, 'rb') as f:
+        data = f.read()
+    truncated = str(tmpdir.join('truncated.tar.gz'))
+    with open(truncated, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    not_tar = str(tmpdir.join('not-tar.tar.gz'))
+    with open(not_tar, 'w') as f:
+        f.write('not a tarball')
+    for filename in [truncated, not_tar, str(tmpdir.join('missing.tar.gz'))]:
+        with pytest.raises(mut.EXTRACT_ERRORS):
+            cache.get(filename, 'queue-exp.txt')
+    monkeypatch.setattr(mut, '_tar_cache', cache)
+    assert(mut.main(['-C', str(tmpdir), not_tar, 'queue-exp.txt']) == 2)
+
+def test_evicted_while_used(cache, tar_filename, monkeypatch):
+    index = cache.index
+    def index_then_evict(tar_filename):
+        # another job evicts the member right after its index is read
+        paths = index(tar_filename)
+        if not evicted:
+            os.remove(paths['queue-exp.txt'])
+            evicted.append(True)
+        return paths
+    evicted = []
+    monkeypatch.setattr(cache, 'index', index_then_evict)
+    path = cache.get(tar_filename, 'queue-exp.txt')
+    assert(evicted)
+    with open(path, 'rb') as f:
+        assert(f.read() == b'0,100,0x15b3\n')
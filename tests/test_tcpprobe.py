@@ -0,0 +1,128 @@
+import data_analysis.tcpprobe as mut
+import data_analysis.queue_store as queue_store
+import socket
+import struct
+import numpy as np
+import pandas as pd
+import pytest
+
+# time, sender, receiver, length, snd_nxt, snd_una, cwnd, ssthresh, snd_wnd,
+# srtt, rcv_wnd, bbr_bw_lo, bbr_bw_hi, bbr_min_rtt, bbr_pacing_gain, bbr_cwnd_gain
+TCPPROBE_EVENTS = [
+    (0.000012345, ('192.0.0.1', 5201), ('192.0.0.4', 40000), 52, 0x1a2b, 0x1a00,
+     10, 2147483647, 29200, 35012, 65483, 0, 0, 0, 0, 0),
+    (0.5, ('192.0.0.1', 5201), ('192.0.0.4', 40000), 52, 0xffffff00, 0x0,
+     24, 20, 29200, 36000, 65483, 1200, 0, 35000, 739, 512),
+    (1.25, ('192.0.0.1', 5202), ('192.0.0.2', 40001), 1500, 0x10, 0x8,
+     2, 7, 1000, 40000, 65483, 5, 1, 35000, 256, 512),
+]
+
+def write_binary_log(filename, events, truncate=0):
+    records = np.zeros(len(events), dtype=mut.TCPPROBE_RECORD_DTYPE)
+    for record, event in zip(records, events):
+        (time, (saddr, sport), (daddr, dport), length, snd_nxt, snd_una,
+         cwnd, ssthresh, snd_wnd, srtt, rcv_wnd, *bbr) = event
+        record['tstamp_ns'] = round(time * 10**9)
+        record['saddr'] = struct.unpack('!I', socket.inet_aton(saddr))[0]
+        record['daddr'] = struct.unpack('!I', socket.inet_aton(daddr))[0]
+        record['sport'] = sport
+        record['dport'] = dport
+        record['family'] = mut.AF_INET
+        record['length'] = length
+        for field, value in zip(['snd_nxt', 'snd_una', 'snd_cwnd', 'ssthresh',
+                                 'snd_wnd', 'srtt', 'rcv_wnd', 'bbr_bw_lo',
+                                 'bbr_bw_hi', 'bbr_min_rtt', 'bbr_pacing_gain',
+                                 'bbr_cwnd_gain'],
+                                [snd_nxt, snd_una, cwnd, ssthresh, snd_wnd,
+                                 srtt, rcv_wnd] + bbr):
+            record[field] = value
+    data = records.tobytes()
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<8sII', mut.TCPPROBE_MAGIC, mut.TCPPROBE_VERSION,
+                            mut.TCPPROBE_RECORD_DTYPE.itemsize))
+        f.write(data[:len(data) - truncate])
+
+def write_text_log(filename, events):
+    # same format as tcpprobe_sprint, %#x writes 0 without the 0x
+    def hex(value):
+        return '{:#x}'.format(value) if value else '0'
+    with open(filename, 'w') as f:
+        for event in events:
+            (time, sender, receiver, length, snd_nxt, snd_una, *rest) = event
+            seconds = int(time)
+            f.write('{}.{:09d} {}:{} {}:{} {} {} {} {}\n'.format(
+                seconds, round((time - seconds) * 10**9), sender[0], sender[1],
+                receiver[0], receiver[1], length, hex(snd_nxt), hex(snd_una),
+                ' '.join(str(value) for value in rest)))
+
+def test_record_size():
+    # sizeof(struct tcp_log_record) in tcp_probe_ray.c
+    assert(mut.TCPPROBE_RECORD_DTYPE.itemsize == 72)
+
+def test_read_binary_tcpprobe(tmpdir):
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    write_binary_log(filename, TCPPROBE_EVENTS)
+    assert(mut.is_binary_tcpprobe_log(filename))
+    records = mut.read_tcpprobe_records(filename)
+    assert(len(records) == len(TCPPROBE_EVENTS))
+    assert(records['snd_cwnd'].tolist() == [10, 24, 2])
+    df = mut.read_tcpprobe(filename)
+    assert(list(df.columns) == mut.TCPPROBE_COLUMNS)
+    assert(mut.format_endpoints(df['sender']).tolist() ==
+           ['192.0.0.1:5201', '192.0.0.1:5201', '192.0.0.1:5202'])
+    assert(mut.format_endpoints(df['receiver']).tolist() ==
+           ['192.0.0.4:40000', '192.0.0.4:40000', '192.0.0.2:40001'])
+    assert(df['sender'].iloc[2] == mut.get_endpoint('192.0.0.1', 5202))
+    assert(mut.get_endpoint_port(df['sender']).tolist() == [5201, 5201, 5202])
+    assert(df['time'].tolist() == [pd.Timedelta(12345, unit='ns'),
+                                   pd.Timedelta(0.5, unit='s'),
+                                   pd.Timedelta(1.25, unit='s')])
+    assert(df['next'].tolist() == [0x1a2b, 0xffffff00, 0x10])
+    assert(df['bbr_pacing_gain'].tolist() == [0, 739, 256])
+
+def test_binary_and_text_logs_match(tmpdir):
+    binary_log = str(tmpdir.join('tcpprobe.bin'))
+    text_log = str(tmpdir.join('tcpprobe.txt'))
+    write_binary_log(binary_log, TCPPROBE_EVENTS)
+    write_text_log(text_log, TCPPROBE_EVENTS)
+    assert(not mut.is_binary_tcpprobe_log(text_log))
+    pd.testing.assert_frame_equal(mut.read_tcpprobe(binary_log),
+                                  mut.read_tcpprobe(text_log))
+
+def test_truncated_binary_tcpprobe(tmpdir):
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    write_binary_log(filename, TCPPROBE_EVENTS, truncate=10)
+    assert(len(mut.read_tcpprobe(filename)) == len(TCPPROBE_EVENTS) - 1)
+    write_binary_log(filename, [])
+    assert(len(mut.read_tcpprobe(filename)) == 0)
+
+def test_wrong_record_size(tmpdir):
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<8sII', mut.TCPPROBE_MAGIC, mut.TCPPROBE_VERSION, 64))
+    with pytest.raises(ValueError):
+        mut.read_tcpprobe_records(filename)
+
+def test_process_tcpprobe(tmpdir):
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    write_binary_log(filename, TCPPROBE_EVENTS)
+    df = mut.process_tcpprobe(mut.read_tcpprobe(filename),
+                              senders=[mut.get_endpoint('192.0.0.1', 5201)])
+    assert(df.index.name == 'time')
+    assert(len(df) == 2)
+    assert(df['bbr_bw_lo'].tolist() == [0, 1200 * 715 / 1e6])
+    assert(df['bbr_pacing_gain'].tolist() == [0, 739 / 256])
+    assert(df['srtt'].tolist() == [35.012, 36.0])
+
+@pytest.mark.parametrize('backend', ['hdf', 'parquet'])
+def test_store_tcpprobe(tmpdir, monkeypatch, backend):
+    monkeypatch.setattr(queue_store, 'QUEUE_STORE_BACKEND', backend)
+    filename = str(tmpdir.join('tcpprobe.bin'))
+    write_binary_log(filename, TCPPROBE_EVENTS)
+    df = mut.process_tcpprobe(mut.read_tcpprobe(filename))
+    store_path = str(tmpdir.join('tcpprobe.h5'))
+    mut.store_tcpprobe(df, store_path)
+    df_cached = mut.load_tcpprobe(store_path)
+    assert(df_cached['sender'].dtype == np.int64)
+    pd.testing.assert_frame_equal(df, df_cached, check_index_type=False)
+    assert(df_cached.index.tolist() == df.index.tolist())
@@ -0,0 +1,70 @@
+import data_analysis.training_library as mut
+import json
+import os
+import numpy as np
+import pytest
+
+TRAINING_EXPS = {'cubic-5bw-35rtt-16q-local-20181113T122426': [0.1, 0.5, 0.25],
+                 'bbr-5bw-35rtt-16q-local-20181113T122426': [0.0, 1.0],
+                 # older run of the same network condition & ccalg
+                 'bbr-5bw-35rtt-16q-local-20181101T100000': [0.5],
+                 'reno-10bw-85rtt-128q-local-20181113T122426': [0.75, 0.5, 0.25, 0.0]}
+
+@pytest.fixture
+def training_dir(tmpdir):
+    for exp_name, features in TRAINING_EXPS.items():
+        with open(str(tmpdir.join(exp_name + '.features')), 'w') as f:
+            f.write('queue_occupancy\n')
+            f.write(''.join('{}\n'.format(value) for value in features))
+        with open(str(tmpdir.join(exp_name + '.metadata')), 'w') as f:
+            json.dump({'bw_measured': len(features)}, f)
+    tmpdir.join('notes.features').write('queue_occupancy\n1\n')
+    return str(tmpdir)
+
+def test_training_library(training_dir):
+    library = mut.TrainingLibrary(mut.build_training_library(training_dir))
+    assert(len(library) == len(TRAINING_EXPS))
+    for exp_name, features in TRAINING_EXPS.items():
+        assert(np.array_equal(library.features(exp_name), features))
+        assert(library.metadata(exp_name) == {'bw_measured': len(features)})
+    assert(sorted(library.get_exp_names(5, 35, 16)) == sorted(
+        exp_name for exp_name in TRAINING_EXPS if '5bw-35rtt-16q' in exp_name))
+    assert(library.get_exp_names(15, 35, 64) == [])
+    assert(library.get_exp_name('bbr', 5, 35, 16)
+           == 'bbr-5bw-35rtt-16q-local-20181113T122426')
+    with pytest.raises(KeyError):
+        library.get_exp_name('vegas', 5, 35, 16)
+
+def test_load_training_library(training_dir, monkeypatch):
+    monkeypatch.setattr(mut, '_training_libraries', {})
+    library = mut.load_training_library(training_dir)
+    assert(os.path.isfile(library.library_filename))
+    assert(mut.load_training_library(training_dir) is library)
+    assert(not mut._is_stale(library.library_filename, training_dir))
+    with open(os.path.join(training_dir, 'vegas-5bw-35rtt-16q-local-20181113T122426.features'), 'w') as f:
+        f.write('queue_occupancy\n0.5\n')
+    os.utime(training_dir, (os.stat(library.library_filename).st_mtime + 1,) * 2)
+    assert(mut._is_stale(library.library_filename, training_dir))
+    monkeypatch.setattr(mut, '_training_libraries', {})
+    assert(len(mut.load_training_library(training_dir)) == len(TRAINING_EXPS) + 1)
+
+def test_is_stale_rewritten_file(training_dir, monkeypatch):
+    monkeypatch.setattr(mut, '_training_libraries', {})
+    library = mut.load_training_library(training_dir)
+    library_mtime = os.stat(library.library_filename).st_mtime
+    os.utime(training_dir, (library_mtime - 1,) * 2)
+    features_filename = os.path.join(
+        training_dir, 'bbr-5bw-35rtt-16q-local-20181113T122426.features')
+    # rewritten in place, which leaves the directory's mtime alone
+    with open(features_filename, 'r+') as f:
+        f.write(f.read())
+    os.utime(features_filename, (library_mtime + 1,) * 2)
+    assert(os.stat(training_dir).st_mtime < library_mtime)
+    assert(mut._is_stale(library.library_filename, training_dir))
+
+def test_not_a_training_library(tmpdir):
+    filename = str(tmpdir.join('training-library.bin'))
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        mut.TrainingLibrary(filename)